@@ -1,11 +1,24 @@
 import storage
 import cc25xx_ui
 
+try:
+    # Data channel for images streamed by send_image.py
+    import usb_cdc
+    usb_cdc.enable(console=True, data=True)
+except ImportError:
+    pass
+
 FS = storage.getmount("/")
 
 cc25xx_ui.check_storage_on_boot()
 
 #if False:
-if cc25xx_ui.need_read() or cc25xx_ui.need_write():
+if cc25xx_ui.need_production() and cc25xx_ui.image_cache_fresh():
+    # Nothing is written by the flasher, the drive stays with the host
+    # Removing control.production reloads into the normal mode
+    # Without the image cache it is built first, with the drive disabled
+    pass
+elif cc25xx_ui.need_read() or cc25xx_ui.need_read_ranges() or cc25xx_ui.need_write() \
+        or cc25xx_ui.stale_image_cache():
     storage.disable_usb_drive()
     storage.remount("/", readonly=False)
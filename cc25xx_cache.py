@@ -0,0 +1,173 @@
+from array import array
+import binascii
+
+def image_key(fs, image):
+    # Size and CRC32 of the image file, the cache is valid for this only
+    buf = bytearray(1024)
+    view = memoryview(buf)
+    size = 0
+    crc = 0
+    with fs.open(image, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            crc = binascii.crc32(view[:n], crc)
+            size += n
+    return "%d %08X" % (size, crc)
+
+def read_manifest(fs, path):
+    # (first line, page lines) of the manifest split in words, None if there is none
+    try:
+        with fs.open(path + ".manifest", "r") as f:
+            lines = f.read().split("\n")
+    except OSError:
+        return None
+    return (lines[0].split(), [x for x in lines[1:] if x])
+
+def matches(fs, image, header):
+    # Manifest first line is of this image: same size and modification time,
+    # or else the same CRC32, which takes reading all of it
+    stat = fs.stat(image)
+    if len(header) < 3 or header[0] != str(stat[6]):
+        return False
+    if header[3:] == [str(stat[8])]:
+        return True
+    return " ".join(header[:2]) == image_key(fs, image)
+
+def fresh(fs, image, path):
+    # Cache at path was built from this image, for whatever page size
+    manifest = read_manifest(fs, path)
+    return bool(manifest) and matches(fs, image, manifest[0])
+
+class ImageCache:
+    """Image reader that goes through a cache of the image, once it is built
+
+    The cache is two files: path.pages is the image as whole flash pages,
+    path.manifest has the size and CRC32 of the image file, the page size and
+    the modification time of the file on the first line, then a line per
+    page: its CRC16 as calculated by the chip, or "-" for a page the image
+    has no data for.
+    Until use_page_size() the source reader is used as is. It builds the cache
+    unless it is there already; on a read-only filesystem the source stays.
+    """
+    f = None
+    addr = 0
+
+    def __init__(self, fs, image, source, path):
+        self.fs = fs
+        self.image = image
+        self.source = source
+        self.path = path
+        # CRC16 of each page, -1 for no data; None while the source is used
+        self.crcs = None
+        self.page_size = 0
+        # image_key() once the cache is used
+        self.key = None
+
+    def use_page_size(self, page_size):
+        """Switch to the cache for pages of this size, True if it is used"""
+        if self.crcs is not None and self.page_size == page_size:
+            return True
+        manifest = read_manifest(self.fs, self.path)
+        if not manifest or manifest[0][2:3] != [str(page_size)] or \
+                not matches(self.fs, self.image, manifest[0]):
+            print("Building image cache")
+            try:
+                manifest = self.build(page_size)
+            except OSError:
+                # Read-only filesystem
+                return False
+        (header, pages) = manifest
+        self.close_cache()
+        self.f = self.fs.open(self.path + ".pages", "rb")
+        self.crcs = array("l", [-1 if x == "-" else int(x, 16) for x in pages])
+        self.page_size = page_size
+        self.key = " ".join(header[:2])
+        self.addr = 0
+        return True
+
+    def build(self, page_size):
+        # One pass over the source for both files, the manifest goes last,
+        # so a build cut short is never used
+        from cc25xx_proto import crc16
+        try:
+            self.fs.remove(self.path + ".manifest")
+        except OSError:
+            pass
+        buf = bytearray(page_size)
+        blank = b"\xff" * page_size
+        # Time first: a file changed while it is read does not match later
+        mtime = self.fs.stat(self.image)[8]
+        header = ("%s %d %d" % (image_key(self.fs, self.image), page_size, mtime)).split()
+        pages = []
+        has_data = getattr(self.source, "has_data", None)
+        self.source.seek(0)
+        addr = 0
+        try:
+            with self.fs.open(self.path + ".pages", "wb") as out:
+                while True:
+                    n = self.source.readinto(buf)
+                    if not n:
+                        break
+                    buf[n:] = blank[n:]
+                    if has_data and not has_data(addr, addr + page_size):
+                        pages.append("-")
+                    else:
+                        pages.append("%04X" % crc16(buf))
+                    # Last page as short as the image, so reads tell its end
+                    out.write(buf if n == page_size else memoryview(buf)[:n])
+                    addr += page_size
+            with self.fs.open(self.path + ".manifest", "w") as f:
+                f.write(" ".join(header) + "\n" + "\n".join(pages) + "\n")
+        except OSError:
+            # E.g. drive full: nothing half written is left behind
+            for name in (self.path + ".manifest", self.path + ".pages"):
+                try:
+                    self.fs.remove(name)
+                except OSError:
+                    pass
+            raise
+        finally:
+            # The source is used from its start if the cache is not
+            self.source.seek(0)
+        return (header, pages)
+
+    def page_crc(self, addr):
+        # CRC16 of the page at addr, None without the cache
+        if self.crcs is None:
+            return None
+        return self.crcs[addr // self.page_size]
+
+    def has_data(self, start, end):
+        if self.crcs is None:
+            return self.source.has_data(start, end)
+        first = start // self.page_size
+        last = min((end - 1) // self.page_size + 1, len(self.crcs))
+        for i in range(first, last):
+            if self.crcs[i] >= 0:
+                return True
+        return False
+
+    def seek(self, addr):
+        self.addr = addr
+        if self.crcs is None:
+            self.source.seek(addr)
+        else:
+            self.f.seek(addr)
+
+    def readinto(self, buffer):
+        if self.crcs is None:
+            return self.source.readinto(buffer)
+        n = self.f.readinto(buffer) or 0
+        self.addr += n
+        return n
+
+    def close_cache(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def close(self):
+        self.close_cache()
+        self.source.close()
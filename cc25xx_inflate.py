@@ -0,0 +1,102 @@
+import struct
+
+def supported():
+    """Whether this firmware can decompress gzip: CircuitPython 8 can not"""
+    try:
+        import deflate
+        return True
+    except ImportError:
+        pass
+    try:
+        import zlib
+        return hasattr(zlib, "decompressobj")
+    except ImportError:
+        return False
+
+class InflateReader:
+    """Gzip file decompressed on the fly
+
+    RAM use is the deflate window, 2**window_bits bytes, and a buffer of
+    bufsize for compressed input. gzip itself always uses a 32K window,
+    a smaller one only works for files compressed with it.
+    The stream is read forward only, so seek() back starts over from the
+    beginning of the file.
+    """
+    f = None
+    pos = 0
+
+    def __init__(self, f, window_bits=15, bufsize=1024):
+        self.f = f
+        self.window_bits = window_bits
+        self.bufsize = bufsize
+        self.scratch = None
+        self.start()
+
+    def start(self):
+        self.f.seek(0)
+        self.pos = 0
+        try:
+            # CircuitPython built with the deflate module
+            import deflate
+            self.stream = deflate.DeflateIO(self.f, deflate.GZIP, self.window_bits)
+            self.inflater = None
+            return
+        except ImportError:
+            pass
+        # CPython, e.g. the emulator; zlib of CircuitPython has decompress() only
+        import zlib
+        if not hasattr(zlib, "decompressobj"):
+            raise RuntimeError("no deflate module in this CircuitPython, "
+                               "copy the image uncompressed")
+        self.stream = None
+        self.inflater = zlib.decompressobj(16 + self.window_bits)
+
+    def inflate_into(self, view):
+        # Up to len(view) bytes, 0 at the end of the stream
+        z = self.inflater
+        while not z.eof:
+            data = z.unconsumed_tail or self.f.read(self.bufsize)
+            out = z.decompress(data, len(view))
+            if out:
+                view[:len(out)] = out
+                return len(out)
+            if not data:
+                break
+        return 0
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        n = 0
+        while n < len(buffer):
+            if self.stream:
+                k = self.stream.readinto(view[n:])
+            else:
+                k = self.inflate_into(view[n:])
+            if not k:
+                break
+            n += k
+        self.pos += n
+        return n
+
+    def seek(self, offset):
+        if offset < self.pos:
+            self.start()
+        # Skip forward by decompressing
+        if offset > self.pos and not self.scratch:
+            self.scratch = bytearray(self.bufsize)
+        while offset > self.pos:
+            n = min(offset - self.pos, len(self.scratch))
+            if not self.readinto(memoryview(self.scratch)[:n]):
+                break
+        return self.pos
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+def gzip_size(fs, path):
+    # Uncompressed size from the gzip trailer (modulo 4G, images are smaller)
+    with fs.open(path, "rb") as f:
+        f.seek(fs.stat(path)[6] - 4)
+        return struct.unpack("<I", f.read(4))[0]
@@ -0,0 +1,250 @@
+# PIO programs of the debug interface as pioasm text, {settle} is read_settle
+#
+# Assembling takes a while on the board, so releases carry them assembled in
+# cc25xx_pio.py, written by install_flasher.sh:
+#   PYTHONPATH=lib python3 cc25xx_pio_asm.py > cc25xx_pio.py
+# Without it cc25xx_proto assembles them at import with assemble() below.
+
+# 1) Pull RESET_N low
+# 2) Toggle two negative flanks on the DC line
+# 3) Pull RESET_N high
+debug_init_asm = """
+.program init_dbg
+.side_set 2 opt
+    set pins, 0     side 0  [3]     ; RST low, DC low
+
+    set pindirs, 1  side 1          ; DC flank 1
+    nop             side 0  [2]
+
+    nop             side 1          ; DC flank 2
+    nop             side 0  [3]
+
+    nop             side 2          ; RST high
+"""
+
+
+# Debug commands
+#
+# CMD_CHIP_ERASE              0x10
+# CMD_WR_CONFIG               0x19
+# CMD_RD_CONFIG               0x24
+# CMD_READ_STATUS             0x30
+# CMD_RESUME                  0x4C
+# CMD_DEBUG_INSTR_1B          (0x54|1)
+# CMD_DEBUG_INSTR_2B          (0x54|2)
+# CMD_DEBUG_INSTR_3B          (0x54|3)
+# CMD_BURST_WRITE             0x80
+# CMD_GET_CHIP_ID             0x68
+#
+# least significant 2 bits are number of bytes following instruction
+# Every command fits into 32-bit word
+#
+# Each command is preceded by a control word:
+#   bits 31..16  number of bytes to write minus one
+#   bits 15..8   X = 0 -> don't wait, X = 1 -> wait ready
+#   bits  7..1   number of bytes to read
+#   bit      0   push read bytes to RX FIFO (0 -> drop them)
+# so a stream of commands may be sent at once and only needed bytes come back
+debug_command_asm = """
+.program debug_command
+.side_set 2 opt
+.wrap_target
+next_command:
+    pull                            ; wait for next command, ensure clock low
+
+    out x, 16          side 2       ; number of bytes to write minus one
+    mov isr osr                     ; keep read commands safe
+
+    set pindirs 1       side 2      ; DD output
+    pull                            ; payload is in following words
+write_byte:
+    pull ifempty
+    set y 7                         ;
+write_bit:
+    out pins, 1         side 3      ; set data bit, clock high
+    jmp y-- write_bit   side 2      ; clock low
+    jmp x-- write_byte
+
+    set pindirs 0       [1]         ; DD input
+    mov osr isr                     ; restore read commands
+
+    out x, 8                        ; X = 0 -> don't wait
+                                    ; X = 1 -> wait ready
+    jmp !x wait_done
+
+wait_ready:
+    jmp pin wait_more               ; DD high -> not ready yet
+
+wait_done:
+    out x, 7                        ; number of bytes to read
+    jmp x-- read_byte
+    jmp command_done
+
+read_byte:
+    set y 7             side 2      ; 8 bits
+read_bit:
+    nop                 side 3 [{settle}]  ; DUP sets bit at rising clock edge, let it settle
+    in pins, 1          side 2      ; read at falling clock edge
+    jmp y-- read_bit
+
+    jmp x-- read_byte
+
+command_done:
+    out x, 1                        ; X = 0 -> result is not needed
+    jmp !x next_command
+    push
+.wrap
+
+wait_more:                          ; drop byte until DD = 0
+    set y 7                         ;
+drop_bit:
+    nop                 side 3
+    jmp y-- drop_bit    side 2
+    jmp wait_ready
+"""
+# Tdir_change is 83 ns, ~0.1us -- may use any speed because 4 ticks are always more
+
+
+# Bulk flash read
+#
+# Python sets DPTR to the byte before the first one and sends one word per byte:
+# "INC DPTR" and "MOVX A, @DPTR" debug instructions, 16 bits each.
+# The state machine clocks both, drops INC result and pushes every read byte.
+# MOVX goes last, so once the last byte is received the program idles at pull.
+flash_read_asm = """
+.program flash_read
+.side_set 2 opt
+.wrap_target
+    pull                side 2      ; INC DPTR, MOVX A, @DPTR
+    set pindirs 1                   ; DD output
+inc_bit:
+    out pins, 1         side 3      ; set data bit, clock high
+    jmp !osre inc_bit   side 2      ; clock low, OSR is empty after 16 bits
+    set pindirs 0       [1]         ; DD input
+inc_wait:
+    jmp pin inc_busy                ; DD high -> not ready yet
+    set y 7
+inc_drop_bit:
+    nop                 side 3 [2]  ; INC result is not needed
+    jmp y-- inc_drop_bit side 2
+
+    mov osr osr                     ; reset shift counter, MOVX is in upper 16 bits now
+    set pindirs 1                   ; DD output
+movx_bit:
+    out pins, 1         side 3
+    jmp !osre movx_bit  side 2
+    set pindirs 0       [1]         ; DD input
+movx_wait:
+    jmp pin movx_busy
+    set y 7
+movx_read_bit:
+    nop                 side 3 [{settle}]  ; DUP sets bit at rising clock edge, let it settle
+    in pins, 1                      ; autopush every byte, a full RX FIFO stalls
+                                    ; here with clock high, so the bit stays valid
+    jmp y-- movx_read_bit side 2
+.wrap
+
+inc_busy:                           ; drop byte until DD = 0
+    set x 7
+inc_busy_bit:
+    nop                 side 3
+    jmp x-- inc_busy_bit side 2
+    jmp inc_wait
+
+movx_busy:
+    set x 7
+movx_busy_bit:
+    nop                 side 3
+    jmp x-- movx_busy_bit side 2
+    jmp movx_wait
+"""
+
+
+# Busy polling
+#
+# Repeats one debug command until bit 7 of its result is clear: MOVX A, @DPTR
+# with DPTR at FCTL for BUSY, or CMD_READ_STATUS for CHIP_ERASE_BUSY.
+# Rounds start with a pause of ~8400 cycles, so the target is not kept busy.
+# Python sends the round limit, then the command word:
+#   bits 31..27  number of command bits minus one
+#   bits 26..    command bits, MSB first
+# One word comes back: rounds left, 0xFFFFFFFF once the limit is reached.
+# Waiting for DD ready counts a round per byte, so a missing target ends too.
+debug_poll_asm = """
+.program debug_poll
+.side_set 2 opt
+.wrap_target
+    pull                side 2      ; round limit
+    mov x, osr
+    pull                            ; command word
+    mov isr, osr                    ; kept for every round
+pause:
+    set y 31
+pause_outer:
+    mov osr, null                   ; 32 bits to shift out
+pause_inner:
+    out null, 1         [3]
+    jmp !osre pause_inner [3]
+    jmp y-- pause_outer [3]
+
+    mov osr, isr
+    out y, 5                        ; number of command bits minus one
+    set pindirs 1                   ; DD output
+command_bit:
+    out pins, 1         side 3      ; set data bit, clock high
+    jmp y-- command_bit side 2      ; clock low
+    set pindirs 0       [1]         ; DD input
+wait_ready:
+    jmp pin wait_more               ; DD high -> not ready yet
+    set y 6                         ; bits after bit 7
+    nop                 side 3 [{settle}]
+    jmp pin busy        side 2      ; bit 7 set -> still busy
+done_bit:
+    nop                 side 3 [{settle}]
+    jmp y-- done_bit    side 2
+    jmp result
+busy:
+    nop                 side 3 [{settle}]
+    jmp y-- busy        side 2
+    jmp x-- pause
+    jmp result
+wait_more:                          ; drop byte until DD = 0
+    set y 7
+drop_bit:
+    nop                 side 3
+    jmp y-- drop_bit    side 2
+    jmp x-- wait_ready
+result:
+    mov isr, x
+    push
+.wrap
+"""
+
+
+PROGRAMS = (("init_dbg", debug_init_asm),
+            ("debug_command", debug_command_asm),
+            ("flash_read", flash_read_asm),
+            ("debug_poll", debug_poll_asm))
+# read_settle values of cc25xx_proto
+SETTLES = (1, 2)
+
+def assemble(settle):
+    """{name: (instructions, pio_kwargs)} of all programs for this settle"""
+    import adafruit_pioasm
+    programs = {}
+    for (name, text) in PROGRAMS:
+        prog = adafruit_pioasm.Program(text.format(settle=settle))
+        programs[name] = (prog.assembled, prog.pio_kwargs)
+    return programs
+
+if __name__ == "__main__":
+    print("# Assembled from cc25xx_pio_asm.py by install_flasher.sh, do not edit")
+    print("from array import array")
+    print("PROGRAMS = {")
+    for settle in SETTLES:
+        print("    %d: {" % settle)
+        for (name, (assembled, pio_kwargs)) in sorted(assemble(settle).items()):
+            print("        %r: (array(\"H\", %r),\n            %r)," %
+                  (name, list(assembled), pio_kwargs))
+        print("    },")
+    print("}")
@@ -1,29 +1,61 @@
 import rp2pio
-import adafruit_pioasm
 from array import array
 import board
 import time
 
-# seems like RP2040 cannot sample fast enough
-# Maybe with second input-only pin on DD reads will be more reliable
 # 25 MHz clock   --  ~8 Mbps bitrate
-pio_frequency = 25_000_000
+# Reads need the target to drive DD in time, so they limit the rate. Burst write
+# data only goes out and may be clocked faster.
+# Both are measured for the board and cable by calibrate(), see set_frequency()
+pio_frequency = 25_000_000      # commands and reads
+write_frequency = pio_frequency # burst write data
+
+# Blocking transfers give up after this many seconds, None to wait forever
+# A link clocked too fast may lose sync, and the target never gets ready then;
+# a target pulled off or wedged never gets ready either
+link_timeout = 1
+# Transfers poll the link for every word instead of reading in bulk once the
+# target answers, set while calibrating
+link_polled = False
 
 pinDD  = board.GP27
 # DC and RST must be consecutive because they are set by pio side-set
 pinDC  = board.GP28
 pinRST = board.GP29
+# Optional second pin wired to DD, e.g. board.GP26, None to read on pinDD
+# It is only ever an input, so its input synchronizer is bypassed and
+# read bits need less time to settle
+pinDDin = None
+
+# Cycles a read bit settles after rising clock edge before it is sampled
+read_settle = 1 if pinDDin else 2
+
+# Pin groups (DD, DC, RST) of more targets flashed at once with the one above,
+# each on a state machine of its own, see sessions(). Up to 7 more.
+# A DD input pin may be given too: (DD, DC, RST, DDin); reads of every target
+# settle for as long as its own wiring needs
+#   e.g. ((board.GP2, board.GP3, board.GP4), (board.GP6, board.GP7, board.GP8))
+more_targets = ()
 
 
 
 sm = None
 loaded_sm = None
 
-ADDR_BUF0                 = 0x0000 # Buffer (512 bytes)
-ADDR_DMA_DESC_0           = 0x0200 # DMA descriptors (8 bytes)
+# RAM layout: two write buffers of write_block_size bytes, then the DMA
+# descriptors (8 bytes each). Sized by set_chip() to fit the SRAM of the chip
+ADDR_BUF0                 = 0x0000 # Buffer
+ADDR_BUF1                 = 0x0800 # Second buffer
+ADDR_DMA_DESC_0           = 0x1000 # DMA descriptors, channels 1-4 follow
 ADDR_DMA_DESC_1           = (ADDR_DMA_DESC_0 + 8)
+ADDR_DMA_DESC_2           = (ADDR_DMA_DESC_1 + 8)
+ADDR_DMA_DESC_3           = (ADDR_DMA_DESC_2 + 8)
+ADDR_DMA_DESC_4           = (ADDR_DMA_DESC_3 + 8)
 CH_DBG_TO_BUF0            = 0x01   # Channel 0
 CH_BUF0_TO_FLASH          = 0x02   # Channel 1
+CH_FLASH_TO_CRC           = 0x04   # Channel 2
+CH_DBG_TO_BUF1            = 0x08   # Channel 3
+CH_BUF1_TO_FLASH          = 0x10   # Channel 4
 
 # DUP registers (XDATA space address)
 DUP_DBGDATA               = 0x6260  #  Debug interface data buffer
@@ -31,7 +63,11 @@ DUP_FCTL                  = 0x6270  #  Flash controller
 DUP_FADDRL                = 0x6271  #  Flash controller addr
 DUP_FADDRH                = 0x6272  #  Flash controller addr
 DUP_FWDATA                = 0x6273  #  Clash controller data buffer
+DUP_CHIPINFO0             = 0x6276  #  Flash size, USB
+DUP_CHIPINFO1             = 0x6277  #  SRAM size
 DUP_CLKCONSTA             = 0x709E  #  Sys clock status
+DUP_RNDL                  = 0x70BC  #  CRC low byte, write twice to seed
+DUP_RNDH                  = 0x70BD  #  CRC high byte, write to add a byte
 DUP_CLKCONCMD             = 0x70C6  #  Sys clock configuration
 DUP_MEMCTR                = 0x70C7  #  Flash bank xdata mapping
 DUP_DMA1CFGL              = 0x70D2  #  Low byte, DMA config ch. 1
@@ -39,6 +75,7 @@ DUP_DMA1CFGH              = 0x70D3  #  Hi byte , DMA config ch. 1
 DUP_DMA0CFGL              = 0x70D4  #  Low byte, DMA config ch. 0
 DUP_DMA0CFGH              = 0x70D5  #  Low byte, DMA config ch. 0
 DUP_DMAARM                = 0x70D6  #  DMA arming register
+DUP_DMAREQ                = 0x70D7  #  DMA manual trigger
 
 def HIBYTE(addr):
     return (addr >> 8) & 0xff
@@ -46,123 +83,77 @@ def LOBYTE(addr):
     return addr & 0xff
 
 
-# 1) Pull RESET_N low
-# 2) Toggle two negative flanks on the DC line
-# 3) Pull RESET_N high
-debug_init_asm = """
-.program init_dbg
-.side_set 2 opt
-    set pins, 0     side 0  [3]     ; RST low, DC low
-
-    set pindirs, 1  side 1          ; DC flank 1
-    nop             side 0  [2]
-
-    nop             side 1          ; DC flank 2
-    nop             side 0  [3]
-
-    nop             side 2          ; RST high
-"""
-debug_init_compiled = adafruit_pioasm.assemble(debug_init_asm)
-
-
-# Debug commands
-#
-# CMD_CHIP_ERASE              0x10
-# CMD_WR_CONFIG               0x19
-# CMD_RD_CONFIG               0x24
-# CMD_READ_STATUS             0x30
-# CMD_RESUME                  0x4C
-# CMD_DEBUG_INSTR_1B          (0x54|1)
-# CMD_DEBUG_INSTR_2B          (0x54|2)
-# CMD_DEBUG_INSTR_3B          (0x54|3)
-# CMD_BURST_WRITE             0x80
-# CMD_GET_CHIP_ID             0x68
-#
-# least significant 2 bits are number of bytes following instruction
-# Every command fits into 32-bit word
-debug_command_asm = """
-.program debug_command
-.side_set 2 opt
-next_command:
-    pull                            ; wait for next command, ensure clock low
-
-    out x, 16          side 2       ; number of bytes to write
-    mov isr osr                     ; keep read commands safe
-
-    jmp x-- write_data
-    jmp write_done
-
-write_data:
-    set pindirs 1       side 2      ; DD output
-    pull                            ; payload is in following words
-write_byte:
-    pull ifempty
-    set y 7                         ;
-write_bit:
-    out pins, 1         side 3      ; set data bit, clock high
-    jmp y-- write_bit   side 2      ; clock low
-    jmp x-- write_byte
-
-    set pindirs 0                   ; DD input
-    mov osr isr                     ; restore read commands
-
-write_done:
-    out x, 8                        ; X = 0 -> don't wait
-                                    ; X = 1 -> wait ready
-
-;wait_ready:                         ; drop byte until X = 0
-    jmp !x wait_done
-
-.wrap_target
-    mov isr null                    ; ISR = 0
-    in pins, 1                      ; ISR = DD
-    mov x isr                       ; X = ISR -> X = DD
-    jmp !x wait_done
-
-wait_more:
-    set y 7                         ;
-drop_bit:
-    nop                 side 3
-    jmp y-- drop_bit    side 2
-.wrap
-
-
-wait_done:
-    out x, 8                        ; number of bytes to read
-    jmp x-- read_byte
-    jmp command_done
-
-read_byte:
-    set y 7             side 2      ; 8 bits
-read_bit:
-    nop                 side 3 [2]  ; DUP sets bit at rising clock edge, let it settle
-    in pins, 1          side 2      ; read at falling clock edge
-    jmp y-- read_bit
-
-    jmp x-- read_byte
-
-command_done:
-    push
-"""
-# Tdir_change is 83 ns, ~0.1us -- may use any speed because 4 ticks are always more
-debug_command_prog = adafruit_pioasm.Program(debug_command_asm)
-
-
-def ensure_sm(sm_id, prog):
+# CRC16 as calculated by the chip: polynomial 0x8005, MSB first
+def crc16_table_entry(byte):
+    crc = byte << 8
+    for i in range(8):
+        crc = ((crc << 1) ^ 0x8005) if crc & 0x8000 else (crc << 1)
+    return crc & 0xffff
+CRC16_TABLE = array("H", [crc16_table_entry(i) for i in range(256)])
+
+def crc16(data, crc=0xffff):
+    table = CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xff00) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+# PIO programs, see cc25xx_pio_asm.py
+class PioProgram:
+    # What rp2pio.StateMachine takes of an adafruit_pioasm.Program
+    def __init__(self, assembled, pio_kwargs):
+        self.assembled = assembled
+        self.pio_kwargs = pio_kwargs
+
+def load_programs(settle):
+    # Assembled at release time, or here when running from the source tree
+    try:
+        from cc25xx_pio import PROGRAMS
+        return PROGRAMS[settle]
+    except (ImportError, KeyError):
+        import cc25xx_pio_asm
+        return cc25xx_pio_asm.assemble(settle)
+
+# Program globals by read_settle, loaded once for all targets that use them
+program_sets = {}
+
+def programs_for(settle):
+    if settle not in program_sets:
+        programs = load_programs(settle)
+        program_sets[settle] = {
+            "read_settle": settle,
+            "debug_init_compiled": programs["init_dbg"][0],
+            "debug_command_prog": PioProgram(*programs["debug_command"]),
+            "flash_read_prog": PioProgram(*programs["flash_read"]),
+            "debug_poll_prog": PioProgram(*programs["debug_poll"]),
+        }
+    return program_sets[settle]
+
+globals().update(programs_for(read_settle))
+
+# PIO cycles of a debug_poll round, mostly the pause
+POLL_ROUND_CYCLES = 8500
+
+
+def ensure_sm(sm_id, prog, **kwargs):
     global loaded_sm, sm
     global pinRST, pinDD, pinDC
 
     if loaded_sm == sm_id:
         return loaded_sm
+
+    # Start the new one before releasing the old one, so shared pins are never
+    # reset in between: RST drop would kick the target out of debug mode
+    new_sm = start_new_sm(prog, **kwargs)
     if sm:
         abort_sm()
 
-    sm = start_new_sm(prog)
+    sm = new_sm
     loaded_sm = sm_id
     return loaded_sm
 
 
-def start_new_sm(prog):
+def start_new_sm(prog, auto_push=False, push_threshold=32, pull_threshold=32):
     new_sm = rp2pio.StateMachine(
         prog.assembled,
         frequency = pio_frequency,
@@ -177,18 +168,20 @@ def start_new_sm(prog):
         initial_out_pin_direction = 0,   # for pull-up
         initial_out_pin_state = 0,
 
-        first_in_pin = pinDD,
+        first_in_pin = pinDDin or pinDD,
         in_pin_count = 1,
         pull_in_pin_up = True,
 
-        jmp_pin = pinDD,
+        jmp_pin = pinDDin or pinDD,
 
         first_sideset_pin = pinDC,          # second is pinRST
         initial_sideset_pin_state = 2,      # DC low, RST high
         initial_sideset_pin_direction = 0x1f,
 
         auto_pull = False,
-        auto_push = False,
+        auto_push = auto_push,
+        push_threshold = push_threshold,
+        pull_threshold = pull_threshold,
         out_shift_right = False,
         in_shift_right = False,
 
@@ -196,8 +189,25 @@ def start_new_sm(prog):
 
         **prog.pio_kwargs
     )
+    if pinDDin:
+        bypass_input_sync(pinDDin)
     return new_sm
 
+
+def bypass_input_sync(pin):
+    # Set the pin in INPUT_SYNC_BYPASS of both PIO blocks (atomic set alias)
+    # PIO then samples it right away instead of 2 system clocks late
+    import memorymap, microcontroller
+    mask = None
+    for name in dir(microcontroller.pin):
+        if getattr(microcontroller.pin, name) is pin and name.startswith("GPIO"):
+            mask = 1 << int(name[len("GPIO"):])
+    if mask is None:
+        raise ValueError("%r is not a GPIO pin" % pin)
+    for pio_base in (0x5020_0000, 0x5030_0000):
+        reg = memorymap.AddressRange(start=pio_base + 0x2000 + 0x038, length=4)
+        reg[0:4] = mask.to_bytes(4, "little")
+
 def abort_sm():
     global sm, loaded_sm
     if sm:
@@ -207,179 +217,754 @@ def abort_sm():
     loaded_sm = None
 
 
+def set_frequency(read, write=None):
+    # Clock rates for commands and reads, and for burst write data
+    global pio_frequency, write_frequency
+    pio_frequency = read
+    write_frequency = write or read
+    if sm:
+        sm.frequency = pio_frequency
+
+
+def transfer(words, result, out_start=0, out_end=None, in_start=0, in_end=0, swap_out=False):
+    # Send words to the state machine and receive result[in_start:in_end]
+    if out_end is None:
+        out_end = len(words)
+    if link_timeout is None:
+        if in_end > in_start:
+            sm.write_readinto(words, result, out_start=out_start, out_end=out_end,
+                              in_start=in_start, in_end=in_end, swap_out=swap_out)
+        else:
+            sm.write(words, start=out_start, end=out_end, swap=swap_out)
+        return
+
+    # Same by DMA in the background, polled only until the target answers, so
+    # a stuck link can be detected. The rest of a read then comes in by one
+    # blocking readinto: only a target pulled off within those milliseconds
+    # could stall it. Calibration polls every word, its links may lose sync
+    sm.background_write(memoryview(words)[out_start:out_end], swap=swap_out)
+    deadline = time.monotonic() + link_timeout
+    i = in_start
+    while i < in_end or sm.writing:
+        n = min(sm.in_waiting, in_end - i)
+        if n:
+            if not link_polled:
+                n = in_end - i
+            sm.readinto(result, start=i, end=i+n)
+            i += n
+        elif time.monotonic() > deadline:
+            sm.stop_background_write()
+            raise TimeoutError("Debug link timeout")
+
+
+
+# Chip families by chip ID:
+#   (name, page size, flash word size, flash KB by CHIPINFO0.FLASHSIZE, SRAM KB)
+# SRAM is the smallest of the family, CHIPINFO tells the actual sizes.
+# Debug locked chips can not be asked, the largest flash is assumed then
+CHIP_FAMILIES = {
+    0xA5: ("CC2530", 2048, 4, {1: 32, 2: 64, 3: 128, 4: 256}, 8),
+    0xB5: ("CC2531", 2048, 4, {3: 128, 4: 256}, 8),
+    0x95: ("CC2533", 1024, 4, {1: 32, 2: 64, 3: 96}, 4),
+    0x8D: ("CC2540", 2048, 4, {3: 128, 4: 256}, 8),
+    0x41: ("CC2541", 2048, 4, {3: 128, 4: 256}, 8),
+    0x43: ("CC2543", 1024, 4, {1: 32}, 1),
+    0x44: ("CC2544", 1024, 4, {1: 32}, 2),
+    0x45: ("CC2545", 1024, 4, {1: 32}, 1),
+}
+
+class ChipInfo:
+    """Flash and RAM parameters of the connected chip"""
+    def __init__(self, chip_id, flash_size, sram_size):
+        (self.name, self.page_size, self.word_size, _, _) = CHIP_FAMILIES[chip_id]
+        self.chip_id = chip_id
+        self.flash_size = flash_size
+        self.sram_size = sram_size
+        # 32K flash banks, mapped to XDATA 0x8000-0xFFFF by MEMCTR
+        self.banks = (flash_size + 0x7fff) // 0x8000
+
+# ChipInfo of the chip debug_init() found, None for none
+chip = None
+
+def read_chip_info(chip_id, locked=False):
+    (name, page_size, word_size, flash_kb, sram_kb) = CHIP_FAMILIES[chip_id]
+    flash = max(flash_kb.values())
+    if not locked:
+        flash = flash_kb.get((read_xdata_memory(DUP_CHIPINFO0) >> 4) & 7, flash)
+        sram_kb = (read_xdata_memory(DUP_CHIPINFO1) & 7) + 1
+    return ChipInfo(chip_id, flash * 1024, sram_kb * 1024)
+
+def set_chip(info):
+    # Size the RAM buffers for the chip: two blocks and the DMA descriptors
+    global chip, write_block_size, write_buffers
+    global ADDR_BUF1, ADDR_DMA_DESC_0, ADDR_DMA_DESC_1, ADDR_DMA_DESC_2, ADDR_DMA_DESC_3, ADDR_DMA_DESC_4
+    chip = info
+    if not info:
+        return
+    block = info.page_size
+    while 2 * block + 5 * 8 > info.sram_size:
+        block //= 2
+    write_block_size = block
+    ADDR_BUF1 = ADDR_BUF0 + block
+    ADDR_DMA_DESC_0 = ADDR_BUF1 + block
+    ADDR_DMA_DESC_1 = ADDR_DMA_DESC_0 + 8
+    ADDR_DMA_DESC_2 = ADDR_DMA_DESC_1 + 8
+    ADDR_DMA_DESC_3 = ADDR_DMA_DESC_2 + 8
+    ADDR_DMA_DESC_4 = ADDR_DMA_DESC_3 + 8
+    write_buffers = (
+        (ADDR_BUF0, ADDR_DMA_DESC_0, ADDR_DMA_DESC_1, CH_DBG_TO_BUF0, CH_BUF0_TO_FLASH),
+        (ADDR_BUF1, ADDR_DMA_DESC_3, ADDR_DMA_DESC_4, CH_DBG_TO_BUF1, CH_BUF1_TO_FLASH),
+    )
+
 
 def debug_init():
-    global sm
+    global sm, clock_wait_time, mapped_bank
+    clock_wait_time = 0
+    mapped_bank = None
+    ensure_sm(0, debug_command_prog)
     # perform debug_init sequence
     for i in range(len(debug_init_compiled)):
         sm.run(debug_init_compiled[i:i+1])
     (chip_id, chip_name, chip_rev) = read_chip_id()
     if not chip_name:
+        set_chip(None)
         print("Skipping XOSC init")
         return (chip_id, chip_name, chip_rev)
+    if debug_locked():
+        # Debug instructions are refused until chip erase
+        set_chip(read_chip_info(chip_id, locked=True))
+        print("Debug locked, skipping XOSC init")
+        return (chip_id, chip_name, chip_rev)
+    init_clock()
+    set_chip(read_chip_info(chip_id))
+    return (chip_id, chip_name, chip_rev)
+
+
+# Seconds the last init_clock() waited for the crystal oscillator
+clock_wait_time = 0
+
+# Seconds the crystal oscillator may take to start
+clock_timeout = 1
+
+def init_clock():
+    global clock_wait_time
+    start = time.monotonic()
     write_xdata_memory(DUP_CLKCONCMD, 0x80);
     sta = 0
     while sta != 0x80:
+        if time.monotonic() - start > clock_timeout:
+            raise BusyTimeout("XOSC not stable after %s s" % clock_timeout)
         sta = read_xdata_memory(DUP_CLKCONSTA)
         print("clock status %02X" % sta)
-    return (chip_id, chip_name, chip_rev)
+    clock_wait_time = time.monotonic() - start
 
 
 def read_chip_id():
     global sm
+    ensure_sm(0, debug_command_prog)
     sm.clear_rxfifo()
 
-    buf = array("L", [0x0001_00_02, 0x68000000])
+    buf = array("L", [0x0000_01_05, 0x68000000])
     # read ChipID
-    sm.background_write(buf); sm.readinto(buf, end=1)
+    transfer(buf, buf, in_end=1)
     chip_id = (buf[0] >> 8) & 0xff
     chip_rev = buf[0] & 0xff
 
-    if chip_id == 0xA5:
-        chip_name = "CC2530"
-    elif chip_id == 0xB5:
-        chip_name = "CC2531"
-    elif chip_id == 0x95:
-        chip_name = "CC2533"
-    elif chip_id == 0x43:
-        chip_name = "CC2543"
-    elif chip_id == 0x44:
-        chip_name = "CC2544"
-    elif chip_id == 0x45:
-        chip_name = "CC2545"
-    else:
-        chip_name = None
+    chip_name = CHIP_FAMILIES[chip_id][0] if chip_id in CHIP_FAMILIES else None
 
     return (chip_id, chip_name, chip_rev)
 
 
+def probe(init=True):
+    """(chip_id, chip_name, chip_rev) like debug_init(), None if nothing answers
+
+    Nothing connected keeps DD high and the link would wait for it forever,
+    so this gives up after CALIBRATION_TIMEOUT. Without init the target is
+    asked for its chip ID only, it must be in debug mode already
+    """
+    global link_timeout
+    saved = link_timeout
+    link_timeout = CALIBRATION_TIMEOUT
+    try:
+        return debug_init() if init else read_chip_id()
+    except TimeoutError:
+        # Link is out of sync
+        abort_sm()
+        return None
+    finally:
+        link_timeout = saved
+
+
+def command_control(cmd, keep=True):
+    # Write instruction with its bytes, wait ready, read 1 byte
+    control = ((cmd >> 8) & 0x0003_0000) | 0x01_02
+    if keep:
+        control |= 1
+    return control
+
+
 def debug_command(cmd):
     global sm
 
-    control = ((cmd >> 8) & 0x0003_0000) + 0x0001_01_01
-    buf = array("L", [control, cmd])
+    buf = array("L", [command_control(cmd), cmd])
 
+    ensure_sm(0, debug_command_prog)
     sm.clear_rxfifo()
-    sm.background_write(buf)
-    sm.readinto(buf, end=1)
+    transfer(buf, buf, in_end=1)
 
     return buf[0] & 0xff
 
 
-ensure_sm(0, debug_command_prog)
+class CommandQueue:
+    """Debug commands sent to debug_command program as one word stream"""
+
+    def __init__(self, size):
+        self.words = array("L", [0] * (2 * size))
+        self.result = bytearray(size)
+        self.clear()
 
+    def clear(self):
+        self.count = 0
+        self.kept = 0
+
+    def add(self, cmd, keep=False):
+        i = 2 * self.count
+        self.words[i] = command_control(cmd, keep)
+        self.words[i + 1] = cmd
+        self.count += 1
+        if keep:
+            self.kept += 1
+
+    def run(self, result=None, start=0):
+        """Send all commands, bytes returned by kept ones go to result[start:]"""
+        global sm
+        if result is None:
+            result = self.result
+            start = 0
+
+        ensure_sm(0, debug_command_prog)
+        sm.clear_rxfifo()
+        transfer(self.words, result, out_end=2*self.count,
+                 in_start=start, in_end=start+self.kept)
+        return result
+
+
+queue = CommandQueue(128)
+
+# flash_read program gets this many command words per transfer
+READ_CHUNK = 256
+flash_read_cmds = array("L", [0x55_A3_55_E0] * READ_CHUNK)
+# Address the flash_read program will continue from, if it is still loaded
+xdata_read_next = None
 
 
 def write_xdata_memory(address, value):
+    queue.clear()
     # MOV DPTR, address
-    debug_command(0x57_90_0000 | (address & 0xffff))
+    queue.add(0x57_90_0000 | (address & 0xffff))
     # MOV A, value
-    debug_command(0x56_74_0000 | ((value & 0xff) << 8))
+    queue.add(0x56_74_0000 | ((value & 0xff) << 8))
     # MOV @DPTR, A
-    debug_command(0x55_F0_0000)
+    queue.add(0x55_F0_0000, keep=True)
+    queue.run()
+
+def write_xdata_registers(values):
+    # Several (address, value) writes in one batch
+    queue.clear()
+    for (address, value) in values:
+        # MOV DPTR, address
+        queue.add(0x57_90_0000 | (address & 0xffff))
+        # MOV A, value
+        queue.add(0x56_74_0000 | ((value & 0xff) << 8))
+        # MOV @DPTR, A
+        queue.add(0x55_F0_0000)
+    queue.run()
 
 def read_xdata_memory(address):
+    queue.clear()
     # MOV DPTR, address
-    debug_command(0x57_90_0000 | (address & 0xffff))
+    queue.add(0x57_90_0000 | (address & 0xffff))
     # MOVX A, @DPTR
-    return debug_command(0x55_E0_0000)
+    queue.add(0x55_E0_0000, keep=True)
+    return queue.run()[0]
 
 def write_xdata_memory_block(address, values):
-    # MOV DPTR, address
-    debug_command(0x57_90_0000 | (address & 0xffff))
-
-    for i in range(len(values)):
-        # MOV A, values[i]
-        debug_command(0x56_74_0000 | ((values[i] & 0xff) << 8))
-        # MOV @DPTR, A
-        debug_command(0x55_F0_0000)
-        # INC DPTR
-        debug_command(0x55_A3_0000)
+    # 3 commands per byte after MOV DPTR
+    chunk = (len(queue.words) // 2 - 1) // 3
+    for start in range(0, len(values), chunk):
+        end = min(start + chunk, len(values))
+        queue.clear()
+        # MOV DPTR, address
+        queue.add(0x57_90_0000 | ((address + start) & 0xffff))
+        for i in range(start, end):
+            # MOV A, values[i]
+            queue.add(0x56_74_0000 | ((values[i] & 0xff) << 8))
+            # MOV @DPTR, A
+            queue.add(0x55_F0_0000)
+            # INC DPTR
+            queue.add(0x55_A3_0000, keep=(i == end - 1))
+        queue.run()
 
 
 def burst_write_block(buffer):
+    # Up to 2048 bytes, length must be a multiple of 4
     global sm
 
-    # Send command (no wait, no ack)
-    control = 0x0002_00_00
-    cmd = (0x8000 | len(buffer)) << 16
-    buf = array("L", [control, cmd])
-    sm.background_write(buf)
-    sm.readinto(buf, end=1)
-
-    # Send data (with ack)
-    control = (len(buffer) << 16) | 0x0101
-    buf = array("L", [control])
-    sm.background_write(buf)
-    for i in range(0, len(buffer), 4):
-        buf[0] = int.from_bytes(buffer[i:i+4], 'big')
-        sm.background_write(buf)
-    sm.readinto(buf, end=1)
-    return buf[0] & 0xff
-
+    ensure_sm(0, debug_command_prog)
+    sm.clear_rxfifo()
+    # Words go out MSB first, so swap bytes
+    data = array("I", bytes(buffer))
+    result = bytearray(1)
+    last = len(data) - 1
+    # Send command (no wait, no ack), 11-bit length: 2048 is 0
+    header = array("L", [0x0001_00_00, (0x8000 | (len(buffer) & 0x7ff)) << 16])
+    if last:
+        # Then the control word for all data but the last word (no ack)
+        header.append((len(buffer) - 5) << 16)
+    transfer(header, result)
+
+    # Data is clocked at write_frequency, the ack is read at pio_frequency
+    if last:
+        if write_frequency != pio_frequency:
+            sm.frequency = write_frequency
+        transfer(data, result, out_end=last, swap_out=True)
+        if write_frequency != pio_frequency:
+            sm.frequency = pio_frequency
+    transfer(array("L", [0x0003_01_03]), result)
+    transfer(data, result, out_start=last, swap_out=True, in_end=1)
+    return result[0]
+
+
+def read_xdata_memory_block(address, buffer):
+    global sm, xdata_read_next
+
+    if loaded_sm != 1 or address != xdata_read_next:
+        # 1. Move data pointer right before XDATA address (MOV DPTR, xdata_addr - 1)
+        debug_command(0x57_90_0000 | ((address - 1) & 0xffff))
+        ensure_sm(1, flash_read_prog, auto_push=True, push_threshold=8, pull_threshold=16)
+
+    # 2. INC DPTR; MOVX A, @DPTR -- state machine streams bytes into buffer
+    for start in range(0, len(buffer), READ_CHUNK):
+        n = min(READ_CHUNK, len(buffer) - start)
+        transfer(flash_read_cmds, buffer, out_end=n, in_start=start, in_end=start+n)
+    xdata_read_next = address + len(buffer)
+
+
+# Flash bank mapped by MEMCTR, None for unknown: target reset maps bank 0
+mapped_bank = None
+
+def map_flash_bank(address):
+    # Map flash memory bank to XDATA address 0x8000-0xFFFF, unless it is already
+    global mapped_bank
+    bank = address >> 15
+    if chip and bank >= chip.banks:
+        raise ValueError("Flash address %X beyond %s flash" % (address, chip.name))
+    if bank == mapped_bank:
+        return
+    write_xdata_memory(DUP_MEMCTR, bank)
+    mapped_bank = bank
 
 
 def read_flash_memory_block(address, buffer):
-    # 1. Map flash memory bank to XDATA address 0x8000-0xFFFF
-    write_xdata_memory(DUP_MEMCTR, address >> 15);
-    # 2. Move data pointer to XDATA address (MOV DPTR, xdata_addr)
-    debug_command(0x57_90_0000 | 0x8000 | (address & 0x7fff))
-    for i in range(len(buffer)):
-        # 3. MOVX A, @DPTR
-        buffer[i] = debug_command(0x55_E0_0000)
-        # 4. INC DPTR
-        debug_command(0x55_A3_0000)
-
-
-def prepare_for_writing():
+    # Range must not cross a 32K bank boundary
+    map_flash_bank(address)
+    read_xdata_memory_block(0x8000 | (address & 0x7fff), buffer)
+
+
+def debug_locked():
+    # STATUS_DEBUG_LOCKED_BM flag in CMD_READ_STATUS
+    return bool(debug_command(0x30_000000) & 0x04)
+
+
+class BusyTimeout(TimeoutError):
+    """Target stayed busy longer than it may"""
+    pass
+
+# Seconds flash_wait() gives the flash controller, page erase takes 20 ms
+flash_timeout = 1
+# Seconds a chip erase may take
+erase_timeout = 5
+
+def wait_clear(read, mask, timeout, what):
+    # Poll read() from here until its mask bits are clear, BusyTimeout after
+    # timeout seconds
+    deadline = time.monotonic() + timeout
+    while read() & mask:
+        if time.monotonic() > deadline:
+            raise BusyTimeout("%s busy for more than %s s" % (what, timeout))
+
+def wait_not_busy(read, command, bits, timeout, what):
+    # Wait for bit 7 of a status byte to clear, BusyTimeout after timeout seconds
+    # The debug_poll program repeats command, bits long, without the host;
+    # read() gets the status from here if there is no state machine for it
+    global sm, link_timeout
+    limit = max(1, int(timeout * pio_frequency / POLL_ROUND_CYCLES))
+    try:
+        ensure_sm(2, debug_poll_prog)
+    except RuntimeError:
+        # E.g. all state machines taken by more_targets
+        wait_clear(read, 0x80, timeout, what)
+        return
+    sm.clear_rxfifo()
+    buf = array("L", [limit, ((bits - 1) << 27) | (command << (27 - bits))])
+    # The answer comes once the target is done, or after timeout
+    saved = link_timeout
+    if saved is not None:
+        link_timeout = saved + timeout
+    try:
+        transfer(buf, buf, in_end=1)
+    finally:
+        link_timeout = saved
+    if buf[0] == 0xffff_ffff:
+        raise BusyTimeout("%s busy for more than %s s" % (what, timeout))
+
+
+def start_chip_erase():
     print("status before erase", end='  ');  print("%02X" % (debug_command(0x30_000000)) )
     debug_command(0x10_000000)          # CMD_CHIP_ERASE
-    print("Waiting for erase end", end='')
-    while (debug_command(0x30_000000) & 0x80):
-        time.sleep(0.5)
-        print(".", end='')
-        # wait for STATUS_CHIP_ERASE_BUSY_BM flag go low in CMD_READ_STATUS
-        pass
-    print("\nEnablind DMA")
-    debug_command(0x19_22_0000)         # enable DMA: CMD_WR_CONFIG 0x22
 
 
-def write_flash_memory_block(address, buffer):
-    buflen = len(buffer)
-    # 1. Write the 2 DMA descriptors to RAM
-    dma_desc_0 = bytes([
-        HIBYTE(DUP_DBGDATA), LOBYTE(DUP_DBGDATA),
-        HIBYTE(ADDR_BUF0),   LOBYTE(ADDR_BUF0),
-        HIBYTE(buflen),      LOBYTE(buflen),
-        0x1f, 0x11 ])
-    dma_desc_1 = bytes([
-        HIBYTE(ADDR_BUF0),   LOBYTE(ADDR_BUF0),
-        HIBYTE(DUP_FWDATA),  LOBYTE(DUP_FWDATA),
-        HIBYTE(buflen),      LOBYTE(buflen),
-        0x12, 0x42 ])
+def finish_chip_erase():
+    print("Waiting for erase end")
+    # wait for STATUS_CHIP_ERASE_BUSY_BM flag go low in CMD_READ_STATUS
+    wait_not_busy(lambda: debug_command(0x30_000000), 0x30, 8,
+                  erase_timeout, "Chip erase")
+    # Chip erase unlocks debugging, XOSC init may have been skipped
+    init_clock()
+    set_chip(read_chip_info(chip.chip_id))
 
-    write_xdata_memory_block(ADDR_DMA_DESC_0, dma_desc_0);
-    write_xdata_memory_block(ADDR_DMA_DESC_1, dma_desc_1);
 
+def prepare_for_writing(chip_erase=True):
+    # With chip_erase False a chip erase may still be running:
+    # start_chip_erase() and finish_chip_erase() before this
+    if chip_erase:
+        start_chip_erase()
+        finish_chip_erase()
+    print("Enablind DMA")
+    debug_command(0x19_22_0000)         # enable DMA: CMD_WR_CONFIG 0x22
 
-    # 3. Set DMA controller pointer to the DMA descriptors
+    # Set DMA controller pointers to the DMA descriptors
     write_xdata_memory(DUP_DMA0CFGH, HIBYTE(ADDR_DMA_DESC_0))
     write_xdata_memory(DUP_DMA0CFGL, LOBYTE(ADDR_DMA_DESC_0))
     write_xdata_memory(DUP_DMA1CFGH, HIBYTE(ADDR_DMA_DESC_1))
     write_xdata_memory(DUP_DMA1CFGL, LOBYTE(ADDR_DMA_DESC_1))
+    # Write descriptors are uploaded on first use
+    for i in range(len(write_buffers_len)):
+        write_buffers_len[i] = 0
+
+
+def erase_flash_page(address, wait=True):
+    # Without wait the erase goes on meanwhile, next flash access waits for it
+    flash_wait()
+    # 1. Select the page: high bits of the word address
+    write_xdata_memory(DUP_FADDRH, HIBYTE( (address // chip.word_size) ))
+    write_xdata_memory(DUP_FADDRL, 0)
+
+    # 2. Start page erase
+    write_xdata_memory(DUP_FCTL, 0x01)
+
+    # 3. Wait until flash controller is done (~20 ms)
+    if wait:
+        flash_wait()
+
+
+def flash_wait():
+    # Wait until flash controller is done
+    if not (read_xdata_memory(DUP_FCTL) & 0x80):
+        return
+    # DPTR is at FCTL now: MOVX A, @DPTR until BUSY is clear
+    wait_not_busy(lambda: read_xdata_memory(DUP_FCTL), 0x55_E0, 16,
+                  flash_timeout, "Flash controller")
+
+
+# Blocks are written through two RAM buffers in turn: the next block is
+# uploaded while the flash controller still programs the previous one
+#   (buffer, DBG=>buffer descriptor, buffer=>flash descriptor, channels)
+# Replaced by set_chip() for the RAM layout of the chip
+write_block_size = 2048
+write_buffers = (
+    (ADDR_BUF0, ADDR_DMA_DESC_0, ADDR_DMA_DESC_1, CH_DBG_TO_BUF0, CH_BUF0_TO_FLASH),
+    (ADDR_BUF1, ADDR_DMA_DESC_3, ADDR_DMA_DESC_4, CH_DBG_TO_BUF1, CH_BUF1_TO_FLASH),
+)
+write_buffer_next = 0
+# Block length the descriptors of each buffer are uploaded for, 0 for none
+write_buffers_len = [0, 0]
 
-    # 4. Set Flash controller start address (wants 16MSb of 18 bit address)
-    write_xdata_memory(DUP_FADDRH, HIBYTE( (address >> 2) ))
-    write_xdata_memory(DUP_FADDRL, LOBYTE( (address >> 2) ))
+def write_flash_memory_block(address, buffer):
+    # Up to write_block_size, returns when programming is started, flash_wait() for the end
+    global write_buffer_next
+    n = write_buffer_next
+    (addr_buf, desc_dbg, desc_flash, ch_dbg, ch_flash) = write_buffers[n]
+    write_buffer_next ^= 1
 
-    # 5. Arm DBG=>buffer DMA channel and start burst write
-    write_xdata_memory(DUP_DMAARM, CH_DBG_TO_BUF0)
+    buflen = len(buffer)
+    # 1. Write the 2 DMA descriptors to RAM, unless they are there already
+    #    DMA controller pointers are set by prepare_for_writing()
+    if write_buffers_len[n] != buflen:
+        dma_desc_0 = bytes([
+            HIBYTE(DUP_DBGDATA), LOBYTE(DUP_DBGDATA),
+            HIBYTE(addr_buf),    LOBYTE(addr_buf),
+            HIBYTE(buflen),      LOBYTE(buflen),
+            0x1f, 0x11 ])
+        dma_desc_1 = bytes([
+            HIBYTE(addr_buf),    LOBYTE(addr_buf),
+            HIBYTE(DUP_FWDATA),  LOBYTE(DUP_FWDATA),
+            HIBYTE(buflen),      LOBYTE(buflen),
+            0x12, 0x42 ])
+
+        write_xdata_memory_block(desc_dbg, dma_desc_0);
+        write_xdata_memory_block(desc_flash, dma_desc_1);
+        write_buffers_len[n] = buflen
+
+    # 2. Arm DBG=>buffer DMA channel and start burst write
+    #    Previous block may still be programmed by the other channel: ORL DMAARM, #ch
+    #    keeps it armed
+    debug_command(0x57_43_00_00 | (LOBYTE(DUP_DMAARM) << 8) | ch_dbg)
     burst_write_block(buffer)
 
-    # 6. Start programming: buffer to flash
-    write_xdata_memory(DUP_DMAARM, CH_BUF0_TO_FLASH)
-    write_xdata_memory(DUP_FCTL, 0x06)
+    # 3. Previous block must be done before programming the next one
+    flash_wait()
+    write_xdata_registers([
+        # Abort flash channels: ORL could re-arm one finished at the same moment
+        (DUP_DMAARM, 0x80 | CH_BUF0_TO_FLASH | CH_BUF1_TO_FLASH),
+        # 4. Set Flash controller start address, in flash words
+        (DUP_FADDRH, HIBYTE( (address // chip.word_size) )),
+        (DUP_FADDRL, LOBYTE( (address // chip.word_size) )),
+        # 5. Start programming: buffer to flash
+        (DUP_DMAARM, ch_flash),
+        (DUP_FCTL, 0x06),
+    ])
+
+
+def read_flash_crc(address, length):
+    # The chip feeds flash to its CRC unit by DMA, only the result is read back
+    # DMA must be set up by prepare_for_writing()
+    # Range must not cross a 32K bank boundary
+    flash_wait()
+    # 1. Map flash memory bank to XDATA address 0x8000-0xFFFF
+    map_flash_bank(address)
+
+    # 2. DMA descriptor: flash => RNDH, block transfer on manual trigger
+    xdata_addr = 0x8000 | (address & 0x7fff)
+    dma_desc_2 = bytes([
+        HIBYTE(xdata_addr), LOBYTE(xdata_addr),
+        HIBYTE(DUP_RNDH),   LOBYTE(DUP_RNDH),
+        HIBYTE(length),     LOBYTE(length),
+        0x20, 0x42 ])
+    write_xdata_memory_block(ADDR_DMA_DESC_2, dma_desc_2)
+
+    # 3. Seed CRC with 0xFFFF
+    write_xdata_memory(DUP_RNDL, 0xff)
+    write_xdata_memory(DUP_RNDL, 0xff)
+
+    # 4. Arm the channel and trigger it
+    write_xdata_memory(DUP_DMAARM, CH_FLASH_TO_CRC)
+    write_xdata_memory(DUP_DMAREQ, CH_FLASH_TO_CRC)
+
+    # 5. Wait until DMA is done and read the result
+    wait_clear(lambda: read_xdata_memory(DUP_DMAARM), CH_FLASH_TO_CRC,
+               flash_timeout, "CRC DMA")
+    return (read_xdata_memory(DUP_RNDH) << 8) | read_xdata_memory(DUP_RNDL)
+
+
+# Clock rates calibrate() tries, ascending: RP2040 system clock divided by 10..2
+CALIBRATION_FREQUENCIES = (12_500_000, 15_625_000, 20_833_333, 25_000_000,
+                           31_250_000, 41_666_666, 62_500_000)
+CALIBRATION_ROUNDS = 3
+CALIBRATION_TIMEOUT = 0.1
+
+# Link test data: extreme bit patterns and a counter, a multiple of 4 for burst write
+link_test_pattern = bytes([0x00, 0xff, 0x55, 0xaa] * 8) + bytes(range(0, 256, 8))
+
+def write_xdata_burst(address, buffer):
+    # Burst write to RAM through DBG=>buffer DMA channel 0
+    # DMA must be set up by prepare_for_writing()
+    buflen = len(buffer)
+    write_xdata_memory_block(ADDR_DMA_DESC_0, bytes([
+        HIBYTE(DUP_DBGDATA), LOBYTE(DUP_DBGDATA),
+        HIBYTE(address),     LOBYTE(address),
+        HIBYTE(buflen),      LOBYTE(buflen),
+        0x1f, 0x11 ]))
+    # Next flash write uploads its own descriptor
+    write_buffers_len[0] = 0
+    write_xdata_memory(DUP_DMAARM, CH_DBG_TO_BUF0)
+    return burst_write_block(buffer)
+
+
+def link_test(chip_id, mask):
+    # Chip ID, then test data written to RAM by commands and by burst write,
+    # read back by flash_read program
+    # mask changes the data, so leftovers of a previous test never pass
+    if read_chip_id() != chip_id:
+        return False
+    data = bytes([b ^ mask for b in link_test_pattern])
+    back = bytearray(len(data))
+    write_xdata_memory_block(ADDR_BUF1, data)
+    read_xdata_memory_block(ADDR_BUF1, back)
+    if back != data:
+        return False
+    data = data[::-1]
+    write_xdata_burst(ADDR_BUF0, data)
+    read_xdata_memory_block(ADDR_BUF0, back)
+    return back == data
+
+
+def link_passes(chip_id, read, write):
+    # Run link tests at the rates given, start over at a safe rate on failure
+    global link_timeout, link_polled
+    set_frequency(read, write)
+    saved = link_timeout
+    link_timeout = CALIBRATION_TIMEOUT
+    link_polled = True
+    try:
+        ok = True
+        for i in range(CALIBRATION_ROUNDS):
+            ok = ok and link_test(chip_id, (read + write + i) & 0xff)
+    except TimeoutError:
+        ok = False
+    link_timeout = saved
+    link_polled = False
+    if not ok:
+        # Link is out of sync: reset the target
+        abort_sm()
+        set_frequency(CALIBRATION_FREQUENCIES[0])
+        debug_init()
+        prepare_for_writing(chip_erase=False)
+    return ok
+
+
+def calibrate(frequencies=CALIBRATION_FREQUENCIES):
+    """Fastest clock rates the connected target passes link tests at
+
+    Returns (read, write) rates, also set for use, or None if the target
+    can not be tested: not found, debug locked, or no PIO room for the
+    flash_read program beside the state machines of other targets. The
+    first rate stays set then
+    """
+    set_frequency(frequencies[0])
+    (chip_id, chip_name, chip_rev) = debug_init()
+    if not chip_name or debug_locked():
+        return None
+    reference = (chip_id, chip_name, chip_rev)
+    prepare_for_writing(chip_erase=False)
+    try:
+        read_xdata_memory_block(ADDR_BUF0, bytearray(1))
+    except RuntimeError as e:
+        # Both PIO blocks taken by debug_command of 5 or more targets
+        print("No link test: %s, debug clock %d Hz" % (e, pio_frequency))
+        return None
+
+    # Rates above the first failing one are not tried
+    read = frequencies[0]
+    for f in frequencies[1:]:
+        if not link_passes(reference, f, f):
+            break
+        read = f
+    write = read
+    for f in frequencies:
+        if f <= read:
+            continue
+        if not link_passes(reference, read, f):
+            break
+        write = f
+    print("Debug clock: read %d Hz, write %d Hz" % (read, write))
+    set_frequency(read, write)
+    return (read, write)
+
+
+# Module globals that belong to one target, use() switches them
+SESSION_STATE = (
+    "pinDD",
+    "pinDC",
+    "pinRST",
+    "pinDDin",
+    "sm",
+    "loaded_sm",
+    "pio_frequency",
+    "write_frequency",
+    "read_settle",
+    "debug_init_compiled",
+    "debug_command_prog",
+    "flash_read_prog",
+    "debug_poll_prog",
+    "clock_wait_time",
+    "chip",
+    "write_block_size",
+    "write_buffers",
+    "ADDR_BUF1",
+    "ADDR_DMA_DESC_0",
+    "ADDR_DMA_DESC_1",
+    "ADDR_DMA_DESC_2",
+    "ADDR_DMA_DESC_3",
+    "ADDR_DMA_DESC_4",
+    "write_buffer_next",
+    "write_buffers_len",
+    "xdata_read_next",
+    "mapped_bank",
+)
+
+class Session:
+    """One target on its own pins and state machine
+
+    The functions of this module work on the target of the active session,
+    use() makes another one active. Results of the last operation are kept
+    here: error is None or why the target was given up
+    """
+    def __init__(self, pins, state):
+        self.pins = pins
+        self.name = repr(pins[0]).split(".")[-1]
+        self.state = state
+        self.chip_id = None
+        self.chip_name = None
+        self.chip_rev = None
+        self.chip = None
+        self.locked = False
+        self.error = None
+
+    def close(self):
+        use(self)
+        abort_sm()
+
 
-    # 7. Wait until flash controller is done
-    while (read_xdata_memory(DUP_FCTL) & 0x80):
-        pass
+# Session whose state the module globals hold, None before sessions()
+active = None
+session_list = None
+
+def use(session):
+    global active
+    if session is active:
+        return
+    g = globals()
+    if active:
+        active.state = {name: g[name] for name in SESSION_STATE}
+    g.update(session.state)
+    active = session
+
+
+def sessions():
+    """Sessions of all targets: pinDD/pinDC/pinRST first, then more_targets"""
+    global active, session_list
+    if session_list:
+        return session_list
+    g = globals()
+    # The first one takes over the state of the module
+    first = Session((pinDD, pinDC, pinRST), {name: g[name] for name in SESSION_STATE})
+    active = first
+    session_list = [first]
+    for pins in more_targets:
+        state = dict(first.state)
+        ddin = pins[3] if len(pins) > 3 else None
+        # A target without DD input pin needs reads to settle longer
+        state.update(programs_for(1 if ddin else 2))
+        state.update({
+            "pinDD": pins[0], "pinDC": pins[1], "pinRST": pins[2],
+            "pinDDin": ddin,
+            "sm": None, "loaded_sm": None, "clock_wait_time": 0, "chip": None,
+            # Wiring differs, so rates do too: safe ones until set_frequency()
+            "pio_frequency": CALIBRATION_FREQUENCIES[0],
+            "write_frequency": CALIBRATION_FREQUENCIES[0],
+            "write_buffer_next": 0, "write_buffers_len": [0, 0],
+            "xdata_read_next": None, "mapped_bank": None,
+        })
+        session_list.append(Session(pins, state))
+    return session_list
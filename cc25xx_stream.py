@@ -0,0 +1,211 @@
+import struct, time
+import binascii
+
+# Image streaming over a serial link, e.g. the usb_cdc data channel
+#
+# Host sends a header until it is answered, then the image in chunks, in
+# address order:
+#   header  "CCIM", image end address (u32), flags (u32)
+#   chunk   "CCCK", address (u32), length (u16), data, CRC32 of data (u32)
+#   end     a chunk of length 0
+# All little endian. Chunks are CHUNK bytes at multiples of CHUNK, the last
+# one may be shorter. Chunks without data may be left out with FLAG_SPARSE:
+# their pages are kept as they are then, otherwise they are written as 0xFF.
+# Board answers every frame with one byte:
+#   ACK     accepted
+#   NAK     CRC mismatch, send it again
+#   ABORT   flashing failed, stop sending
+#   DONE    after the end chunk: image is flashed and verified
+# A header that comes while the board reloads is lost, one sent again while
+# the first is read is ignored: only the first one is answered
+HEADER = struct.Struct("<4sII")
+CHUNK_HEADER = struct.Struct("<4sIH")
+CRC = struct.Struct("<I")
+# Smallest flash page of the supported chips, so chunks never cross a page
+CHUNK = 1024
+FLAG_SPARSE = 1
+ACK = b"+"
+NAK = b"-"
+ABORT = b"!"
+DONE = b"K"
+
+# Source for padding
+FF = b"\xff" * CHUNK
+
+class StreamError(Exception):
+    pass
+
+class StreamTimeout(StreamError):
+    pass
+
+def read_exactly(port, n, timeout):
+    # n bytes from port, StreamError if they do not come in time
+    data = b""
+    deadline = time.monotonic() + timeout
+    while len(data) < n:
+        more = port.read(n - len(data))
+        if more:
+            data += more
+        elif time.monotonic() > deadline:
+            raise StreamTimeout("Image stream timeout")
+    return data
+
+class StreamReader:
+    """Image read from a serial port as the host sends it
+
+    Same interface as the other image readers: readinto() from address 0 on,
+    has_data() for pages read already. The host gets its ack when a chunk is
+    needed, so at most one chunk is buffered.
+    """
+    def __init__(self, port, timeout=10):
+        self.port = port
+        self.timeout = timeout
+        self.end = 0
+        self.flags = 0
+        self.addr = 0
+        self.pending = None     # (address, data) of a chunk not used yet
+        self.finished = False
+        self.seen = None
+
+    def wait_header(self, timeout):
+        """Wait this long for a host to start streaming, True if it did"""
+        deadline = time.monotonic() + timeout
+        magic = b""
+        # Resync on the magic: drop whatever came before it
+        while magic != b"CCIM":
+            c = self.port.read(1)
+            if c:
+                magic = (magic + c)[-4:]
+            elif time.monotonic() > deadline:
+                return False
+        header = magic + read_exactly(self.port, HEADER.size - 4, self.timeout)
+        (_, self.end, self.flags) = HEADER.unpack(header)
+        self.seen = bytearray((self.end + CHUNK - 1) // CHUNK)
+        self.port.write(ACK)
+        return True
+
+    @property
+    def sparse(self):
+        return bool(self.flags & FLAG_SPARSE)
+
+    def next_chunk(self):
+        # (address, data) of the next chunk, None after the end chunk
+        while True:
+            header = read_exactly(self.port, CHUNK_HEADER.size, self.timeout)
+            (magic, address, length) = CHUNK_HEADER.unpack(header)
+            if magic == b"CCIM":
+                # Header sent again before the host got its ack
+                header += read_exactly(self.port, HEADER.size - CHUNK_HEADER.size,
+                                       self.timeout)
+                if HEADER.unpack(header)[1:] == (self.end, self.flags):
+                    continue
+            if magic != b"CCCK":
+                self.port.write(ABORT)
+                raise StreamError("Image stream out of sync")
+            data = read_exactly(self.port, length + CRC.size, self.timeout)
+            if CRC.unpack(data[length:])[0] != binascii.crc32(data[:length]):
+                self.port.write(NAK)
+                continue
+            if not length:
+                self.finished = True
+                return None
+            if address % CHUNK or address + length > self.end:
+                self.port.write(ABORT)
+                raise StreamError("Chunk at %06X out of the image" % address)
+            self.port.write(ACK)
+            return (address, data[:length])
+
+    def readinto(self, buffer):
+        start = self.addr
+        if start >= self.end:
+            return 0
+        end = start + len(buffer)
+        for j in range(0, len(buffer), CHUNK):
+            n = min(CHUNK, len(buffer) - j)
+            buffer[j:j+n] = FF[:n]
+        while not self.finished:
+            chunk = self.pending or self.next_chunk()
+            self.pending = None
+            if not chunk:
+                break
+            (address, data) = chunk
+            if address < start:
+                raise StreamError("Chunk at %06X out of order" % address)
+            if address >= end:
+                # Next time
+                self.pending = chunk
+                break
+            buffer[address-start:address-start+len(data)] = data
+            self.seen[address // CHUNK] = 1
+        self.addr = end
+        # Padding past the end of the image is not data
+        return min(len(buffer), self.end - start)
+
+    def has_data(self, start, end):
+        if not self.sparse:
+            return True
+        for i in range(start // CHUNK, min((end - 1) // CHUNK + 1, len(self.seen))):
+            if self.seen[i]:
+                return True
+        return False
+
+    def seek(self, addr):
+        if addr != self.addr:
+            raise StreamError("Image stream can not seek")
+
+    def finish(self, ok):
+        """Tell the host how it went, the end chunk must come if it did"""
+        if ok and not self.finished and not self.pending:
+            ok = self.next_chunk() is None
+        self.port.write(DONE if ok and self.finished else ABORT)
+        return ok and self.finished
+
+    def close(self):
+        pass
+
+def send_image(port, f, end, sparse=False, timeout=30, retries=3, progress=None,
+               resend=1):
+    """Host side: stream f (readinto(), has_data() if sparse) of end bytes
+
+    The header goes again every resend seconds until the board answers it,
+    for up to timeout seconds. Returns True once the board reports the image
+    flashed and verified
+    """
+    def answer(wait=timeout):
+        a = read_exactly(port, 1, wait)
+        if a == ABORT:
+            raise StreamError("Flashing failed, see the board console")
+        return a
+
+    def frame(address, data):
+        body = CHUNK_HEADER.pack(b"CCCK", address, len(data)) + bytes(data) + \
+               CRC.pack(binascii.crc32(data))
+        for i in range(retries):
+            port.write(body)
+            a = answer()
+            if a != NAK:
+                return a
+        raise StreamError("Chunk at %06X not accepted" % address)
+
+    header = HEADER.pack(b"CCIM", end, FLAG_SPARSE if sparse else 0)
+    deadline = time.monotonic() + timeout
+    while True:
+        port.write(header)
+        try:
+            answer(resend)
+            break
+        except StreamTimeout:
+            if time.monotonic() > deadline:
+                raise
+    buf = bytearray(CHUNK)
+    f.seek(0)
+    for address in range(0, end, CHUNK):
+        n = min(f.readinto(buf), end - address)
+        if n <= 0:
+            break
+        if sparse and not f.has_data(address, address + n):
+            continue
+        frame(address, memoryview(buf)[:n])
+        if progress:
+            progress(address + n, end)
+    return frame(0, b"") == DONE
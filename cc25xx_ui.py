@@ -1,6 +1,5 @@
 import storage
-import re, time, microcontroller
-from hex_reader import HexReader
+import time, microcontroller
 
 FS = storage.getmount("/")
 
@@ -8,15 +7,50 @@ workdir    = "/cc25xx"
 read_lock  = workdir + "/control.skip_flash_read"
 read_image_basename = "data.read.bin"
 read_image = workdir + "/" + read_image_basename
+# Chip the dump was read from, dump is trusted for delta writing while it exists
+read_image_id = workdir + "/data.read.id"
+# Flash ranges to read, one per line, each to its own data.read.<range>.bin
+# The file is removed once they are read
+read_ranges_control = workdir + "/control.read_ranges"
+# Debug clock rates measured for this board and cable: "read write" in Hz,
+# a line each for more_targets with pin name of their DD last: "read write GP2"
+link_rates = workdir + "/link.rates"
+# Links of several targets, or on a production line, give up after this many
+# seconds even if cc25xx_proto.link_timeout is None: a target pulled off then
+# fails alone instead of hanging the others, or the line
+write_link_timeout = 1
+# Timings of the last runs, one line each, newest last
+perf_log = workdir + "/perf.log"
+perf_log_runs = 20
+# Image to write as whole pages with their CRCs, built on first use:
+# image.cache.pages and image.cache.manifest
+image_cache = workdir + "/image.cache"
+# Deflate window of *.gz images is 2**inflate_window_bits bytes of RAM
+# 15 for files made by gzip, smaller ones need images compressed to match
+inflate_window_bits = 15
+# Pages verified by a write that did not finish, see WriteJournal
+write_journal = workdir + "/write.journal"
+# Verified pages are appended to the journal this many at a time
+journal_pages = 8
+# Production line: the image is kept and flashed to every target attached
+production_lock = workdir + "/control.production"
+# Seconds between checks for a target to be attached or detached
+production_poll = 0.3
+
+# Console progress is printed at most this often (seconds), USB serial is slow
+progress_interval = 0.5
+progress_next = 0
 
 # Status indicator (auto-detects NeoPixel or single LED)
+# Pins are claimed on first use, not by just importing this module
 class _Indicator:
     def __init__(self):
         self.pin = None
         self.is_neopixel = False
-        self._init()
+        self.ready = False
     
     def _init(self):
+        self.ready = True
         try:
             # Try NeoPixel first
             import neopixel_write, digitalio, board
@@ -34,6 +68,8 @@ class _Indicator:
     
     def set(self, r, g, b):
         """Set status (color for NeoPixel, brightness for LED)"""
+        if not self.ready:
+            self._init()
         if not self.pin:
             return
         if self.is_neopixel:
@@ -45,6 +81,8 @@ class _Indicator:
 
     def blink(self, r, g, b, times=3, delay=0.2):
         """Blink status (color for NeoPixel, brightness for LED)"""
+        if not self.ready:
+            self._init()
         if not self.pin:
             return
         for _ in range(times):
@@ -55,6 +93,71 @@ class _Indicator:
 
 status_led = _Indicator()
 
+# Time spent in phases of one read or write run, and counters
+class RunStats:
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self.counts = {}
+        self.start = time.monotonic()
+
+    def add(self, phase, since):
+        """Account time since then to phase, return now for the next one"""
+        now = time.monotonic()
+        self.phases[phase] = self.phases.get(phase, 0) + now - since
+        return now
+
+    def split(self, phase, part, seconds):
+        """Move seconds of phase to part"""
+        self.phases[phase] = self.phases.get(phase, 0) - seconds
+        self.phases[part] = self.phases.get(part, 0) + seconds
+
+    def count(self, key, n=1):
+        self.counts[key] = self.counts.get(key, 0) + n
+
+    def line(self, ok):
+        total = time.monotonic() - self.start
+        rate = self.counts.get("bytes", 0) / total if total else 0
+        items = ["%s ok=%d s=%.2f Bps=%d" % (self.name, ok, total, rate)]
+        items += ["%s=%.2f" % kv for kv in sorted(self.phases.items())]
+        items += ["%s=%d" % kv for kv in sorted(self.counts.items())]
+        return " ".join(items)
+
+# Stats of the current or last run
+last_run = None
+
+def save_run_stats(ok):
+    # Append the last run to perf_log, keep perf_log_runs lines
+    if not last_run:
+        return
+    try:
+        with FS.open(perf_log, "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        lines = []
+    # Failed runs of the same kind right before this one
+    retries = 0
+    for line in reversed(lines):
+        if not line.startswith(last_run.name + " ok=0"):
+            break
+        retries += 1
+    last_run.counts["retries"] = retries
+    line = last_run.line(ok)
+    print(line)
+    lines = (lines + [line])[-perf_log_runs:]
+    with FS.open(perf_log, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def show_progress(label, done, total, width=64):
+    # Rate limited, the last one is always shown
+    global progress_next
+    now = time.monotonic()
+    if now < progress_next and done < total:
+        return
+    progress_next = now + progress_interval
+    n = width * done // total
+    print("\r%s: [" % label, "="*n, " "*(width - n), "]", sep='', end='')
+
 # Helper for cases where something is screwed up
 def safe_mode():
     microcontroller.on_next_reset(microcontroller.RunMode.SAFE_MODE)
@@ -81,36 +184,121 @@ def need_read():
             # Unknown error
             return False
 
+# "bin" or "hex" for names of images, gzipped as well, None for other files
+def image_kind(name):
+    name = name.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    for kind in ("bin", "hex"):
+        if name.endswith("." + kind):
+            return kind
+    return None
+
 def image_to_write_from():
-    regex = re.compile(".*\.(bin|hex)$")
     for (f, _,_,_) in FS.ilistdir(workdir):
-        if f == read_image_basename:
+        if f.startswith("data.read."):
+            # Dumps
             continue
-        if regex.match(f.lower()):
+        if image_kind(f) and not gzip_unsupported(f):
             return workdir + "/" + f
     return False
 
+# *.gz images are left alone if the firmware can not decompress them
+def gzip_unsupported(name):
+    if not name.lower().endswith(".gz"):
+        return False
+    import cc25xx_inflate
+    return not cc25xx_inflate.supported()
+
+def need_read_ranges():
+    try:
+        FS.stat(read_ranges_control)
+        return True
+    except OSError:
+        return False
+
 def need_write():
     if image_to_write_from():
         return True
-    else:
+    for (f, _,_,_) in FS.ilistdir(workdir):
+        if image_kind(f) and gzip_unsupported(f):
+            print("%s: no deflate module in this CircuitPython, copy the image uncompressed" % f)
+    return False
+
+def need_production():
+    try:
+        FS.stat(production_lock)
+    except OSError:
         return False
+    return need_write()
 
 
 
+# Targets whose rates are set already, once per boot is enough
+link_ready = set()
+
+# {target: (read, write)} saved in link_rates, "" is the first target
+def load_link_rates():
+    rates = {}
+    try:
+        with FS.open(link_rates, "r") as f:
+            for line in f.read().split("\n"):
+                words = line.split()
+                if len(words) >= 2:
+                    target = words[2] if len(words) > 2 else ""
+                    rates[target] = (int(words[0]), int(words[1]))
+    except (OSError, ValueError):
+        pass
+    return rates
+
+# Load debug clock rates of the active target, or measure them if asked
+# Too fast a link may garble commands, so calibration waits for the flash dump
+# target is "" for the first one, pin name of DD for more_targets
+def setup_link(calibrate=False, target=""):
+    import cc25xx_proto
+    if target in link_ready:
+        return
+    rates = load_link_rates()
+    if target in rates:
+        cc25xx_proto.set_frequency(*rates[target])
+        link_ready.add(target)
+        return
+    if not calibrate:
+        return
+    print(("Calibrating debug clock " + target).strip())
+    found = cc25xx_proto.calibrate()
+    if found:
+        rates[target] = found
+        link_ready.add(target)
+        try:
+            with FS.open(link_rates, "w") as f:
+                for (name, (read, write)) in sorted(rates.items()):
+                    f.write(("%d %d %s" % (read, write, name)).strip() + "\n")
+        except OSError:
+            # Read-only in production mode, calibrate again next boot
+            pass
+
 def read_flash():
-    with FS.open(read_image, "w") as d:
-        result = read_flash_to_filedesc(d)
+    forget_dump()
+    result = False
+    try:
+        with FS.open(read_image, "w") as d:
+            result = read_flash_to_filedesc(d)
+    finally:
+        save_run_stats(bool(result))
 
     if result:
+        with FS.open(read_image_id, "w") as f:
+            f.write("%02X %02X\n" % result)
         with FS.open(read_lock, "w") as f:
             pass
     else:
         time.sleep(5)
 
 def read_flash_to_filedesc(f):
+    global last_run
     import cc25xx_proto
-    # Flash size of CC2531 is 256K
+    run = last_run = RunStats("read")
     # Reading 32K takes about 20 seconds
     # So, for visible activity, use 2K block
     blocksize = 2*1024
@@ -118,77 +306,804 @@ def read_flash_to_filedesc(f):
 
     status_led.blink(10, 20, 10, 2)  # Cyan: initializing
 
+    setup_link()
+    t = time.monotonic()
     (chip_id, chip_name, chip_rev) = cc25xx_proto.debug_init()
+    t = run.add("init", t)
+    run.split("init", "xosc", cc25xx_proto.clock_wait_time)
     if not chip_name:
         status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
         return False
 
     status_led.set(0, 0, 0)  # Off: starting
 
-    nblocks = 256*1024 // blocksize
+    nblocks = cc25xx_proto.chip.flash_size // blocksize
     for i in range(nblocks):
         cc25xx_proto.read_flash_memory_block(i*blocksize, buf)
+        t = run.add("read", t)
         f.write(buf)
+        t = run.add("file", t)
+        run.count("bytes", blocksize)
         # Blinking yellow while reading
         status_led.set(10 + i%2*6, 10 + (i+1)%2*6, 0)
-        if i % 2 == 1:
-            print("\rRead flash: [", "="*(i//2), " "*((nblocks-i)//2), "]", sep='', end='')
+        show_progress("Read flash", i + 1, nblocks)
 
-    status_led.set(0, 20, 0, 5)  # Green: success
+    status_led.blink(0, 20, 0, 5)  # Green: success
     print("")
+    return (chip_id, chip_rev)
+
+# Named ranges of control.read_ranges:
+#   (distance of the start from the end of flash, length, in pages or bytes)
+#   nv        Z-Stack NV pages, HAL_NV_PAGE_CNT 6 right below the last page
+#   ieee      secondary IEEE address, 8 bytes right below the lock bits
+#   lockbits  flash and debug lock bits at the end of the last page
+READ_REGIONS = {
+    "nv": (7, 6, "pages"),
+    "ieee": (24, 8, "bytes"),
+    "lockbits": (16, 16, "bytes"),
+}
+
+def parse_read_range(line, chip):
+    """(name, start, end) of a control.read_ranges line
+
+    A name from READ_REGIONS, or hex addresses "start end" or "start +length"
+    """
+    words = line.split()
+    if len(words) == 1 and words[0].lower() in READ_REGIONS:
+        name = words[0].lower()
+        (back, length, unit) = READ_REGIONS[name]
+        if unit == "pages":
+            (back, length) = (back * chip.page_size, length * chip.page_size)
+        start = chip.flash_size - back
+        return (name, start, start + length)
+    if len(words) != 2:
+        raise ValueError("Bad range: %s" % line)
+    start = int(words[0], 16)
+    if words[1].startswith("+"):
+        end = start + int(words[1][1:], 16)
+    else:
+        end = int(words[1], 16)
+    if not 0 <= start < end <= chip.flash_size:
+        raise ValueError("Range out of %s flash: %s" % (chip.name, line))
+    return ("%06X-%06X" % (start, end), start, end)
+
+def read_flash_ranges():
+    with FS.open(read_ranges_control, "r") as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    result = False
+    try:
+        result = read_flash_ranges_to_files(lines)
+    finally:
+        save_run_stats(result)
+
+    if result:
+        FS.remove(read_ranges_control)
+    else:
+        time.sleep(5)
+
+def read_flash_ranges_to_files(lines):
+    global last_run
+    import cc25xx_proto
+    run = last_run = RunStats("ranges")
+    blocksize = 2*1024
+    buf = bytearray(blocksize)
+    view = memoryview(buf)
+
+    status_led.blink(10, 20, 10, 2)  # Cyan: initializing
+
+    setup_link()
+    t = time.monotonic()
+    (chip_id, chip_name, chip_rev) = cc25xx_proto.debug_init()
+    t = run.add("init", t)
+    run.split("init", "xosc", cc25xx_proto.clock_wait_time)
+    if not chip_name:
+        status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+        return False
+    try:
+        ranges = [parse_read_range(line, cc25xx_proto.chip) for line in lines]
+    except ValueError as e:
+        print(e)
+        status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+        return False
+
+    status_led.set(0, 0, 0)  # Off: starting
+
+    for (name, start, end) in ranges:
+        with FS.open(workdir + "/data.read." + name + ".bin", "w") as f:
+            address = start
+            while address < end:
+                # Blocks do not cross 32K banks, bank is mapped once per bank
+                n = min(blocksize, end - address, 0x8000 - address % 0x8000)
+                cc25xx_proto.read_flash_memory_block(address, view[:n])
+                t = run.add("read", t)
+                f.write(view[:n])
+                t = run.add("file", t)
+                run.count("bytes", n)
+                address += n
+        print("%s: %06X-%06X" % (name, start, end))
+        run.count("ranges")
+
+    status_led.blink(0, 20, 0, 5)  # Green: success
+    return True
+
+def forget_dump():
+    try:
+        FS.remove(read_image_id)
+    except OSError:
+        pass
+
+def open_dump():
+    # Only a dump of a known chip is usable, dump_matches() checks its size
+    try:
+        FS.stat(read_image_id)
+        return FS.open(read_image, "r+b")
+    except OSError:
+        return None
+
+def dump_matches(dump, chip_id, chip_rev):
+    import cc25xx_proto
+    with FS.open(read_image_id, "rb") as f:
+        dump_id = [int(x, 16) for x in f.read().split()]
+    chip = cc25xx_proto.chip
+    if dump_id != [chip_id, chip_rev] or FS.stat(read_image)[6] != chip.flash_size:
+        return False
+
+    # Another stick with the same chip may be connected, compare some pages
+    pagesize = chip.page_size
+    npages = chip.flash_size // pagesize
+    page = bytearray(pagesize)
+    old = bytearray(pagesize)
+    for i in (0, npages//3, 2*npages//3, npages-1):
+        cc25xx_proto.read_flash_memory_block(i*pagesize, page)
+        dump.seek(i*pagesize)
+        dump.readinto(old)
+        if page != old:
+            return False
     return True
 
 
+# Pages a write has verified, so the next try after a reload resumes there
+class WriteJournal:
+    """Journal of a write in write_journal
+
+    First line is the header: size and CRC32 of the image file, chip ID,
+    revision and page size. Then a line per page done, in order: page number
+    and CRC16 of the page, "-" for a page the image has no data for, left as
+    it was, or "?" for a page written but not verified. A resumed write
+    checks them all against the image before it trusts them.
+    Lines are appended journal_pages at a time, the journal is removed once
+    the write is done.
+    """
+    def __init__(self):
+        self.header = None
+        self.lines = []
+
+    def open(self, header):
+        """[(page, CRC16, -1 for "-" or None for "?")] done by a write with this header"""
+        self.header = header
+        try:
+            with FS.open(write_journal, "r") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return []
+        if not lines or lines[0] != header:
+            return []
+        pages = []
+        for line in lines[1:]:
+            try:
+                (page, crc) = line.split()
+                pages.append((int(page), -1 if crc == "-" else None if crc == "?"
+                               else int(crc, 16)))
+            except ValueError:
+                # Cut short by a reset
+                break
+        return pages
+
+    def start(self, pages):
+        """Start the journal anew with these pages done"""
+        lines = [self.header] + [self.line(page, crc) for (page, crc) in pages]
+        try:
+            with FS.open(write_journal, "w") as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError:
+            # Read-only filesystem
+            self.header = None
+
+    def line(self, page, crc):
+        return "%d %s" % (page, "?" if crc is None else "-" if crc < 0 else "%04X" % crc)
+
+    def add(self, page, crc):
+        """Page done: verified with CRC16, -1 if left as it was, None if not verified"""
+        if not self.header:
+            return
+        self.lines.append(self.line(page, crc))
+        if len(self.lines) >= journal_pages:
+            self.flush()
+
+    def flush(self):
+        if not self.header or not self.lines:
+            return
+        try:
+            with FS.open(write_journal, "a") as f:
+                f.write("\n".join(self.lines) + "\n")
+        except OSError:
+            # Filesystem full or gone read-only: go on without the journal
+            self.header = None
+        self.lines = []
+
+    def close(self, done):
+        if not self.header:
+            return
+        if done:
+            try:
+                FS.remove(write_journal)
+            except OSError:
+                pass
+        else:
+            self.flush()
+        self.header = None
+
 
-def write_flash(blocksize = 512):
+def write_flash(blocksize = 2048):
+    import cc25xx_proto
     image = image_to_write_from()
     if not image:
         return False
-    if re.match(".*\.bin$", image.lower()):
-        with FS.open(image, "r") as d:
-            result = write_flash_from_filedesc(d, blocksize=blocksize)
-    elif re.match(".*\.hex$", image.lower()):
-        reader = HexReader(image)
-        result = write_flash_from_filedesc(reader, blocksize=blocksize)
+    opened = open_image_or_report(image)
+    if not opened:
+        return False
+    (reader, args) = opened
+    if cc25xx_proto.more_targets:
+        # Several targets: the dump is of one of them at best
+        dump = None
+        write = write_flash_to_targets
+        extra = {"link_timeout": write_link_timeout}
+    else:
+        dump = open_dump()
+        write = write_flash_from_filedesc
+        # A try cut short by a reload is resumed
+        extra = {"journal": WriteJournal()}
+    result = False
+    try:
+        args.update(extra)
+        result = with_link_timeout(write, reader, blocksize=blocksize, dump=dump, **args)
+    finally:
+        reader.close()
+        if "journal" in extra:
+            extra["journal"].close(result)
+        if dump:
+            dump.close()
+            if not result:
+                # Pages may have changed without the dump following them
+                forget_dump()
+        save_run_stats(result)
 
     if result:
         FS.remove(image)
+        # Written once, the cache would only take space
+        forget_image_cache()
     return result
 
-def write_flash_from_filedesc(f, blocksize = 512):
+# func(*args, **kwargs) with the link giving up after link_timeout seconds
+# where cc25xx_proto.link_timeout would wait forever
+def with_link_timeout(func, *args, link_timeout=None, **kwargs):
     import cc25xx_proto
-    # Flash size of CC2531 is 256K
-    # writing 2K stuck
-    # So, some small configurable default
-    #blocksize = 64
-    buf = bytearray(blocksize)
+    saved = cc25xx_proto.link_timeout
+    if saved is None:
+        cc25xx_proto.link_timeout = link_timeout
+    try:
+        return func(*args, **kwargs)
+    finally:
+        cc25xx_proto.link_timeout = saved
+
+# Reader of the image, and write_flash_from_filedesc() arguments for it
+# Images ending with .gz are decompressed while being read
+def open_image(image):
+    from cc25xx_cache import ImageCache
+    f = FS.open(image, "rb")
+    if image.lower().endswith(".gz"):
+        import cc25xx_inflate
+        try:
+            f = cc25xx_inflate.InflateReader(f, window_bits=inflate_window_bits)
+        except RuntimeError:
+            f.close()
+            raise
+        size = cc25xx_inflate.gzip_size(FS, image)
+    else:
+        size = FS.stat(image)[6]
+    if image_kind(image) == "bin":
+        # Binary image covers flash from the start
+        (source, args) = (f, {"erase": "pages", "size": size})
+    else:
+        from hex_reader import HexReader
+        (source, args) = (HexReader(f), {"erase": "data"})
+    return (ImageCache(FS, image, source, image_cache), args)
+
+# open_image(), None if the image can not be read here, e.g. *.gz without a
+# deflate module: it is left on the drive
+def open_image_or_report(image):
+    try:
+        return open_image(image)
+    except RuntimeError as e:
+        print("%s: %s" % (image.split("/")[-1], e))
+        status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+        return None
+
+def image_cache_fresh():
+    import cc25xx_cache
+    image = image_to_write_from()
+    return bool(image) and cc25xx_cache.fresh(FS, image, image_cache)
+
+# Cache files left behind by an image that is gone
+def stale_image_cache():
+    for name in (image_cache + ".manifest", image_cache + ".pages"):
+        try:
+            FS.stat(name)
+            return not image_to_write_from()
+        except OSError:
+            pass
+    return False
+
+def forget_image_cache():
+    for name in (image_cache + ".manifest", image_cache + ".pages"):
+        try:
+            FS.remove(name)
+        except OSError:
+            pass
+
+# Flash every target attached with the same image, without resets in between
+# Targets are found by polling chip ID, nothing is written to the filesystem:
+# results go to the console and the LED shows them until the target is detached
+def production_line(blocksize = 2048):
+    import cc25xx_proto
+    image = image_to_write_from()
+    opened = open_image_or_report(image)
+    if not opened:
+        return
+    (reader, args) = opened
+    print("Production line: %s" % image)
+    setup_link()
+    done = failed = 0
+    while True:
+        # Dim white: waiting for a target
+        status_led.set(2, 2, 2)
+        found = cc25xx_proto.probe()
+        if not found or not found[1]:
+            time.sleep(production_poll)
+            continue
+        print("%s attached" % found[1])
+        reader.seek(0)
+        try:
+            ok = with_link_timeout(write_flash_from_filedesc, reader, blocksize=blocksize,
+                                   link_timeout=write_link_timeout, **args)
+        except TimeoutError as e:
+            # Pulled off, or wedged: back to waiting, a wedged one is written again
+            print("\nTarget lost: %s" % e)
+            status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+            cc25xx_proto.abort_sm()
+            failed += 1
+            print("Flashed %d, failed %d" % (done, failed))
+            continue
+        except Exception as e:
+            print("\n%s" % e)
+            status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+            ok = False
+        if ok:
+            done += 1
+        else:
+            failed += 1
+        if last_run:
+            print(last_run.line(ok))
+        print("Flashed %d, failed %d" % (done, failed))
+        # Green or red until the target is gone
+        if ok:
+            status_led.set(0, 20, 0)
+        else:
+            status_led.set(20, 0, 0)
+        while cc25xx_proto.probe(init=False) == found:
+            time.sleep(production_poll)
+        cc25xx_proto.abort_sm()
+        print("Target detached")
+
+# Flash an image a host streams over port, see cc25xx_stream
+# Waits up to wait seconds for the host to start, returns None if it did not
+# The drive may be with the host, so the dump and perf.log are not touched
+def write_flash_from_stream(port, wait, blocksize = 2048):
+    import cc25xx_stream
+    reader = cc25xx_stream.StreamReader(port)
+    if not reader.wait_header(wait):
+        return None
+    print("Image stream: %d bytes" % reader.end)
+    if reader.sparse:
+        args = {"erase": "data"}
+    else:
+        args = {"erase": "pages", "size": reader.end}
+    ok = False
+    try:
+        ok = write_flash_from_filedesc(reader, blocksize=blocksize, **args)
+    except Exception as e:
+        print("\n%s" % e)
+        status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+    ok = reader.finish(ok)
+    if last_run:
+        print(last_run.line(ok))
+    return ok
+
+# usb_cdc data channel, enabled by boot.py, None if there is none
+def stream_port():
+    try:
+        import usb_cdc
+    except ImportError:
+        return None
+    port = usb_cdc.data
+    if port:
+        # Reads return what came within this time
+        port.timeout = 0.1
+    return port
+
+# Erase modes:
+#   "chip"  -- erase whole chip before writing
+#   "pages" -- erase every page the input reaches before writing it
+#   "data"  -- like "pages", but only pages f.has_data() for, others are kept as is
+# Input of size covering the whole flash gets chip erase, it is faster
+# With a flash dump of this chip only pages differing from it are written,
+# and the dump is updated to match
+# With verify every written page is checked by CRC calculated on the chip
+def write_flash_from_filedesc(f, blocksize = 2048, erase = "chip", dump = None, verify = True,
+                              size = None, journal = None):
+    global last_run
+    import cc25xx_proto
+    run = last_run = RunStats("write")
 
     status_led.blink(10, 20, 10, 2)  # Cyan: initializing
+    setup_link(calibrate=True)
+    t = time.monotonic()
     (chip_id, chip_name, chip_rev) = cc25xx_proto.debug_init()
+    t = run.add("init", t)
+    run.split("init", "xosc", cc25xx_proto.clock_wait_time)
     if not chip_name:
         status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
         return False
-    cc25xx_proto.prepare_for_writing()
+    chip = cc25xx_proto.chip
+    # Input is handled by erase pages, each page is written in blocks
+    # Block is up to what fits the RAM of the chip, smaller ones only make sense for debugging
+    pagesize = chip.page_size
+    blocksize = min(blocksize, pagesize, cc25xx_proto.write_block_size)
+    # Two page buffers: next page is decoded while the previous one is programmed
+    bufs = (bytearray(pagesize), bytearray(pagesize))
+    views = (memoryview(bufs[0]), memoryview(bufs[1]))
+    blank = b"\xff" * pagesize
+    blank_block = blank[:blocksize]
+    if size and size >= chip.flash_size:
+        erase = "chip"
+    locked = cc25xx_proto.debug_locked()
+    if locked:
+        # Locked chip does not allow page erase, only chip erase unlocks it
+        erase = "chip"
+        dump = None
+    if dump and not dump_matches(dump, chip_id, chip_rev):
+        print("Flash dump is not from this chip, ignoring it")
+        dump = None
+    t = run.add("dump", t)
+    # A cached image knows the CRCs of its pages
+    page_crc = f.page_crc if hasattr(f, "use_page_size") and f.use_page_size(pagesize) else None
+    t = run.add("file", t)
+    start = 0
+    if journal and page_crc:
+        done = journal.open("%s %X %X %d" % (f.key, chip_id, chip_rev, pagesize))
+        if done and not locked:
+            # Pages of the last try that still verify are not written again
+            # DMA is needed for CRCs, a chip erase waits until they are checked
+            cc25xx_proto.prepare_for_writing(chip_erase = False)
+            for (page, crc) in done:
+                expected = page_crc(page*pagesize)
+                if page != start:
+                    break
+                if crc is not None and crc < 0:
+                    # Left as it was: right only if the image has no data for it
+                    if expected >= 0:
+                        break
+                elif expected < 0 or (crc is not None and crc != expected) or \
+                        cc25xx_proto.read_flash_crc(page*pagesize, pagesize) != expected:
+                    break
+                start += 1
+        journal.start(done[:start])
+        t = run.add("verify", t)
+    if start:
+        print("Resuming at page %d" % start)
+        run.count("pages_resumed", start)
+        f.seek(start*pagesize)
+        # Pages after them may be anything: erase the ones written
+        if erase == "chip":
+            erase = "pages"
+    if dump:
+        # Unchanged pages must survive
+        old = bytearray(pagesize)
+        if erase == "chip":
+            erase = "pages"
+    else:
+        # Flash will not match the dump anymore
+        forget_dump()
+    cc25xx_proto.prepare_for_writing(chip_erase = (erase == "chip"))
+    if verify:
+        blank_crc = cc25xx_proto.crc16(blank)
+    t = run.add("erase" if erase == "chip" else "init", t)
 
     status_led.set(0, 0, 0)  # Off: starting
 
-    nblocks = 256*1024 // blocksize
-    rangediv = nblocks // 64
-    for i in range(nblocks):
+    # Chip erase of a locked chip lets its flash size be read
+    npages = cc25xx_proto.chip.flash_size // pagesize
+    programming = None
+    for i in range(start, npages):
+        buf = bufs[i % 2]
+        view = views[i % 2]
         readsz = f.readinto(buf)
+        t = run.add("file", t)
+        # Verify includes waiting for the end of programming
+        if programming and not finish_page(programming, dump, verify, journal):
+            return False
+        t = run.add("verify", t)
+        programming = None
         if not readsz:
             print("\nInput exausted")
             break
-        if readsz < blocksize:
+        if readsz < pagesize:
             # Pad missing part
-            for i in range(readsz, blocksize):
-                buf[i] = 0xff
-        cc25xx_proto.write_flash_memory_block(i*blocksize, buf)
+            buf[readsz:] = blank[readsz:]
+        address = i*pagesize
+        if erase == "data" and not f.has_data(address, address + pagesize):
+            # No data for this page, keep it as is
+            changed = False
+        else:
+            if dump:
+                dump.seek(address)
+                dump.readinto(old)
+                changed = buf != old
+                if not changed:
+                    # The dump misses writes it did not see, e.g. streamed
+                    # ones: the chip confirms a page before it is skipped
+                    crc = page_crc(address) if page_crc else -1
+                    if crc < 0:
+                        crc = cc25xx_proto.crc16(buf)
+                    changed = cc25xx_proto.read_flash_crc(address, pagesize) != crc
+            else:
+                changed = True
+        t = run.add("file", t)
+        if changed:
+            # Bytes of the image written, not padding or skipped pages
+            run.count("bytes", readsz)
+            if erase != "chip":
+                cc25xx_proto.erase_flash_page(address)
+                t = run.add("erase", t)
+            # Erased flash is all 0xFF already, skip blank blocks
+            is_blank = buf == blank
+            if not is_blank:
+                for j in range(0, pagesize, blocksize):
+                    if buf[j:j+blocksize] != blank_block:
+                        cc25xx_proto.write_flash_memory_block(address + j, view[j:j+blocksize])
+                    else:
+                        run.count("blocks_skipped")
+            else:
+                run.count("blocks_skipped", pagesize // blocksize)
+            t = run.add("program", t)
+            crc = None
+            if verify:
+                crc = page_crc(address) if page_crc else -1
+                if crc < 0:
+                    crc = blank_crc if is_blank else cc25xx_proto.crc16(buf)
+            t = run.add("verify", t)
+            # Check the page when the next one is read
+            programming = (address, buf, crc)
+            run.count("pages_written")
+        else:
+            run.count("pages_skipped")
+            if journal and page_crc:
+                # "-" without image data, else the CRC of the image, checked on resume
+                journal.add(i, page_crc(address))
         # Blinking yellow/pink while writing
         status_led.set(10 + i%2*6, 5 + (i+1)%2*6, 5 + (i+1)%2*6)
-        if (i+1) % rangediv == 0:
-            print("\rWrite flash: [", "="*(i//rangediv), " "*((nblocks-i)//rangediv), "]", sep='', end='')
+        show_progress("Write flash", i + 1, npages)
+    if programming and not finish_page(programming, dump, verify, journal):
+        return False
+    run.add("verify", t)
 
     status_led.blink(0, 20, 0, 5)  # Green: success
     print("")
     return True
+
+# Every page goes to all targets in turn: while one is sent its page, the
+# others erase and program theirs. Targets must have the same chip, one that
+# fails is given up with its Session.error set and the others go on.
+# Erase modes are as above, dump is not used
+def write_flash_to_targets(f, blocksize = 2048, erase = "chip", dump = None, verify = True,
+                           size = None):
+    global last_run
+    import cc25xx_proto
+    run = last_run = RunStats("write")
+    targets = cc25xx_proto.sessions()
+    forget_dump()
+
+    status_led.blink(10, 20, 10, 2)  # Cyan: initializing
+    for s in targets:
+        s.error = None
+    t = time.monotonic()
+    live = on_targets(targets, "init", init_target)
+    t = run.add("init", t)
+    if not live:
+        report_targets(targets, run)
+        status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+        return False
+    # Locked chip does not allow page erase, only chip erase unlocks it
+    full = erase == "chip" or (size and size >= live[0].chip.flash_size)
+    chip_erase = [s for s in live if full or s.locked]
+
+    # Chip erases run all at once
+    erasing = on_targets(chip_erase, "erase", cc25xx_proto.start_chip_erase)
+    live = [s for s in live if s in erasing or s not in chip_erase]
+    chip_erase = erasing
+    live = on_targets(live, "erase", prepare_target, chip_erase)
+    t = run.add("erase" if chip_erase else "init", t)
+    if not live:
+        report_targets(targets, run)
+        status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+        return False
+
+    # Sizes of locked chips are known after chip erase only
+    chip = live[0].chip
+    for s in live[1:]:
+        if (s.chip.name, s.chip.flash_size, s.chip.sram_size) != \
+           (chip.name, chip.flash_size, chip.sram_size):
+            s.error = "not the same chip as " + live[0].name
+            s.close()
+    live = [s for s in live if not s.error]
+    # Same chip, same RAM layout on all
+    cc25xx_proto.use(live[0])
+    pagesize = chip.page_size
+    blocksize = min(blocksize, pagesize, cc25xx_proto.write_block_size)
+    bufs = (bytearray(pagesize), bytearray(pagesize))
+    views = (memoryview(bufs[0]), memoryview(bufs[1]))
+    blank = b"\xff" * pagesize
+    blank_block = blank[:blocksize]
+    if verify:
+        blank_crc = cc25xx_proto.crc16(blank)
+    page_crc = f.page_crc if hasattr(f, "use_page_size") and f.use_page_size(pagesize) else None
+    t = run.add("file", t)
+
+    status_led.set(0, 0, 0)  # Off: starting
+
+    npages = chip.flash_size // pagesize
+    programming = None
+    for i in range(npages):
+        buf = bufs[i % 2]
+        view = views[i % 2]
+        readsz = f.readinto(buf)
+        t = run.add("file", t)
+        if programming:
+            live = on_targets(live, "verify", verify_page, programming, verify)
+        t = run.add("verify", t)
+        programming = None
+        if not readsz or not live:
+            break
+        if readsz < pagesize:
+            # Pad missing part
+            buf[readsz:] = blank[readsz:]
+        address = i*pagesize
+        if erase == "data" and not f.has_data(address, address + pagesize):
+            # No data for this page, keep it as is
+            run.count("pages_skipped")
+            continue
+        run.count("bytes", readsz)
+        # Erase on all targets first, the erases then go on together
+        erased = on_targets([s for s in live if s not in chip_erase], "erase",
+                            cc25xx_proto.erase_flash_page, address, False)
+        live = [s for s in live if s in erased or s in chip_erase]
+        t = run.add("erase", t)
+        is_blank = buf == blank
+        blocks = [] if is_blank else [j for j in range(0, pagesize, blocksize)
+                                      if buf[j:j+blocksize] != blank_block]
+        run.count("blocks_skipped", pagesize // blocksize - len(blocks))
+        live = on_targets(live, "program", program_page, address, view, blocks, blocksize)
+        t = run.add("program", t)
+        crc = None
+        if verify:
+            crc = page_crc(address) if page_crc else -1
+            if crc < 0:
+                crc = blank_crc if is_blank else cc25xx_proto.crc16(buf)
+        t = run.add("verify", t)
+        programming = (address, buf, crc)
+        run.count("pages_written")
+        # Blinking yellow/pink while writing
+        status_led.set(10 + i%2*6, 5 + (i+1)%2*6, 5 + (i+1)%2*6)
+        show_progress("Write flash", i + 1, npages)
+    if programming:
+        live = on_targets(live, "verify", verify_page, programming, verify)
+    run.add("verify", t)
+    print("")
+
+    report_targets(targets, run)
+    if len(live) == len(targets):
+        status_led.blink(0, 20, 0, 5)  # Green: success
+        return True
+    status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+    return False
+
+# Run func on every target, returns the ones it did not fail on
+# A target fails by func returning False or raising, its link is dropped then
+def on_targets(targets, phase, func, *args):
+    import cc25xx_proto
+    passed = []
+    for s in targets:
+        cc25xx_proto.use(s)
+        try:
+            ok = func(*args) is not False
+        except Exception as e:
+            print("\n%s: %s" % (s.name, e))
+            ok = False
+        if ok:
+            passed.append(s)
+            continue
+        s.error = s.error or phase + " failed"
+        cc25xx_proto.abort_sm()
+    return passed
+
+def init_target():
+    import cc25xx_proto
+    s = cc25xx_proto.active
+    found = cc25xx_proto.probe()
+    if not found:
+        s.error = "no answer"
+        return False
+    (s.chip_id, s.chip_name, s.chip_rev) = found
+    if not s.chip_name:
+        s.error = "no chip"
+        return False
+    # Every target has rates of its own wiring
+    setup_link(calibrate=True,
+               target="" if s is cc25xx_proto.sessions()[0] else s.name)
+    s.chip = cc25xx_proto.chip
+    s.locked = cc25xx_proto.debug_locked()
+
+def prepare_target(chip_erase):
+    import cc25xx_proto
+    if cc25xx_proto.active in chip_erase:
+        cc25xx_proto.finish_chip_erase()
+        cc25xx_proto.active.chip = cc25xx_proto.chip
+    cc25xx_proto.prepare_for_writing(chip_erase=False)
+
+def program_page(address, view, blocks, blocksize):
+    import cc25xx_proto
+    for j in blocks:
+        cc25xx_proto.write_flash_memory_block(address + j, view[j:j+blocksize])
+
+def verify_page(page, verify):
+    import cc25xx_proto
+    (address, buf, crc) = page
+    if not verify:
+        cc25xx_proto.flash_wait()
+        return True
+    if cc25xx_proto.read_flash_crc(address, len(buf)) != crc:
+        cc25xx_proto.active.error = "verification failed at %06X" % address
+        return False
+
+def report_targets(targets, run):
+    for s in targets:
+        print("%s: %s %s" % (s.name, s.chip_name or "-", s.error or "ok"))
+        run.count("targets_failed" if s.error else "targets_ok")
+
+# Wait for page programming end, verify it and update the dump
+def finish_page(page, dump, verify, journal = None):
+    import cc25xx_proto
+    (address, buf, crc) = page
+    if verify:
+        if cc25xx_proto.read_flash_crc(address, len(buf)) != crc:
+            print("\nVerification failed at %06X" % address)
+            status_led.blink(20, 0, 0, 3, 0.5)  # Red: error
+            return False
+    else:
+        cc25xx_proto.flash_wait()
+    if dump:
+        dump.seek(address)
+        dump.write(buf)
+    if journal:
+        journal.add(address // len(buf), crc)
+    return True
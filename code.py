@@ -4,6 +4,35 @@ import time
 
 FS = storage.getmount("/")
 
+if cc25xx_ui.need_production():
+    print("Production line mode")
+    try:
+        # Runs until the board is reset or reloaded
+        cc25xx_ui.production_line()
+    except Exception as e:
+        traceback.print_exception(e)
+        time.sleep(5)
+        supervisor.reload()
+
+if not cc25xx_ui.need_read_ranges():
+    pass
+elif FS.readonly:
+    print("Resetting to remount FS for writing")
+    microcontroller.reset()
+else:
+    print("Reading flash ranges")
+    try:
+        cc25xx_ui.read_flash_ranges()
+    except Exception as e:
+        traceback.print_exception(e)
+        time.sleep(5)
+        supervisor.reload()
+
+    # Show green light
+    time.sleep(5)
+    # Return to RW for host
+    microcontroller.reset()
+
 if not cc25xx_ui.need_read():
     print("read lock file present, not reading")
 elif FS.readonly:
@@ -44,6 +73,26 @@ else:
     # Return to RW for host
     microcontroller.reset()
 
+if not cc25xx_ui.stale_image_cache():
+    pass
+elif FS.readonly:
+    print("Resetting to remount FS for writing")
+    microcontroller.reset()
+else:
+    print("Removing image cache, its image is gone")
+    cc25xx_ui.forget_image_cache()
+    # Return to RW for host
+    microcontroller.reset()
+
+# Meanwhile a host may stream an image over the USB data channel
+port = cc25xx_ui.stream_port()
+if port:
+    try:
+        cc25xx_ui.write_flash_from_stream(port, 5)
+    except Exception as e:
+        traceback.print_exception(e)
+else:
+    time.sleep(5)
+
 # restart to check locks again
-time.sleep(5)
 supervisor.reload()
@@ -1,102 +1,206 @@
+from array import array
 from binascii import unhexlify
 
+# Source for bulk padding
+FF = memoryview(b"\xff" * 256)
+
+def hex_nibble(c):
+    # Value of ASCII hex digit
+    return (c - 48) if c < 58 else ((c | 0x20) - 87)
+
 class HexReader:
-    """Streaming intel hex reader"""
+    """Intel hex reader
+
+    One pass over the file builds an index of segments: runs of consecutive
+    records with contiguous data, as (address, length, file offset) sorted by
+    address. Reads seek straight to the segments covering the requested range,
+    so records may come in any order.
+    """
     f = None
-    addr_upper = 0
     addr = 0
-    next_chunk = None
 
-    def __init__(self, path):
-        self.f = open(path, 'rb')
+    def __init__(self, f, bufsize=1024):
+        # File object or path
+        self.f = open(f, 'rb') if isinstance(f, str) else f
+        # Hex text as read from file, may end with a partial record
+        self.text = bytearray(bufsize)
+        # Hex digits of complete records, without ':' and line breaks
+        self.digits = bytearray(bufsize)
+        # File offsets of decoded records
+        self.offsets = array("L", [0] * (bufsize // 11 + 1))
+        self.seek_file(0)
+        self.build_index()
+
+    def build_index(self):
+        addrs = array("L")
+        lens = array("L")
+        offs = array("L")
+        base = 0
+        end = None              # where the last data record ended
+        while True:
+            r = self.next_record()
+            if r == None:
+                break
+            (rec_type, addr16, data, offset) = r
+            if rec_type == 0 and len(data):
+                a = base + addr16
+                if a == end:
+                    lens[-1] += len(data)
+                else:
+                    addrs.append(a)
+                    lens.append(len(data))
+                    offs.append(offset)
+                end = a + len(data)
+            elif rec_type in (2, 4):
+                base = self.record_base(rec_type, data)
+            elif rec_type == 1:
+                break
+        order = sorted(range(len(addrs)), key=lambda i: addrs[i])
+        self.seg_addr = array("L", [addrs[i] for i in order])
+        self.seg_len = array("L", [lens[i] for i in order])
+        self.seg_off = array("L", [offs[i] for i in order])
+        self.end = max([addrs[i] + lens[i] for i in order] or [0])
+        self.stream_seg = None
+
+    def has_data(self, start, end):
+        for i in range(len(self.seg_addr)):
+            if self.seg_addr[i] < end and self.seg_addr[i] + self.seg_len[i] > start:
+                return True
+        return False
+
+    def seek(self, addr):
+        # Next readinto() starts at this address, e.g. 0 to read the image again
+        self.addr = addr
+        self.stream_seg = None
 
     def readinto(self, buffer):
-        if not self.f:
+        start = self.addr
+        if start >= self.end:
             return 0
-        offset = self.addr
-        while self.addr - offset < len(buffer):
-            self.writechunk(buffer, offset)
-            #print("filled", self.addr - offset, "of", len(buffer))
-        return len(buffer)
-
-    def writechunk(self, buffer, offset):
-        bufpos = self.addr - offset
-        if not self.next_chunk:
-            ac = self.get_chunk()   # addr+chunk
-            if ac == None:
-                # No data in this chunk
-                return False
-            elif ac == False:
-                # No more data to read
-                self.pad_buffer(buffer, bufpos, len(buffer) - bufpos)
-                self.addr = offset + len(buffer)
-                return False
-            elif not ac:
-                #print("ac", ac, ac == False)
-                raise ValueError
-        else:
-            ac = self.next_chunk
-            self.next_chunk = None
-        (caddr, cdata) = ac             # chunk address + chunk data
-        if caddr - offset > len(buffer):
-            # This chunk is beyond current buffer, will copy it next time
-            self.next_chunk = ac
-            # Pad the buffer to the end
-            self.pad_buffer(buffer, bufpos, len(buffer) - bufpos)
-            self.addr = offset + len(buffer)
-            return False
-        if caddr > self.addr:
-            # Pad the gap between prev data and new chunk
-            self.pad_buffer(buffer, bufpos, caddr - self.addr)
-        for i in range(len(cdata)):
-            # Copy the actual chunk data
-            bufidx = caddr+i-offset
-            if bufidx >= len(buffer):
-                # Ooops, the record overflows the buffer
-                # Wrap the rest of chunk for the next buffer request
-                self.addr = caddr+i
-                self.next_chunk = (self.addr, cdata[i:])
-                return True
-            buffer[bufidx] = cdata[i]
-        self.addr = caddr + len(cdata)
-        return True
+        end = start + len(buffer)
+        self.pad_buffer(buffer, 0, len(buffer))
+        hits = [i for i in range(len(self.seg_addr))
+                if self.seg_addr[i] < end and self.seg_addr[i] + self.seg_len[i] > start]
+        # Overlapping data: the later record in the file wins
+        hits.sort(key=lambda i: self.seg_off[i])
+        for i in hits:
+            self.copy_segment(i, buffer, start, end)
+        self.addr = end
+        # Padding past the end of the image is not data
+        return min(len(buffer), self.end - start)
 
-    def get_chunk(self):
-        if not self.f:
-            # EOF reached. Pad the buffer to the end
-            return False
-        hc = self.f.readline()          # hex chunk
-        #print("hex chunk ", hc, "len", len(hc))
-        if len(hc) == 0:
-            print("WTF", self.f)
-            self.f.close()
-            self.f = None
-            return False
-        return self.parse_hex_chunk(hc)
+    def copy_segment(self, i, buffer, start, end):
+        # Continue where the last read of this segment stopped, if possible
+        if self.stream_seg != i or self.stream_expect > start:
+            self.seek_file(self.seg_off[i])
+            self.stream_seg = i
+            self.stream_expect = self.seg_addr[i]
+            self.stream_base = None
+        seg_end = self.seg_addr[i] + self.seg_len[i]
+        while self.stream_expect < seg_end:
+            r = self.pushback or self.next_record()
+            self.pushback = None
+            if r == None:
+                break
+            (rec_type, addr16, data, offset) = r
+            if rec_type in (2, 4):
+                self.stream_base = self.record_base(rec_type, data)
+                continue
+            if rec_type != 0 or not len(data):
+                continue
+            if self.stream_base == None:
+                self.stream_base = self.seg_addr[i] - addr16
+            a = self.stream_base + addr16
+            if a != self.stream_expect:
+                break
+            if a >= end:
+                # Next time
+                self.pushback = r
+                break
+            # Copy the part inside the buffer
+            lo = max(a, start)
+            hi = min(a + len(data), end)
+            if hi > lo:
+                buffer[lo-start:hi-start] = data[lo-a:hi-a]
+            if a + len(data) > end:
+                # The record overflows the buffer, the rest goes next time
+                self.pushback = r
+                break
+            self.stream_expect = a + len(data)
 
-    def parse_hex_chunk(self, hc):
-        if (len(hc) < 13) or (hc[0] != ord(':')):
-            return False
-        data_len = int(hc[1:3], 16)
-        data_addr = int(hc[3:7], 16)
-        rec_type = int(hc[7:9], 16)
-        #print("type", rec_type, "addr", data_addr, "len", data_len)
-        if rec_type == 0:
-            # Data record
-            #print("   -> data ", data_addr, " -> ", (self.addr_upper << 16) + data_addr)
-            return ((self.addr_upper << 16) + data_addr, unhexlify(hc[9:9+data_len*2]))
-        elif rec_type == 4:
+    def record_base(self, rec_type, data):
+        value = (data[0] << 8) | data[1]
+        if rec_type == 4:
             # Extended linear address record
-            self.addr_upper = int(hc[9:9+data_len*2])
+            return value << 16
+        # Extended segment address record
+        return value << 4
+
+    def seek_file(self, offset):
+        self.f.seek(offset)
+        self.text_base = offset     # file offset of text[0]
+        self.text_len = 0
+        # Decoded records: length, address, type, data, checksum
+        self.records = b""
+        self.pos = 0
+        self.rec_idx = 0
+        self.pushback = None
+
+    def next_record(self):
+        # (type, address, data, file offset) or None at the end of file
+        if self.pos >= len(self.records) and not self.decode_records():
             return None
-        elif rec_type == 1:
-            # EOF
+        rec = self.records
+        i = self.pos
+        data_len = rec[i]
+        self.pos = i + 5 + data_len
+        offset = self.offsets[self.rec_idx]
+        self.rec_idx += 1
+        return (rec[i+3], (rec[i+1] << 8) | rec[i+2], memoryview(rec)[i+4:i+4+data_len], offset)
+
+    def decode_records(self):
+        # Decode all complete records of the next piece of text at once
+        text = memoryview(self.text)
+        if self.text_len < len(text):
+            self.text_len += self.f.readinto(text[self.text_len:]) or 0
+        t = self.text
+        end = self.text_len
+        r = 0
+        w = 0
+        k = 0
+        while k < len(self.offsets):
+            # Skip line breaks
+            while r < end and t[r] != 0x3a:     # ':'
+                r += 1
+            if r + 3 > end:
+                break
+            n = 10 + 2 * ((hex_nibble(t[r+1]) << 4) | hex_nibble(t[r+2]))
+            if r + 1 + n > end:
+                break
+            self.digits[w:w+n] = text[r+1:r+1+n]
+            self.offsets[k] = self.text_base + r
+            w += n
+            r += 1 + n
+            k += 1
+        # Keep the partial record for the next time
+        self.text[0:end-r] = bytes(text[r:end])
+        self.text_len = end - r
+        self.text_base += r
+        if not w:
+            return False
+        self.records = unhexlify(memoryview(self.digits)[:w])
+        self.pos = 0
+        self.rec_idx = 0
+        return True
+
+    def close(self):
+        if self.f:
             self.f.close()
             self.f = None
-            return False
-        else:
-            return None
 
     def pad_buffer(self, buffer, start, count):
-        for i in range(count):
-            buffer[start+i] = 0xff
+        while count > 0:
+            n = min(count, len(FF))
+            buffer[start:start+n] = FF[:n]
+            start += n
+            count -= n
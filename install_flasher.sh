@@ -46,6 +46,15 @@ LIB_DIR=$MOUNTPOINT/lib
 for src in cc25xx_*.py hex_reader.py lib/*.py; do
     install_py $src $LIB_DIR
 done
+
+# PIO programs assembled here, so the board does not assemble them at every boot
+PIO_DIR=$(mktemp -d)
+if PYTHONPATH=lib python3 cc25xx_pio_asm.py > $PIO_DIR/cc25xx_pio.py; then
+    install_py $PIO_DIR/cc25xx_pio.py $LIB_DIR
+else
+    echo "Cannot assemble PIO programs, the board will do it at boot" >&2
+fi
+rm -rf $PIO_DIR
 for script in code.py boot.py README.TXT; do
     cp -v $script $MOUNTPOINT/
 done
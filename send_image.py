@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Stream an image to the flasher over its USB data channel
+
+    python3 send_image.py /dev/ttyACM1 firmware.hex
+
+The data channel is the second serial port of the board, the first one is
+the console. The board takes the image when it is idle: no dump to read and
+no image on the drive. *.hex, *.bin and their *.gz are accepted; only pages
+with data of a *.hex are written, a *.bin is written from the start.
+"""
+
+import argparse
+import gzip
+import io
+import os
+import sys
+
+from cc25xx_stream import send_image, StreamError
+from hex_reader import HexReader
+
+
+class Port:
+    """Serial port or pty in raw mode, read() returns what came in timeout
+
+    POSIX only, open_port() uses pyserial instead where it is installed
+    """
+    def __init__(self, path, timeout=0.1):
+        import tty
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        if os.isatty(self.fd):
+            tty.setraw(self.fd)
+        self.timeout = timeout
+
+    def read(self, n):
+        import select
+        (ready, _, _) = select.select([self.fd], [], [], self.timeout)
+        return os.read(self.fd, n) if ready else b""
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view):
+            view = view[os.write(self.fd, view):]
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_port(path, timeout=0.1):
+    """pyserial port if it is installed, e.g. on Windows, else Port"""
+    try:
+        import serial
+    except ImportError:
+        return Port(path, timeout)
+    return serial.Serial(path, timeout=timeout)
+
+
+def load_image(path):
+    """(reader, end address, sparse) of an image file"""
+    name = path.lower()
+    opener = gzip.open if name.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        data = f.read()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".hex"):
+        reader = HexReader(io.BytesIO(data))
+        return (reader, reader.end, True)
+    return (io.BytesIO(data), len(data), False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("port", help="data channel of the board, e.g. /dev/ttyACM1")
+    parser.add_argument("image", help="*.hex, *.bin, *.hex.gz or *.bin.gz")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="seconds to wait for the board to answer")
+    args = parser.parse_args()
+
+    (reader, end, sparse) = load_image(args.image)
+    port = open_port(args.port)
+
+    def progress(done, total):
+        print("\rSent %d of %d bytes" % (done, total), end="", flush=True)
+
+    try:
+        ok = send_image(port, reader, end, sparse=sparse, timeout=args.timeout,
+                        progress=progress)
+    except StreamError as e:
+        print("\n%s" % e)
+        ok = False
+    finally:
+        port.close()
+    print("\nFlashed and verified" if ok else "\nFailed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
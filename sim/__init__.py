@@ -0,0 +1,74 @@
+"""Host-side emulator for running the flasher without a board
+
+    import sim
+    target = sim.install(fs_root="/tmp/cc")      # CC2531 on GP27/28/29
+    import cc25xx_proto
+    cc25xx_proto.debug_init()
+
+`install()` puts stand-ins for rp2pio, board, storage, microcontroller,
+supervisor and memorymap on sys.path, resets the simulated world and
+attaches targets.
+With `virtual_time` the time module's sleep/monotonic follow the simulated
+clock, so erase waits and timings reflect PIO cycles instead of host speed.
+"""
+
+import os
+import sys
+import time as _time
+
+from . import world as _world
+from .cc253x import CC253x, CHIPS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.environ.get("CC25XX_REPO", os.path.dirname(HERE))
+MODULES = os.path.join(HERE, "modules")
+
+DEVICE_MODULES = ("rp2pio", "board", "storage", "microcontroller", "supervisor", "memorymap")
+
+_real_time = (_time.sleep, _time.monotonic, _time.monotonic_ns)
+
+
+def _virtual_sleep(seconds):
+    _world.world.clock.advance(seconds)
+    for target in _world.world.targets:
+        target.sync()
+
+
+def install(fs_root=None, targets=None, *, virtual_time=True):
+    """Prepare a fresh simulated board and return the first target"""
+    for path in (os.path.join(REPO, "lib"), REPO, MODULES):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    for name in list(sys.modules):
+        if name in DEVICE_MODULES or name.startswith("cc25xx_") or name in ("hex_reader",):
+            del sys.modules[name]
+
+    w = _world.reset()
+    if targets is None:
+        targets = [CC253x()]
+    for t in targets:
+        w.attach(t)
+
+    import storage
+    if fs_root is None:
+        import tempfile
+        fs_root = tempfile.mkdtemp(prefix="cc25xx_fs_")
+    os.makedirs(fs_root, exist_ok=True)
+    storage.mount_root(fs_root)
+
+    if virtual_time:
+        _time.sleep = _virtual_sleep
+        _time.monotonic = w.clock.monotonic
+        _time.monotonic_ns = lambda: w.clock.ns
+    else:
+        uninstall_time()
+    return targets[0] if targets else None
+
+
+def uninstall_time():
+    _time.sleep, _time.monotonic, _time.monotonic_ns = _real_time
+
+
+def current():
+    return _world.world
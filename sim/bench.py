@@ -0,0 +1,193 @@
+"""Link traffic and projected time of the flasher's operations
+
+    python3 -m sim.bench [--frequency HZ] [--write-frequency HZ]
+                         [--host-call-ns NS] [--out FILE]
+
+Each operation runs on a fresh simulated CC2531. For each one the harness
+reports:
+  commands     debug commands the target received
+  fifo_words   words moved through the state machine FIFOs, both directions
+  dc_clocks    DC clock cycles (one per DD bit)
+  host_calls   rp2pio calls and property reads of the flasher
+  time_s       virtual time, i.e. PIO cycles plus flash/erase durations
+               plus host_call_ns for every rp2pio call
+
+The output is one JSON document. Keep it per commit and compare the numbers.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+
+from . import install, current, HERE
+
+FLASH_SIZE = 256 * 1024
+PAGE = 2048
+
+
+def _image(seed, size=FLASH_SIZE):
+    rnd = random.Random(seed)
+    data = bytearray(rnd.getrandbits(8) for _ in range(size))
+    if size == FLASH_SIZE:
+        # Lock bit of the last byte clear would lock debugging
+        data[-1] |= 0x80
+    return bytes(data)
+
+
+class Bench:
+    def __init__(self, frequency, write_frequency, host_call_ns):
+        self.frequency = frequency
+        self.write_frequency = write_frequency
+        self.host_call_ns = host_call_ns
+        self.results = {}
+
+    def fresh(self, flash=None):
+        """New world with one target, cc25xx modules freshly imported"""
+        self.target = install()
+        self.world = current()
+        self.world.host_call_ns = self.host_call_ns
+        if flash is not None:
+            self.target.flash[:] = flash
+        import storage
+        import cc25xx_proto
+        import cc25xx_ui
+        os.makedirs(os.path.join(storage.root, "cc25xx"), exist_ok=True)
+        # Rates as if calibrated already
+        with open(os.path.join(storage.root, "cc25xx", "link.rates"), "w") as f:
+            f.write("%d %d\n" % (self.frequency, self.write_frequency))
+        cc25xx_proto.set_frequency(self.frequency, self.write_frequency)
+        self.proto = cc25xx_proto
+        self.ui = cc25xx_ui
+        return cc25xx_proto
+
+    def _counters(self):
+        t = self.target.stats
+        w = self.world.stats
+        return (t["commands"], w["words_out"] + w["words_in"], t["dc_clocks"],
+                self.world.clock.ns, w["host_calls"])
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        before = self._counters()
+        record = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield record
+        after = self._counters()
+        record.update({
+            "commands": after[0] - before[0],
+            "fifo_words": after[1] - before[1],
+            "dc_clocks": after[2] - before[2],
+            "host_calls": after[4] - before[4],
+            "time_s": round((after[3] - before[3]) / 1e9, 6),
+        })
+        if self.target.errors:
+            record["target_errors"] = self.target.errors[:5]
+        self.results[name] = record
+
+    # --- operations ----------------------------------------------------------
+    def init(self):
+        p = self.fresh()
+        with self.measure("init") as r:
+            r["ok"] = p.debug_init()[1] is not None
+
+    def read_2k(self):
+        image = _image(1)
+        p = self.fresh(image)
+        with contextlib.redirect_stdout(io.StringIO()):
+            p.debug_init()
+        buf = bytearray(PAGE)
+        with self.measure("read_2k") as r:
+            p.read_flash_memory_block(0x8000 + PAGE, buf)
+        r["ok"] = buf == image[0x8000 + PAGE:0x8000 + 2 * PAGE]
+
+    def write(self, size):
+        data = _image(2, size)
+        p = self.fresh()
+        with contextlib.redirect_stdout(io.StringIO()):
+            p.debug_init()
+            p.prepare_for_writing(chip_erase=False)
+        address = 0x10000
+        with self.measure("write_%d" % size) as r:
+            p.write_flash_memory_block(address, bytearray(data))
+            p.flash_wait()
+        r["ok"] = bytes(self.target.flash[address:address + size]) == data
+
+    def chip_erase(self):
+        p = self.fresh(_image(3))
+        with contextlib.redirect_stdout(io.StringIO()):
+            p.debug_init()
+        with self.measure("chip_erase") as r:
+            p.prepare_for_writing(chip_erase=True)
+        r["ok"] = self.target.flash == b"\xff" * FLASH_SIZE
+
+    def dump(self):
+        image = _image(4)
+        self.fresh(image)
+        f = io.BytesIO()
+        with self.measure("dump_256k") as r:
+            self.ui.read_flash_to_filedesc(f)
+        r["ok"] = f.getvalue() == image
+
+    def flash(self):
+        image = _image(5)
+        self.fresh()
+        with self.measure("flash_256k") as r:
+            self.ui.write_flash_from_filedesc(io.BytesIO(image), erase="chip")
+        r["ok"] = self.target.flash == image
+
+    def run(self):
+        self.init()
+        self.read_2k()
+        self.write(512)
+        self.write(2048)
+        self.chip_erase()
+        self.dump()
+        self.flash()
+        return self.results
+
+
+def _revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"],
+                              cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frequency", type=int, default=25_000_000,
+                        help="pio_frequency, Hz")
+    parser.add_argument("--write-frequency", type=int, default=None,
+                        help="write_frequency, Hz (default: same)")
+    # CircuitPython on the RP2040 takes some tens of microseconds per call
+    parser.add_argument("--host-call-ns", type=int, default=20_000,
+                        help="Python cost of one rp2pio call, ns")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    bench = Bench(args.frequency, args.write_frequency or args.frequency,
+                  args.host_call_ns)
+    report = {
+        "revision": _revision(),
+        "frequency": bench.frequency,
+        "write_frequency": bench.write_frequency,
+        "host_call_ns": bench.host_call_ns,
+        "results": bench.run(),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if all(r.get("ok") for r in report["results"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,631 @@
+"""Simulated CC253x/CC254x debug target
+
+Bit-level model of the two-wire debug interface (DD/DC/RESET_N) wired to a
+small 8051 core with the XDATA map, DMA controller, flash controller and
+CRC16 unit that the flasher relies on.
+"""
+
+# Flash controller timings (CC2530 datasheet)
+WORD_WRITE_NS = 20_000
+PAGE_ERASE_NS = 20_000_000
+CHIP_ERASE_NS = 200_000_000
+XOSC_SETTLE_NS = 100_000
+
+# XDATA registers
+XREG_DBGDATA = 0x6260
+XREG_FCTL = 0x6270
+XREG_FADDRL = 0x6271
+XREG_FADDRH = 0x6272
+XREG_FWDATA = 0x6273
+XREG_CHIPINFO0 = 0x6276
+XREG_CHIPINFO1 = 0x6277
+XREG_CHIPID = 0x624A
+
+# SFRs (also mirrored into XDATA at 0x7000 + address)
+SFR_SP = 0x81
+SFR_DPL = 0x82
+SFR_DPH = 0x83
+SFR_CLKCONSTA = 0x9E
+SFR_FMAP = 0x9F
+SFR_RNDL = 0xBC
+SFR_RNDH = 0xBD
+SFR_CLKCONCMD = 0xC6
+SFR_MEMCTR = 0xC7
+SFR_PSW = 0xD0
+SFR_DMAIRQ = 0xD1
+SFR_DMA1CFGL = 0xD2
+SFR_DMA1CFGH = 0xD3
+SFR_DMA0CFGL = 0xD4
+SFR_DMA0CFGH = 0xD5
+SFR_DMAARM = 0xD6
+SFR_DMAREQ = 0xD7
+SFR_ACC = 0xE0
+SFR_B = 0xF0
+
+TRIG_NONE = 0
+TRIG_FLASH = 18
+TRIG_DBG_BW = 31
+
+STATUS_CHIP_ERASE_BUSY = 0x80
+STATUS_CPU_HALTED = 0x20
+STATUS_DEBUG_LOCKED = 0x04
+STATUS_OSC_STABLE = 0x02
+
+CHIPS = {
+    # name: chip id, flash size, sram size, page size, usb
+    "CC2530F256": (0xA5, 256 * 1024, 8 * 1024, 2048, False),
+    "CC2530F128": (0xA5, 128 * 1024, 8 * 1024, 2048, False),
+    "CC2530F64": (0xA5, 64 * 1024, 8 * 1024, 2048, False),
+    "CC2530F32": (0xA5, 32 * 1024, 8 * 1024, 2048, False),
+    "CC2531F256": (0xB5, 256 * 1024, 8 * 1024, 2048, True),
+    "CC2531F128": (0xB5, 128 * 1024, 8 * 1024, 2048, True),
+    "CC2533F96": (0x95, 96 * 1024, 6 * 1024, 1024, False),
+    "CC2540F256": (0x8D, 256 * 1024, 8 * 1024, 2048, True),
+    "CC2541F256": (0x41, 256 * 1024, 8 * 1024, 2048, False),
+    "CC2543": (0x43, 32 * 1024, 1024, 1024, False),
+    "CC2544": (0x44, 32 * 1024, 2 * 1024, 1024, True),
+    "CC2545": (0x45, 32 * 1024, 1024, 1024, False),
+}
+
+
+def crc16_step(crc, byte):
+    """CRC16 unit (RNDH write): polynomial 0x8005, MSB first"""
+    crc ^= byte << 8
+    for _ in range(8):
+        crc = ((crc << 1) ^ 0x8005) if crc & 0x8000 else (crc << 1)
+    return crc & 0xffff
+
+
+class DMAChannel:
+    def __init__(self, n):
+        self.n = n
+        self.armed = False
+        self.desc = None
+        self.count = 0
+
+    def load(self, mem):
+        d = mem
+        self.src = (d[0] << 8) | d[1]
+        self.dst = (d[2] << 8) | d[3]
+        self.vlen = d[4] >> 5
+        self.len = ((d[4] & 0x1f) << 8) | d[5]
+        self.wordsize = d[6] >> 7
+        self.tmode = (d[6] >> 5) & 3
+        self.trig = d[6] & 0x1f
+        self.srcinc = d[7] >> 6
+        self.dstinc = (d[7] >> 4) & 3
+        self.count = 0
+        self.armed = True
+
+
+class CC253x:
+    def __init__(self, model="CC2531F256", *, pins=(27, 28, 29), rev=0x24,
+                 flash=None, instr_latency_ns=0, read_delay_ns=0, write_setup_ns=0):
+        (self.chip_id, self.flash_size, self.sram_size, self.page_size,
+         self.usb) = CHIPS[model]
+        self.model = model
+        self.rev = rev
+        self.pin_dd, self.pin_dc, self.pin_rst = pins
+        self.flash = bytearray(b"\xff" * self.flash_size)
+        if flash is not None:
+            self.flash[:len(flash)] = flash
+        self.instr_latency_ns = instr_latency_ns
+        # Link timing: DD output is valid this long after rising DC edge,
+        # host data on DD must be stable this long before falling DC edge
+        self.read_delay_ns = read_delay_ns
+        self.write_setup_ns = write_setup_ns
+        self._dd = 1
+        self._dd_prev = 1
+        self._dd_ns = 0
+        self.world = None
+        self.connected = True
+        self.stats = {"commands": 0, "debug_instr": 0, "burst_bytes": 0,
+                      "page_erases": 0, "chip_erases": 0, "words_written": 0,
+                      "double_writes": 0, "errors": 0, "dc_clocks": 0}
+        self.errors = []
+        self.power_on()
+
+    # --- wiring ------------------------------------------------------------
+    def connect(self, world):
+        self.world = world
+        world.gpio.listeners.append(self._on_pins)
+        self._dc = world.gpio.host_level(self.pin_dc)
+        self._rst = world.gpio.host_level(self.pin_rst)
+
+    def detach(self):
+        """Unplug the target: it stops reacting to the debug lines"""
+        self.connected = False
+        self._release()
+
+    def attach(self):
+        self.connected = True
+        self.power_on()
+
+    @property
+    def now(self):
+        return self.world.clock.ns
+
+    def error(self, msg):
+        self.stats["errors"] += 1
+        self.errors.append(msg)
+
+    # --- reset / power -----------------------------------------------------
+    def power_on(self):
+        self.debug = False
+        self.dc_edges = 0
+        self.locked = not (self.flash[-1] & 0x80)
+        self._reset_core()
+        self._proto_reset()
+
+    def _reset_core(self):
+        self.a = 0
+        self.dptr = 0
+        self.iram = bytearray(256)
+        self.sram = bytearray(self.sram_size)
+        self.sfr = bytearray(128)
+        self.sfr[SFR_SP - 0x80] = 7
+        self.sfr[SFR_CLKCONSTA - 0x80] = 0xC9
+        self.sfr[SFR_CLKCONCMD - 0x80] = 0xC9
+        self.clk_settle = 0
+        self.fctl = 0
+        self.faddr = 0
+        self.fwbuf = []
+        self.flash_op = None        # ("erase", end, page) or ("write", ...)
+        self.word_end = None
+        self.word_data = None
+        self.chip_erase_end = 0
+        self.dbgdata = 0
+        self.dbg_config = 0x04
+        self.crc = 0
+        self.dma = [DMAChannel(i) for i in range(5)]
+
+    def _proto_reset(self):
+        self.state = "cmd"
+        self.in_byte = 0
+        self.in_bits = 0
+        self.cmd = []
+        self.cmd_len = None
+        self.burst_left = 0
+        self.out = []
+        self.out_bits = 0
+        self.ready = False
+        self.dummy = 0
+        self._release()
+
+    def _drive(self, level):
+        gpio = self.world.gpio
+        if self.read_delay_ns:
+            old = gpio.drive.get(self.pin_dd, 1)
+            gpio.settle[self.pin_dd] = (old, gpio.stamp + self.read_delay_ns)
+        gpio.drive[self.pin_dd] = level
+
+    def _release(self):
+        if self.world:
+            self.world.gpio.drive.pop(self.pin_dd, None)
+
+    # --- debug interface bit level -----------------------------------------
+    def _on_pins(self, gpio):
+        if not self.connected:
+            return
+        dc = gpio.host_level(self.pin_dc)
+        rst = gpio.host_level(self.pin_rst)
+        dd = gpio.host_level(self.pin_dd)
+        if dd != self._dd:
+            (self._dd_prev, self._dd, self._dd_ns) = (self._dd, dd, gpio.stamp)
+        if rst != self._rst:
+            self._rst = rst
+            if not rst:
+                self.debug = False
+                self.dc_edges = 0
+                self._proto_reset()
+            else:
+                self.locked = not (self.flash[-1] & 0x80)
+                self._reset_core()
+                self._proto_reset()
+                self.debug = self.dc_edges == 2
+        if dc != self._dc:
+            self._dc = dc
+            if dc:
+                self.stats["dc_clocks"] += 1
+            if not rst:
+                if not dc:
+                    self.dc_edges += 1
+            elif self.debug:
+                if dc:
+                    self._rising()
+                else:
+                    self._falling(gpio)
+
+    def _rising(self):
+        if self.state == "out":
+            byte = self.out[0]
+            bit = (byte >> (7 - self.out_bits)) & 1
+            self._drive(bit)
+
+    def _falling(self, gpio):
+        if self.state in ("cmd", "burst"):
+            if self.pin_dd in gpio.drive:
+                self.error("host clocks data while target drives DD")
+            bit = gpio.host_level(self.pin_dd)
+            if gpio.stamp - self._dd_ns < self.write_setup_ns:
+                bit = self._dd_prev
+            self.in_byte = (self.in_byte << 1) | bit
+            self.in_bits += 1
+            if self.in_bits == 8:
+                byte = self.in_byte
+                self.in_byte = 0
+                self.in_bits = 0
+                if self.state == "cmd":
+                    self._cmd_byte(byte)
+                else:
+                    self._burst_byte(byte)
+        elif self.state == "wait":
+            self.dummy += 1
+            if self.dummy == 8:
+                self.dummy = 0
+                self._check_ready()
+        elif self.state == "out":
+            self.out_bits += 1
+            if self.out_bits == 8:
+                self.out_bits = 0
+                self.out.pop(0)
+                if not self.out:
+                    self.state = "cmd"
+                    self._release()
+
+    def _check_ready(self):
+        self.sync()
+        if self.now >= self.ready_at:
+            self.ready = True
+            self.state = "out"
+            self._drive(0)
+        else:
+            self._release()
+
+    def _respond(self, data, latency=0):
+        self.out = list(data)
+        self.out_bits = 0
+        self.state = "wait"
+        self.dummy = 0
+        self.ready_at = self.now + latency
+        self._check_ready()
+
+    def _cmd_byte(self, byte):
+        self.cmd.append(byte)
+        b0 = self.cmd[0]
+        if len(self.cmd) == 1:
+            if b0 & 0x80:
+                self.cmd_len = 2
+            else:
+                self.cmd_len = 1 + (b0 & 3)
+        if len(self.cmd) < self.cmd_len:
+            return
+        cmd = self.cmd
+        self.cmd = []
+        self.stats["commands"] += 1
+        self.sync()
+        if b0 & 0x80:
+            # 11-bit length, 0 means 2048
+            self.burst_left = (((b0 & 0x07) << 8) | cmd[1]) or 2048
+            self.state = "burst"
+            return
+        op = b0 & 0xfc
+        if op == 0x10:      # CHIP_ERASE
+            self.stats["chip_erases"] += 1
+            self.chip_erase_end = self.now + CHIP_ERASE_NS
+            self._respond([self._status()])
+        elif op == 0x18:    # WR_CONFIG
+            self.dbg_config = cmd[1]
+            self._respond([self._status()])
+        elif op == 0x20:    # RD_CONFIG
+            self._respond([self.dbg_config])
+        elif op == 0x28:    # GET_PC
+            self._respond([0, 0])
+        elif op == 0x30:    # READ_STATUS
+            self._respond([self._status()])
+        elif op in (0x40, 0x44):    # HALT
+            self._respond([self._status()])
+        elif op in (0x48, 0x4C):    # RESUME
+            self._respond([self._status()])
+        elif op == 0x54:    # DEBUG_INSTR
+            self.stats["debug_instr"] += 1
+            if self.locked:
+                self._respond([0])
+            else:
+                self._exec(cmd[1:])
+                self._respond([self.a], self.instr_latency_ns)
+        elif op == 0x68:    # GET_CHIP_ID
+            self._respond([self.chip_id, self.rev])
+        else:
+            self.error("unknown debug command %02X" % b0)
+            self._respond([0])
+
+    def _burst_byte(self, byte):
+        self.stats["burst_bytes"] += 1
+        if not self.locked:
+            self.dbgdata = byte
+            self._trigger(TRIG_DBG_BW)
+        self.burst_left -= 1
+        if self.burst_left == 0:
+            self._respond([self._status()])
+
+    def _status(self):
+        self.sync()
+        s = STATUS_CPU_HALTED
+        if self.now < self.chip_erase_end:
+            s |= STATUS_CHIP_ERASE_BUSY
+        if self.locked:
+            s |= STATUS_DEBUG_LOCKED
+        if self.sfr[SFR_CLKCONSTA - 0x80] & 0x40 == 0:
+            s |= STATUS_OSC_STABLE
+        return s
+
+    # --- time driven peripherals ---------------------------------------------
+    def sync(self):
+        now = self.now
+        if self.chip_erase_end and now >= self.chip_erase_end:
+            self.chip_erase_end = 0
+            self.flash[:] = b"\xff" * self.flash_size
+            self.locked = False
+        if self.clk_settle and now >= self.clk_settle:
+            self.clk_settle = 0
+            self.sfr[SFR_CLKCONSTA - 0x80] = self.sfr[SFR_CLKCONCMD - 0x80]
+        op = self.flash_op
+        if op is None:
+            return
+        if op[0] == "erase":
+            if now >= op[1]:
+                start = op[2] * self.page_size
+                self.flash[start:start + self.page_size] = b"\xff" * self.page_size
+                self.flash_op = None
+                self.fctl &= ~0x81
+            return
+        # write sequence: program words while data keeps coming
+        while True:
+            if self.word_end is None:
+                self._feed_flash()
+                if len(self.fwbuf) < 4:
+                    self.flash_op = None
+                    self.fctl &= ~0xC2
+                    return
+                self.word_data = self.fwbuf[:4]
+                del self.fwbuf[:4]
+                self.word_end = op[1] + WORD_WRITE_NS
+                self._feed_flash()
+            if self.word_end > now:
+                return
+            addr = (self.faddr * 4) % self.flash_size
+            for i in range(4):
+                old = self.flash[addr + i]
+                if old & self.word_data[i] != self.word_data[i]:
+                    self.stats["double_writes"] += 1
+                self.flash[addr + i] = old & self.word_data[i]
+            self.stats["words_written"] += 1
+            self.faddr = (self.faddr + 1) & 0xffff
+            op[1] = self.word_end
+            self.word_end = None
+
+    def _feed_flash(self):
+        # flash controller raises the FLASH DMA trigger while it has room
+        while len(self.fwbuf) < 4:
+            before = len(self.fwbuf)
+            self._trigger(TRIG_FLASH)
+            if len(self.fwbuf) == before:
+                break
+
+    # --- DMA -----------------------------------------------------------------
+    def _desc_addr(self, n):
+        if n == 0:
+            return (self.sfr[SFR_DMA0CFGH - 0x80] << 8) | self.sfr[SFR_DMA0CFGL - 0x80]
+        base = (self.sfr[SFR_DMA1CFGH - 0x80] << 8) | self.sfr[SFR_DMA1CFGL - 0x80]
+        return base + 8 * (n - 1)
+
+    def _arm(self, value):
+        if value & 0x80:
+            for ch in self.dma:
+                if value & (1 << ch.n):
+                    ch.armed = False
+            return
+        for ch in self.dma:
+            bit = value & (1 << ch.n)
+            if bit and not ch.armed:
+                addr = self._desc_addr(ch.n)
+                ch.load([self.xread(addr + i) for i in range(8)])
+            elif not bit:
+                ch.armed = False
+
+    def _trigger(self, trig, only=None):
+        if self.dbg_config & 0x04:
+            return
+        for ch in self.dma:
+            if not ch.armed or ch.trig != trig:
+                continue
+            if only is not None and ch.n != only:
+                continue
+            n = ch.len - ch.count if ch.tmode in (1, 3) else 1
+            for _ in range(n):
+                self._transfer(ch)
+                if not ch.armed:
+                    break
+
+    def _transfer(self, ch):
+        step = {0: 0, 1: 1, 2: 2, 3: -1}
+        size = 2 if ch.wordsize else 1
+        for k in range(size):
+            self.xwrite(ch.dst + k, self.xread(ch.src + k))
+        ch.src = (ch.src + step[ch.srcinc] * size) & 0xffff
+        ch.dst = (ch.dst + step[ch.dstinc] * size) & 0xffff
+        ch.count += 1
+        if ch.count >= ch.len:
+            ch.armed = False
+            self.sfr[SFR_DMAIRQ - 0x80] |= 1 << ch.n
+
+    # --- memory --------------------------------------------------------------
+    def xread(self, addr):
+        addr &= 0xffff
+        if addr >= 0x8000:
+            bank = self.sfr[SFR_MEMCTR - 0x80] & 7
+            off = (bank << 15) + (addr - 0x8000)
+            return self.flash[off % self.flash_size]
+        if addr < self.sram_size:
+            return self.sram[addr]
+        if 0x7080 <= addr < 0x7100:
+            return self.sfr_read(addr - 0x7000)
+        if addr == XREG_FCTL:
+            self.sync()
+            return self.fctl | (0x80 if self.flash_op else 0)
+        if addr == XREG_FADDRL:
+            return self.faddr & 0xff
+        if addr == XREG_FADDRH:
+            return self.faddr >> 8
+        if addr == XREG_DBGDATA:
+            return self.dbgdata
+        if addr == XREG_CHIPID:
+            return self.chip_id
+        if addr == XREG_CHIPINFO0:
+            sizes = {32: 1, 64: 2, 96: 3, 128: 3, 256: 4}
+            return (sizes.get(self.flash_size // 1024, 0) << 4) | (0x08 if self.usb else 0)
+        if addr == XREG_CHIPINFO1:
+            return (self.sram_size // 1024 - 1) & 7
+        return 0
+
+    def xwrite(self, addr, value):
+        addr &= 0xffff
+        value &= 0xff
+        if addr >= 0x8000:
+            self.error("XDATA write into flash window %04X" % addr)
+            return
+        if addr < self.sram_size:
+            self.sram[addr] = value
+        elif 0x7080 <= addr < 0x7100:
+            self.sfr_write(addr - 0x7000, value)
+        elif addr == XREG_FCTL:
+            self.sync()
+            if self.flash_op:
+                self.error("FCTL written while flash controller busy")
+                return
+            self.fctl = value & 0x0c
+            if value & 0x01:
+                page = (self.faddr * 4) // self.page_size
+                self.stats["page_erases"] += 1
+                self.flash_op = ["erase", self.now + PAGE_ERASE_NS, page]
+                self.fctl |= 0x81
+            elif value & 0x02:
+                self.flash_op = ["write", self.now]
+                self.fctl |= 0x82
+                self.word_end = None
+                self.sync()
+        elif addr == XREG_FADDRL:
+            self.faddr = (self.faddr & 0xff00) | value
+        elif addr == XREG_FADDRH:
+            self.faddr = (self.faddr & 0x00ff) | (value << 8)
+        elif addr == XREG_FWDATA:
+            self.fwbuf.append(value)
+        elif addr == XREG_DBGDATA:
+            self.dbgdata = value
+
+    def sfr_read(self, addr):
+        if addr == SFR_ACC:
+            return self.a
+        if addr == SFR_DPL:
+            return self.dptr & 0xff
+        if addr == SFR_DPH:
+            return self.dptr >> 8
+        if addr == SFR_RNDL:
+            return self.crc & 0xff
+        if addr == SFR_RNDH:
+            return self.crc >> 8
+        if addr == SFR_CLKCONSTA:
+            self.sync()
+        if addr == SFR_DMAARM:
+            self.sync()
+            return sum(1 << ch.n for ch in self.dma if ch.armed)
+        return self.sfr[addr - 0x80]
+
+    def sfr_write(self, addr, value):
+        if addr == SFR_ACC:
+            self.a = value
+        elif addr == SFR_DPL:
+            self.dptr = (self.dptr & 0xff00) | value
+        elif addr == SFR_DPH:
+            self.dptr = (self.dptr & 0x00ff) | (value << 8)
+        elif addr == SFR_RNDL:
+            self.crc = ((self.crc << 8) | value) & 0xffff
+        elif addr == SFR_RNDH:
+            self.crc = crc16_step(self.crc, value)
+        elif addr == SFR_DMAARM:
+            self._arm(value)
+        elif addr == SFR_DMAREQ:
+            for ch in self.dma:
+                if value & (1 << ch.n) and ch.armed and ch.trig == TRIG_NONE:
+                    self._trigger(TRIG_NONE, only=ch.n)
+        else:
+            if addr == SFR_CLKCONCMD:
+                self.clk_settle = self.now + XOSC_SETTLE_NS
+            self.sfr[addr - 0x80] = value
+
+    def dread(self, addr):
+        return self.iram[addr] if addr < 0x80 else self.sfr_read(addr)
+
+    def dwrite(self, addr, value):
+        if addr < 0x80:
+            self.iram[addr] = value & 0xff
+        else:
+            self.sfr_write(addr, value & 0xff)
+
+    def code_read(self, addr):
+        addr &= 0xffff
+        if addr < 0x8000:
+            return self.flash[addr]
+        bank = self.sfr[SFR_FMAP - 0x80] & 7
+        return self.flash[((bank << 15) + addr - 0x8000) % self.flash_size]
+
+    # --- 8051 subset ---------------------------------------------------------
+    def _exec(self, code):
+        if not code:
+            return
+        op = code[0]
+        if op == 0x00:                      # NOP
+            pass
+        elif op == 0x04:                    # INC A
+            self.a = (self.a + 1) & 0xff
+        elif op == 0x14:                    # DEC A
+            self.a = (self.a - 1) & 0xff
+        elif op == 0x43:                    # ORL direct,#data
+            self.dwrite(code[1], self.dread(code[1]) | code[2])
+        elif op == 0x53:                    # ANL direct,#data
+            self.dwrite(code[1], self.dread(code[1]) & code[2])
+        elif op == 0x44:                    # ORL A,#data
+            self.a |= code[1]
+        elif op == 0x54:                    # ANL A,#data
+            self.a &= code[1]
+        elif op == 0x74:                    # MOV A,#data
+            self.a = code[1]
+        elif op == 0x75:                    # MOV direct,#data
+            self.dwrite(code[1], code[2])
+        elif 0x78 <= op <= 0x7f:            # MOV Rn,#data
+            self.iram[op & 7] = code[1]
+        elif op == 0x85:                    # MOV direct,direct
+            self.dwrite(code[2], self.dread(code[1]))
+        elif op == 0x90:                    # MOV DPTR,#data16
+            self.dptr = (code[1] << 8) | code[2]
+        elif op == 0x93:                    # MOVC A,@A+DPTR
+            self.a = self.code_read(self.a + self.dptr)
+        elif op == 0xA3:                    # INC DPTR
+            self.dptr = (self.dptr + 1) & 0xffff
+        elif op == 0xE0:                    # MOVX A,@DPTR
+            self.a = self.xread(self.dptr)
+        elif op == 0xE4:                    # CLR A
+            self.a = 0
+        elif op == 0xE5:                    # MOV A,direct
+            self.a = self.dread(code[1])
+        elif 0xE8 <= op <= 0xEF:            # MOV A,Rn
+            self.a = self.iram[op & 7]
+        elif op == 0xF0:                    # MOVX @DPTR,A
+            self.xwrite(self.dptr, self.a)
+        elif op == 0xF5:                    # MOV direct,A
+            self.dwrite(code[1], self.a)
+        elif 0xF8 <= op <= 0xFF:            # MOV Rn,A
+            self.iram[op & 7] = self.a
+        else:
+            self.error("unsupported 8051 opcode %02X" % op)
@@ -0,0 +1,21 @@
+"""Stand-in for CircuitPython's board module (RP2040 GPIO names)"""
+
+
+class Pin:
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return "board.GP%d" % self.id
+
+    def __eq__(self, other):
+        return isinstance(other, Pin) and other.id == self.id
+
+    def __hash__(self):
+        return self.id
+
+
+for _i in range(30):
+    globals()["GP%d" % _i] = Pin(_i)
+
+LED = GP25
@@ -0,0 +1,41 @@
+"""Stand-in for CircuitPython's memorymap: only PIO INPUT_SYNC_BYPASS"""
+
+from sim import world as _world
+
+PIO_BASES = (0x50200000, 0x50300000)
+INPUT_SYNC_BYPASS = 0x038
+# RP2040 atomic register access aliases
+ALIASES = {0x0000: "rw", 0x1000: "xor", 0x2000: "set", 0x3000: "clr"}
+
+
+class AddressRange:
+    def __init__(self, *, start, length):
+        self.start = start
+        self.length = length
+        self.reg = None
+        for (i, base) in enumerate(PIO_BASES):
+            for (offset, op) in ALIASES.items():
+                if start == base + offset + INPUT_SYNC_BYPASS:
+                    self.reg = (i, op)
+        if self.reg is None:
+            raise ValueError("address not emulated")
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        value = _world.world.gpio.sync_bypass[self.reg[0]]
+        return value.to_bytes(4, "little")[index]
+
+    def __setitem__(self, index, data):
+        value = int.from_bytes(bytes(data), "little")
+        bypass = _world.world.gpio.sync_bypass
+        (i, op) = self.reg
+        if op == "rw":
+            bypass[i] = value
+        elif op == "xor":
+            bypass[i] ^= value
+        elif op == "set":
+            bypass[i] |= value
+        else:
+            bypass[i] &= ~value
@@ -0,0 +1,36 @@
+"""Stand-in for CircuitPython's microcontroller module"""
+
+
+class Reset(BaseException):
+    """Raised instead of resetting the board"""
+
+
+class RunMode:
+    NORMAL = "NORMAL"
+    SAFE_MODE = "SAFE_MODE"
+    UF2 = "UF2"
+    BOOTLOADER = "BOOTLOADER"
+
+
+next_run_mode = RunMode.NORMAL
+resets = 0
+
+
+def on_next_reset(run_mode):
+    global next_run_mode
+    next_run_mode = run_mode
+
+
+def reset():
+    global resets
+    resets += 1
+    raise Reset()
+
+
+class pin:
+    """GPIO pins by number, the same objects as in board"""
+
+
+import board as _board
+for _i in range(30):
+    setattr(pin, "GPIO%d" % _i, getattr(_board, "GP%d" % _i))
@@ -0,0 +1,340 @@
+"""Stand-in for CircuitPython's rp2pio running on the PIO interpreter"""
+
+from sim import world as _world
+from sim.pio import StateMachineCore, Stall, FIFO_DEPTH
+
+# Give up on a blocking call after this many cycles without finishing
+STEP_LIMIT = 200_000_000
+
+
+def _pin(p):
+    return None if p is None else p.id
+
+
+def _itemsize(buf):
+    size = getattr(buf, "itemsize", 1)
+    return 4 if size > 4 else size
+
+
+def _swap(value, size):
+    return int.from_bytes(value.to_bytes(size, "little"), "big")
+
+
+class StateMachine:
+    def __init__(self, program, frequency, *, init=None,
+                 first_out_pin=None, out_pin_count=1,
+                 initial_out_pin_state=0, initial_out_pin_direction=0xffffffff,
+                 first_in_pin=None, in_pin_count=1,
+                 pull_in_pin_up=0, pull_in_pin_down=0,
+                 first_set_pin=None, set_pin_count=1,
+                 initial_set_pin_state=0, initial_set_pin_direction=0x1f,
+                 first_sideset_pin=None, sideset_pin_count=1, sideset_enable=False,
+                 initial_sideset_pin_state=0, initial_sideset_pin_direction=0x1f,
+                 jmp_pin=None, exclusive_pin_use=True,
+                 auto_pull=False, pull_threshold=32, out_shift_right=True,
+                 wait_for_txstall=True,
+                 auto_push=False, push_threshold=32, in_shift_right=True,
+                 user_interruptible=True,
+                 wrap_target=0, wrap=-1, offset=-1, **kwargs):
+        w = _world.world
+        self._world = w
+        self._program = list(program)
+        block = None
+        # A block the program is loaded in already comes first, like CircuitPython
+        key = tuple(self._program)
+        blocks = sorted(w.blocks, key=lambda b: key not in b.programs)
+        for b in blocks:
+            if b.can_load(self._program) and b.free_sm() is not None:
+                block = b
+                break
+        if block is None:
+            raise RuntimeError("All state machines in use")
+        self._block = block
+        self._offset = block.load(self._program)
+        self._slot = block.free_sm()
+
+        self.pins = {}
+        gpio = w.gpio
+        if first_in_pin is not None:
+            for i in range(in_pin_count):
+                if pull_in_pin_up & (1 << i) or pull_in_pin_up is True:
+                    gpio.pull[first_in_pin.id + i] = "up"
+        if first_out_pin is not None:
+            for i in range(out_pin_count):
+                gpio.set_out(first_out_pin.id + i, (initial_out_pin_state >> i) & 1)
+                gpio.set_dir(first_out_pin.id + i, (initial_out_pin_direction >> i) & 1)
+        if first_set_pin is not None:
+            for i in range(set_pin_count):
+                gpio.set_out(first_set_pin.id + i, (initial_set_pin_state >> i) & 1)
+                gpio.set_dir(first_set_pin.id + i, (initial_set_pin_direction >> i) & 1)
+        if first_sideset_pin is not None:
+            for i in range(sideset_pin_count):
+                gpio.set_out(first_sideset_pin.id + i, (initial_sideset_pin_state >> i) & 1)
+                gpio.set_dir(first_sideset_pin.id + i, (initial_sideset_pin_direction >> i) & 1)
+        gpio.flush()
+
+        self._core = StateMachineCore(
+            block, self._offset, len(self._program), gpio, w.clock,
+            frequency=frequency,
+            wrap_target=wrap_target, wrap=None if wrap == -1 else wrap,
+            sideset_pin_count=sideset_pin_count if first_sideset_pin else 0,
+            sideset_enable=sideset_enable,
+            first_out_pin=_pin(first_out_pin), out_pin_count=out_pin_count,
+            first_set_pin=_pin(first_set_pin), set_pin_count=set_pin_count,
+            first_in_pin=_pin(first_in_pin), in_pin_count=in_pin_count,
+            first_sideset_pin=_pin(first_sideset_pin),
+            jmp_pin=_pin(jmp_pin),
+            auto_push=auto_push, push_threshold=push_threshold,
+            in_shift_right=in_shift_right,
+            auto_pull=auto_pull, pull_threshold=pull_threshold,
+            out_shift_right=out_shift_right)
+        block.sms[self._slot] = self._core
+        w.machines.append(self)
+        self._in_shift_right = in_shift_right
+        self._background = []       # [buffer, index, swap, loop]
+        self._loop = None
+        self._deinited = False
+        self.stats = {"words_out": 0, "words_in": 0}
+        if init:
+            self.run(init)
+
+    def _count(self, key):
+        self.stats[key] += 1
+        self._world.stats[key] += 1
+
+    # --- execution ---------------------------------------------------------
+    def _pump(self):
+        core = self._core
+        while len(core.tx) < FIFO_DEPTH:
+            if self._background:
+                entry = self._background[0]
+                buf, idx, swap = entry[0], entry[1], entry[2]
+                if idx >= len(buf):
+                    self._background.pop(0)
+                    continue
+                core.tx.append(self._word(buf, idx, swap))
+                self._count("words_out")
+                entry[1] += 1
+            elif self._loop is not None:
+                buf, swap = self._loop
+                self._loop_idx = getattr(self, "_loop_idx", 0) % len(buf)
+                core.tx.append(self._word(buf, self._loop_idx, swap))
+                self._count("words_out")
+                self._loop_idx += 1
+            else:
+                break
+
+    def _word(self, buf, idx, swap):
+        size = _itemsize(buf)
+        value = buf[idx] & ((1 << (8 * size)) - 1)
+        return _swap(value, size) if swap and size > 1 else value
+
+    def _tick(self):
+        """Run one instruction; False when the SM is stalled"""
+        self._pump()
+        core = self._core
+        clock = self._world.clock
+        # Time the host spent elsewhere passed for this SM too
+        if core.ns < clock.ns:
+            core.ns = clock.ns
+        try:
+            core.step()
+            stalled = False
+        except Stall:
+            stalled = True
+        self._world.gpio.flush()
+        # The other SMs run meanwhile
+        for m in self._world.machines:
+            if m is not self:
+                m._catch_up(clock.ns)
+        return not stalled
+
+    def _catch_up(self, until):
+        core = self._core
+        while core.enabled and core.ns < until:
+            self._pump()
+            try:
+                core.step()
+            except Stall:
+                # Waits for the host or the target, until now at least
+                core.ns = until
+            self._world.gpio.flush()
+
+    def _host_delay(self):
+        # Python on the RP2040 is slow: let the SM run while the host "executes"
+        self._world.stats["host_calls"] += 1
+        ns = self._world.host_call_ns
+        if ns:
+            end = self._world.clock.ns + ns
+            while self._world.clock.ns < end:
+                if not self._tick() and not self._background:
+                    self._world.clock.ns = end
+                    break
+
+    def _run_until(self, done, what):
+        idle = 0
+        for _ in range(STEP_LIMIT):
+            if done():
+                return
+            if self._tick():
+                idle = 0
+            else:
+                idle += 1
+                if idle > 100_000 and not self._background and self._loop is None:
+                    raise RuntimeError("PIO deadlock while waiting for " + what)
+        raise RuntimeError("PIO step limit exceeded while waiting for " + what)
+
+    def run(self, instructions):
+        self._host_delay()
+        for instr in instructions:
+            self._core.exec_queue.append(instr)
+            self._run_until(lambda: not self._core.exec_queue, "exec")
+
+    def _put(self, value):
+        self._run_until(lambda: len(self._core.tx) < FIFO_DEPTH, "tx space")
+        self._core.tx.append(value)
+        self._count("words_out")
+
+    def _get(self, buf, idx, swap):
+        self._run_until(lambda: self._core.rx, "rx data")
+        value = self._core.rx.popleft()
+        self._count("words_in")
+        size = _itemsize(buf)
+        if size == 1:
+            value = (value >> 24) if self._in_shift_right else value
+            buf[idx] = value & 0xff
+            return
+        if size == 2:
+            value = (value >> 16) if self._in_shift_right else value
+            value &= 0xffff
+        if swap:
+            value = _swap(value, size)
+        buf[idx] = value
+
+    def write(self, buffer, *, start=0, end=None, swap=False):
+        self._host_delay()
+        end = len(buffer) if end is None else end
+        self._run_until(lambda: not self._background, "background write")
+        for i in range(start, end):
+            self._put(self._word(buffer, i, swap))
+        return True
+
+    def readinto(self, buffer, *, start=0, end=None, swap=False):
+        self._host_delay()
+        end = len(buffer) if end is None else end
+        for i in range(start, end):
+            self._get(buffer, i, swap)
+        return True
+
+    def write_readinto(self, buffer_out, buffer_in, *, out_start=0, out_end=None,
+                       in_start=0, in_end=None, swap_out=False, swap_in=False):
+        self._host_delay()
+        out_end = len(buffer_out) if out_end is None else out_end
+        in_end = len(buffer_in) if in_end is None else in_end
+        self._background.append([memoryview_slice(buffer_out, out_start, out_end), 0, swap_out])
+        for i in range(in_start, in_end):
+            self._get(buffer_in, i, swap_in)
+        self._run_until(lambda: not self._background, "write_readinto output")
+        return True
+
+    def background_write(self, once=None, *, loop=None, loop2=None, swap=False):
+        self._host_delay()
+        # one transfer in flight plus one pending, DMA starts right away
+        self._run_until(lambda: len(self._background) < 2, "background write slot")
+        if once is not None:
+            self._background.append([memoryview_slice(once, 0, len(once)), 0, swap])
+            self._pump()
+        if loop is not None:
+            self._loop = (memoryview_slice(loop, 0, len(loop)), swap)
+            self._loop_idx = 0
+
+    def stop_background_write(self):
+        self._background = []
+        self._loop = None
+
+    def _poll(self, done):
+        # Python polling a property: the SM runs meanwhile
+        self._host_delay()
+        for _ in range(64):
+            if done():
+                return
+            if not self._tick():
+                self._world.clock.ns += 1000
+                for target in self._world.targets:
+                    target.sync()
+
+    @property
+    def writing(self):
+        self._poll(lambda: not self._background)
+        return bool(self._background) or self._loop is not None
+
+    @property
+    def pending(self):
+        return len(self._background)
+
+    def clear_rxfifo(self):
+        self._core.rx.clear()
+        self._core.rxstall = False
+
+    def clear_txstall(self):
+        self._core.txstall = False
+
+    @property
+    def rxstall(self):
+        return self._core.rxstall
+
+    @property
+    def txstall(self):
+        return self._core.txstall
+
+    @property
+    def in_waiting(self):
+        self._poll(lambda: self._core.rx)
+        return len(self._core.rx)
+
+    @property
+    def frequency(self):
+        return self._core.frequency
+
+    @frequency.setter
+    def frequency(self, value):
+        self._core.frequency = value
+
+    def restart(self):
+        self._core.reset_state()
+
+    def stop(self):
+        self._core.enabled = False
+
+    def deinit(self):
+        if self._deinited:
+            return
+        self._deinited = True
+        self._world.machines.remove(self)
+        self._block.sms[self._slot] = None
+        self._block.unload(self._program)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.deinit()
+
+
+class _Slice:
+    """Read-only window into a buffer, keeping its item size"""
+    def __init__(self, buf, start, end):
+        self.buf = buf
+        self.start = start
+        self.end = end
+        self.itemsize = _itemsize(buf)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        return self.buf[self.start + i]
+
+
+def memoryview_slice(buf, start, end):
+    return _Slice(buf, start, end)
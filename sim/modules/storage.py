@@ -0,0 +1,107 @@
+"""Stand-in for CircuitPython's storage module backed by a host directory"""
+
+import io
+import os
+
+root = None
+_mount = None
+usb_drive = True
+
+
+class _File(io.FileIO):
+    """File that takes str and bytes alike, like MicroPython's VFS
+
+    In text mode read() and readline() return str, readinto() works as well.
+    """
+    text = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        return super().write(data)
+
+    def read(self, size=-1):
+        data = super().read(size)
+        return data.decode() if self.text else data
+
+    def readline(self, size=-1):
+        data = super().readline(size)
+        return data.decode() if self.text else data
+
+
+class VfsFat:
+    def __init__(self, path):
+        self.root = path
+        self.readonly = False
+        self.label = "CIRCUITPY"
+
+    def _path(self, path):
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def open(self, path, mode="r"):
+        text = "b" not in mode
+        mode = mode.replace("b", "").replace("t", "")
+        if "+" in mode:
+            raw = "r+" if mode.startswith("r") else mode[0] + "+"
+        else:
+            raw = mode
+        f = _File(self._path(path), raw)
+        f.text = text
+        return f
+
+    def ilistdir(self, path="/"):
+        full = self._path(path)
+        if not os.path.isdir(full):
+            raise OSError(2, "ENOENT")
+        entries = []
+        for name in sorted(os.listdir(full)):
+            p = os.path.join(full, name)
+            kind = 0x4000 if os.path.isdir(p) else 0x8000
+            entries.append((name, kind, 0, 0 if kind == 0x4000 else os.path.getsize(p)))
+        return iter(entries)
+
+    def stat(self, path):
+        try:
+            st = os.stat(self._path(path))
+        except FileNotFoundError:
+            raise OSError(2, "ENOENT")
+        kind = 0x4000 if os.path.isdir(self._path(path)) else 0x8000
+        return (kind, 0, 0, 0, 0, 0, st.st_size, int(st.st_atime), int(st.st_mtime),
+                int(st.st_ctime))
+
+    def mkdir(self, path):
+        os.mkdir(self._path(path))
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except FileNotFoundError:
+            raise OSError(2, "ENOENT")
+
+    def rename(self, old, new):
+        os.replace(self._path(old), self._path(new))
+
+
+def mount_root(path):
+    global root, _mount
+    root = path
+    _mount = VfsFat(path)
+    return _mount
+
+
+def getmount(path):
+    return _mount
+
+
+def remount(path, readonly=False, *, disable_concurrent_write_protection=False):
+    _mount.readonly = readonly
+
+
+def disable_usb_drive():
+    global usb_drive
+    usb_drive = False
+
+
+def enable_usb_drive():
+    global usb_drive
+    usb_drive = True
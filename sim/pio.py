@@ -0,0 +1,420 @@
+"""Instruction level RP2040 PIO interpreter
+
+Executes the 16-bit words produced by adafruit_pioasm, one instruction per
+step, with side-set, delays, wrap, FIFOs, autopush/autopull and stalls.
+Every executed cycle advances the shared virtual clock.
+"""
+
+from collections import deque
+
+# Input synchronizer: 2 system clock cycles at 125 MHz
+SYNC_NS = 16
+
+MASK32 = 0xffff_ffff
+FIFO_DEPTH = 4
+BLOCK_SIZE = 32         # instruction memory words per PIO block
+BLOCK_SMS = 4           # state machines per PIO block
+
+
+class Stall(Exception):
+    pass
+
+
+def bitrev32(v):
+    return int("{:032b}".format(v)[::-1], 2)
+
+
+class PIOBlock:
+    """Instruction memory and IRQ flags shared by up to four state machines"""
+    def __init__(self, index):
+        self.index = index
+        self.programs = {}      # tuple(instructions) -> [offset, refcount]
+        self.used = [False] * BLOCK_SIZE
+        self.memory = [0] * BLOCK_SIZE
+        self.sms = [None] * BLOCK_SMS
+        self.irq = 0
+
+    def can_load(self, program):
+        return tuple(program) in self.programs or self._find_offset(len(program)) is not None
+
+    def _find_offset(self, length):
+        # like pico-sdk: highest free offset first
+        for offset in range(BLOCK_SIZE - length, -1, -1):
+            if not any(self.used[offset:offset + length]):
+                return offset
+        return None
+
+    def load(self, program):
+        key = tuple(program)
+        if key in self.programs:
+            self.programs[key][1] += 1
+            return self.programs[key][0]
+        offset = self._find_offset(len(program))
+        if offset is None:
+            raise RuntimeError("Insufficient PIO instruction memory")
+        for i, instr in enumerate(program):
+            if instr >> 13 == 0:
+                # relocate JMP targets like pio_add_program does
+                instr = (instr & ~0x1f) | ((instr + offset) & 0x1f)
+            self.memory[offset + i] = instr
+            self.used[offset + i] = True
+        self.programs[key] = [offset, 1]
+        return offset
+
+    def unload(self, program):
+        key = tuple(program)
+        entry = self.programs[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            for i in range(len(program)):
+                self.used[entry[0] + i] = False
+                self.memory[entry[0] + i] = 0
+            del self.programs[key]
+
+    def free_sm(self):
+        for i, sm in enumerate(self.sms):
+            if sm is None:
+                return i
+        return None
+
+
+class StateMachineCore:
+    """One PIO state machine executing a relocated program"""
+
+    def __init__(self, block, offset, length, gpio, clock, *,
+                 frequency,
+                 wrap_target=0, wrap=None,
+                 sideset_pin_count=0, sideset_enable=False,
+                 first_out_pin=None, out_pin_count=1,
+                 first_set_pin=None, set_pin_count=1,
+                 first_in_pin=None, in_pin_count=1,
+                 first_sideset_pin=None,
+                 jmp_pin=None,
+                 auto_push=False, push_threshold=32, in_shift_right=True,
+                 auto_pull=False, pull_threshold=32, out_shift_right=True):
+        self.block = block
+        self.offset = offset
+        self.gpio = gpio
+        self.clock = clock
+        self.frequency = frequency
+        self.wrap_target = offset + wrap_target
+        self.wrap = offset + (length - 1 if wrap is None else wrap)
+
+        self.ss_count = sideset_pin_count
+        self.ss_opt = bool(sideset_enable)
+        self.delay_bits = 5 - self.ss_count - (1 if self.ss_opt else 0)
+
+        self.out_base, self.out_count = first_out_pin, out_pin_count
+        self.set_base, self.set_count = first_set_pin, set_pin_count
+        self.in_base, self.in_count = first_in_pin, in_pin_count
+        self.ss_base = first_sideset_pin
+        self.jmp_pin = jmp_pin
+
+        self.auto_push = auto_push
+        self.push_thresh = push_threshold or 32
+        self.in_right = in_shift_right
+        self.auto_pull = auto_pull
+        self.pull_thresh = pull_threshold or 32
+        self.out_right = out_shift_right
+
+        self.tx = deque()
+        self.rx = deque()
+        self.rxstall = False
+        self.txstall = False
+        self.enabled = True
+        self.reset_state()
+
+        self.cycles = 0
+        self.instructions = 0
+        self.ns = clock.ns          # own time, the clock is the latest of all
+
+    def _advance(self, cycles):
+        self.cycles += cycles
+        self.ns += cycles * 1_000_000_000 // self.frequency
+        if self.ns > self.clock.ns:
+            self.clock.ns = self.ns
+
+    def reset_state(self):
+        self.pc = self.offset
+        self.x = 0
+        self.y = 0
+        self.isr = 0
+        self.isr_count = 0
+        self.osr = 0
+        self.osr_count = 32         # empty
+        self.sideset_pending = True
+        self.exec_queue = deque()
+
+    # --- pin helpers ---------------------------------------------------------
+    def _write_pins(self, base, count, value, dirs=False):
+        if base is None:
+            return
+        for i in range(count):
+            bit = (value >> i) & 1
+            if dirs:
+                self.gpio.set_dir(base + i, bit)
+            else:
+                self.gpio.set_out(base + i, bit)
+
+    def _level(self, pin):
+        # Inputs pass the synchronizer unless it is bypassed for the pin
+        bypass = self.gpio.sync_bypass[self.block.index] >> pin & 1
+        return self.gpio.level(pin, 0 if bypass else SYNC_NS)
+
+    def _read_pins(self, count):
+        v = 0
+        base = self.in_base if self.in_base is not None else 0
+        for i in range(count):
+            v |= self._level((base + i) % 30) << i
+        return v
+
+    # --- execution -----------------------------------------------------------
+    def _split(self, instr):
+        field = (instr >> 8) & 0x1f
+        ss = None
+        if self.ss_count:
+            if self.ss_opt:
+                if field & 0x10:
+                    ss = (field >> self.delay_bits) & ((1 << self.ss_count) - 1)
+            else:
+                ss = field >> self.delay_bits
+        delay = field & ((1 << self.delay_bits) - 1)
+        return ss, delay
+
+    def step(self):
+        """Execute one instruction, return cycles taken. Raises Stall"""
+        if self.exec_queue:
+            instr = self.exec_queue[0]
+            forced = True
+        else:
+            instr = self.block.memory[self.pc]
+            forced = False
+        ss, delay = self._split(instr)
+        if ss is not None and self.sideset_pending:
+            self._write_pins(self.ss_base, self.ss_count, ss)
+            self.sideset_pending = False
+        try:
+            jumped = self._execute(instr)
+        except Stall:
+            self._advance(1)
+            raise
+        self.sideset_pending = True
+        if forced:
+            self.exec_queue.popleft()
+        elif not jumped:
+            self.pc = self.wrap_target if self.pc == self.wrap else (self.pc + 1) % BLOCK_SIZE
+        self.instructions += 1
+        self._advance(1 + delay)
+        return 1 + delay
+
+    def _execute(self, instr):
+        op = instr >> 13
+        if op == 0:     # JMP
+            cond = (instr >> 5) & 7
+            addr = instr & 0x1f
+            take = False
+            if cond == 0:
+                take = True
+            elif cond == 1:
+                take = self.x == 0
+            elif cond == 2:
+                take = self.x != 0
+                self.x = (self.x - 1) & MASK32
+            elif cond == 3:
+                take = self.y == 0
+            elif cond == 4:
+                take = self.y != 0
+                self.y = (self.y - 1) & MASK32
+            elif cond == 5:
+                take = self.x != self.y
+            elif cond == 6:
+                take = self._level(self.jmp_pin) == 1
+            elif cond == 7:
+                take = self.osr_count < self.pull_thresh
+            if take:
+                self.pc = addr
+                return True
+            return False
+        elif op == 1:   # WAIT
+            pol = (instr >> 7) & 1
+            src = (instr >> 5) & 3
+            idx = instr & 0x1f
+            if src == 0:
+                lvl = self._level(idx)
+            elif src == 1:
+                lvl = self._level((self.in_base + idx) % 30)
+            elif src == 2:
+                bit = 1 << (idx & 7)
+                lvl = 1 if self.block.irq & bit else 0
+                if pol and lvl:
+                    self.block.irq &= ~bit
+            else:
+                raise RuntimeError("reserved wait source")
+            if lvl != pol:
+                raise Stall()
+            return False
+        elif op == 2:   # IN
+            src = (instr >> 5) & 7
+            n = instr & 0x1f or 32
+            if src == 0:
+                data = self._read_pins(n)
+            elif src == 1:
+                data = self.x
+            elif src == 2:
+                data = self.y
+            elif src == 3:
+                data = 0
+            elif src == 6:
+                data = self.isr
+            elif src == 7:
+                data = self.osr
+            else:
+                raise RuntimeError("reserved in source")
+            data &= (1 << n) - 1
+            if self.auto_push and self.isr_count + n >= self.push_thresh and len(self.rx) >= FIFO_DEPTH:
+                self.rxstall = True
+                raise Stall()
+            if self.in_right:
+                self.isr = ((self.isr >> n) | (data << (32 - n))) & MASK32 if n < 32 else data
+            else:
+                self.isr = ((self.isr << n) | data) & MASK32 if n < 32 else data
+            self.isr_count = min(32, self.isr_count + n)
+            if self.auto_push and self.isr_count >= self.push_thresh:
+                self.rx.append(self.isr)
+                self.isr = 0
+                self.isr_count = 0
+            return False
+        elif op == 3:   # OUT
+            dst = (instr >> 5) & 7
+            n = instr & 0x1f or 32
+            if self.auto_pull and self.osr_count >= self.pull_thresh:
+                if not self.tx:
+                    self.txstall = True
+                    raise Stall()
+                self.osr = self.tx.popleft()
+                self.osr_count = 0
+            if self.out_right:
+                data = self.osr & ((1 << n) - 1)
+                self.osr = self.osr >> n if n < 32 else 0
+            else:
+                data = self.osr >> (32 - n)
+                self.osr = (self.osr << n) & MASK32 if n < 32 else 0
+            self.osr_count = min(32, self.osr_count + n)
+            if dst == 0:
+                self._write_pins(self.out_base, self.out_count, data)
+            elif dst == 1:
+                self.x = data
+            elif dst == 2:
+                self.y = data
+            elif dst == 3:
+                pass
+            elif dst == 4:
+                self._write_pins(self.out_base, self.out_count, data, dirs=True)
+            elif dst == 5:
+                self.pc = data & 0x1f
+                return True
+            elif dst == 6:
+                self.isr = data
+                self.isr_count = n
+            elif dst == 7:
+                self.exec_queue.append(data & 0xffff)
+            return False
+        elif op == 4:   # PUSH / PULL
+            is_pull = (instr >> 7) & 1
+            cond = (instr >> 6) & 1
+            block = (instr >> 5) & 1
+            if not is_pull:
+                if cond and self.isr_count < self.push_thresh:
+                    return False
+                if len(self.rx) >= FIFO_DEPTH:
+                    if block:
+                        self.rxstall = True
+                        raise Stall()
+                else:
+                    self.rx.append(self.isr)
+                self.isr = 0
+                self.isr_count = 0
+            else:
+                if cond and self.osr_count < self.pull_thresh:
+                    return False
+                if not self.tx:
+                    if block:
+                        self.txstall = True
+                        raise Stall()
+                    self.osr = self.x
+                else:
+                    self.osr = self.tx.popleft()
+                self.osr_count = 0
+            return False
+        elif op == 5:   # MOV
+            dst = (instr >> 5) & 7
+            mop = (instr >> 3) & 3
+            src = instr & 7
+            if src == 0:
+                data = self._read_pins(32)
+            elif src == 1:
+                data = self.x
+            elif src == 2:
+                data = self.y
+            elif src == 3:
+                data = 0
+            elif src == 5:
+                data = MASK32 if len(self.tx) < 1 else 0
+            elif src == 6:
+                data = self.isr
+            elif src == 7:
+                data = self.osr
+            else:
+                raise RuntimeError("reserved mov source")
+            if mop == 1:
+                data = ~data & MASK32
+            elif mop == 2:
+                data = bitrev32(data)
+            if dst == 0:
+                self._write_pins(self.out_base, self.out_count, data)
+            elif dst == 1:
+                self.x = data
+            elif dst == 2:
+                self.y = data
+            elif dst == 4:
+                self.exec_queue.append(data & 0xffff)
+            elif dst == 5:
+                self.pc = data & 0x1f
+                return True
+            elif dst == 6:
+                self.isr = data
+                self.isr_count = 0
+            elif dst == 7:
+                self.osr = data
+                self.osr_count = 0
+            return False
+        elif op == 6:   # IRQ
+            clear = (instr >> 6) & 1
+            wait = (instr >> 5) & 1
+            idx = instr & 0x1f
+            if idx & 0x10:
+                idx = (idx & 0x4) | ((idx + self.block.sms.index(self)) & 3) if self in self.block.sms else idx & 7
+            bit = 1 << (idx & 7)
+            if clear:
+                self.block.irq &= ~bit
+            else:
+                if not getattr(self, "_irq_waiting", False):
+                    self.block.irq |= bit
+                    self._irq_waiting = bool(wait)
+                if wait:
+                    if self.block.irq & bit:
+                        raise Stall()
+                    self._irq_waiting = False
+            return False
+        else:           # SET
+            dst = (instr >> 5) & 7
+            data = instr & 0x1f
+            if dst == 0:
+                self._write_pins(self.set_base, self.set_count, data)
+            elif dst == 1:
+                self.x = data
+            elif dst == 2:
+                self.y = data
+            elif dst == 4:
+                self._write_pins(self.set_base, self.set_count, data, dirs=True)
+            return False
@@ -0,0 +1,129 @@
+"""Shared simulation state: virtual clock, GPIO bank and PIO blocks"""
+
+from .pio import PIOBlock
+
+NUM_PINS = 30
+
+
+class Clock:
+    """Virtual time in nanoseconds, advanced by PIO cycles and sleeps"""
+    def __init__(self):
+        self.ns = 0
+
+    def advance_cycles(self, cycles, frequency):
+        self.ns += cycles * 1_000_000_000 // frequency
+
+    def advance(self, seconds):
+        self.ns += int(seconds * 1_000_000_000)
+
+    def monotonic(self):
+        return self.ns / 1_000_000_000
+
+
+class GPIO:
+    """Pin levels resolved from PIO outputs, device drivers and pulls"""
+    def __init__(self):
+        self.out = [0] * NUM_PINS
+        self.dir = [0] * NUM_PINS
+        self.pull = [None] * NUM_PINS     # None, "up" or "down"
+        self.drive = {}                   # pin -> level driven by a device
+        self.listeners = []
+        self.dirty = False
+        self.contention = 0
+        self.clock = None
+        self.stamp = 0                    # ns of the last host pin change
+        self.settle = {}                  # pin -> (old level, ns device output is valid)
+        self.net = {}                     # pin -> pin wired to it
+        self.sync_bypass = [0, 0]         # INPUT_SYNC_BYPASS of PIO0, PIO1
+
+    def tie(self, a, b):
+        """Wire two pins together"""
+        self.net[a] = b
+        self.net[b] = a
+
+    def _pull(self, pin):
+        pull = self.pull[pin]
+        if pull is None and pin in self.net:
+            pull = self.pull[self.net[pin]]
+        return pull
+
+    def _source(self, pin):
+        # The pin of a wired pair that sets the level
+        other = self.net.get(pin)
+        if other is None or self.dir[pin] or pin in self.drive:
+            return pin
+        if self.dir[other] or other in self.drive:
+            return other
+        return pin
+
+    def _changed(self):
+        self.dirty = True
+        if self.clock:
+            self.stamp = self.clock.ns
+
+    def set_out(self, pin, value):
+        if self.out[pin] != value:
+            self.out[pin] = value
+            self._changed()
+
+    def set_dir(self, pin, value):
+        if self.dir[pin] != value:
+            self.dir[pin] = value
+            self._changed()
+
+    def host_level(self, pin):
+        """Level as seen by a device: what the host drives or the pull"""
+        other = self.net.get(pin)
+        if not self.dir[pin] and other is not None and self.dir[other]:
+            pin = other
+        if self.dir[pin]:
+            return self.out[pin]
+        return 0 if self._pull(pin) == "down" else 1
+
+    def level(self, pin, lag=0):
+        """Level as seen by the host, lag ns ago for device outputs"""
+        pull = self._pull(pin)
+        pin = self._source(pin)
+        if pin in self.drive:
+            if self.dir[pin]:
+                self.contention += 1
+                return self.out[pin]
+            if pin in self.settle and self.clock.ns - lag < self.settle[pin][1]:
+                return self.settle[pin][0]
+            return self.drive[pin]
+        if self.dir[pin]:
+            return self.out[pin]
+        return 1 if pull == "up" else 0
+
+    def flush(self):
+        if self.dirty:
+            self.dirty = False
+            for listener in self.listeners:
+                listener(self)
+
+
+class World:
+    def __init__(self):
+        self.clock = Clock()
+        self.gpio = GPIO()
+        self.gpio.clock = self.clock
+        self.blocks = [PIOBlock(0), PIOBlock(1)]
+        self.machines = []          # rp2pio.StateMachine objects alive
+        self.targets = []
+        self.host_call_ns = 0       # simulated Python cost per rp2pio call
+        self.stats = {"words_out": 0, "words_in": 0,    # FIFO words, all SMs
+                      "host_calls": 0}                  # rp2pio calls
+
+    def attach(self, target):
+        self.targets.append(target)
+        target.connect(self)
+        return target
+
+
+world = World()
+
+
+def reset():
+    global world
+    world = World()
+    return world
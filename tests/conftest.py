@@ -0,0 +1,118 @@
+"""Fixtures running the flasher against the emulator in sim/
+
+Every test gets a fresh simulated board: cc25xx modules are imported anew,
+the drive is a temporary directory and time is virtual.
+"""
+
+import contextlib
+import io
+import os
+import random
+import sys
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# code.py of the board shadows the standard library module of that name,
+# which pdb and so pytest need: import the real one first
+_path = sys.path[:]
+sys.path[:] = [p for p in _path if os.path.abspath(p or os.curdir) != REPO]
+import code
+sys.path[:] = _path
+if REPO not in sys.path:
+    sys.path.insert(0, REPO)
+
+import sim
+from sim.cc253x import CC253x
+
+
+def image(seed, size):
+    """Random bytes; a last byte with the lock bit clear would lock the chip"""
+    rnd = random.Random(seed)
+    data = bytearray(rnd.getrandbits(8) for _ in range(size))
+    data[-1] |= 0x80
+    return bytes(data)
+
+
+def intel_hex(chunks):
+    """Intel hex text of {address: data}, 16 bytes a record"""
+    def record(rec_type, addr, data=b""):
+        body = bytes([len(data), addr >> 8, addr & 0xff, rec_type]) + data
+        return ":%s%02X\n" % (body.hex().upper(), -sum(body) & 0xff)
+    lines = []
+    for (address, data) in sorted(chunks.items()):
+        base = None
+        for i in range(0, len(data), 16):
+            a = address + i
+            if a >> 16 != base:
+                base = a >> 16
+                lines.append(record(4, 0, bytes([base >> 8, base & 0xff])))
+            lines.append(record(0, a & 0xffff, data[i:i + 16]))
+    lines.append(record(1, 0))
+    return "".join(lines)
+
+
+class Board:
+    """Simulated board with targets attached, and the flasher modules"""
+    def __init__(self, root, targets, rates):
+        self.root = str(root)
+        self.targets = targets
+        self.target = sim.install(fs_root=self.root, targets=targets)
+        self.world = sim.current()
+        self.workdir = os.path.join(self.root, "cc25xx")
+        os.makedirs(self.workdir, exist_ok=True)
+        import board
+        import cc25xx_proto
+        import cc25xx_ui
+        self.proto = cc25xx_proto
+        self.ui = cc25xx_ui
+        # Targets after the first one are more_targets, on their own pins
+        cc25xx_proto.more_targets = tuple(
+            tuple(getattr(board, "GP%d" % pin) for pin in (t.pin_dd, t.pin_dc, t.pin_rst))
+            for t in targets[1:])
+        if rates:
+            # As if calibrated already
+            self.write("link.rates", "".join(
+                ("%d %d GP%d" % (rates + (t.pin_dd,)) if i else "%d %d" % rates) + "\n"
+                for (i, t) in enumerate(targets)))
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+    def write(self, name, data):
+        with open(self.path(name), "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+
+    def read(self, name):
+        with open(self.path(name), "rb") as f:
+            return f.read()
+
+    def files(self):
+        return sorted(os.listdir(self.workdir))
+
+    @property
+    def seconds(self):
+        return self.world.clock.ns / 1e9
+
+    def quiet(self, func, *args, **kwargs):
+        """func(*args, **kwargs) with its console output kept in self.output"""
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.output = out.getvalue()
+
+
+@pytest.fixture
+def make_board(tmp_path):
+    """make_board(*targets, rates=(read, write)): default is one CC2531F256"""
+    def make(*targets, rates=(25_000_000, 25_000_000)):
+        return Board(tmp_path, list(targets) or [CC253x()], rates)
+    yield make
+    sim.uninstall_time()
+
+
+@pytest.fixture
+def board(make_board):
+    return make_board()
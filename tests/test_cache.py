@@ -0,0 +1,108 @@
+"""Image cache: cc25xx_cache.ImageCache and its upkeep by cc25xx_ui"""
+
+import os
+
+from conftest import image
+
+
+def cache_files(board):
+    return [f for f in board.files() if f.startswith("image.cache")]
+
+
+def build(board, name="fw.bin"):
+    ui = board.ui
+    (reader, args) = ui.open_image(ui.workdir + "/" + name)
+    try:
+        assert board.quiet(reader.use_page_size, 2048)
+    finally:
+        reader.close()
+    return reader
+
+
+def test_fresh_without_reading_the_image(board, monkeypatch):
+    import cc25xx_cache
+    board.write("fw.bin", image(1, 10000))
+    key = build(board).key
+    assert cc25xx_cache.image_key(board.ui.FS, board.ui.workdir + "/fw.bin") == key
+    def no_reading(fs, image):
+        raise AssertionError("image read")
+    monkeypatch.setattr(cc25xx_cache, "image_key", no_reading)
+    assert board.ui.image_cache_fresh()
+    # Nor is it read to use the cache
+    assert build(board).key == key
+
+
+def test_fresh_by_crc_when_time_differs(board):
+    data = image(2, 10000)
+    board.write("fw.bin", data)
+    build(board)
+    path = board.path("fw.bin")
+    mtime = os.stat(path).st_mtime
+    os.utime(path, (mtime + 10, mtime + 10))
+    assert board.ui.image_cache_fresh()
+    # Same size, other content
+    board.write("fw.bin", image(3, 10000))
+    os.utime(path, (mtime + 20, mtime + 20))
+    assert not board.ui.image_cache_fresh()
+    assert board.quiet(board.ui.write_flash)
+    assert "Building image cache" in board.output
+    assert board.target.flash[:10000] == image(3, 10000)
+
+
+def test_size_differs(board):
+    board.write("fw.bin", image(4, 10000))
+    build(board)
+    board.write("fw.bin", image(4, 10001))
+    assert not board.ui.image_cache_fresh()
+
+
+def test_cache_removed_after_write(board):
+    board.write("fw.bin", image(5, 6000))
+    assert board.quiet(board.ui.write_flash)
+    assert cache_files(board) == []
+
+
+def test_cache_of_removed_image(board):
+    ui = board.ui
+    board.write("fw.bin", image(6, 6000))
+    build(board)
+    assert cache_files(board) == ["image.cache.manifest", "image.cache.pages"]
+    assert not ui.stale_image_cache()
+    os.remove(board.path("fw.bin"))
+    assert ui.stale_image_cache()
+    ui.forget_image_cache()
+    assert cache_files(board) == []
+    assert not ui.stale_image_cache()
+
+
+class FullFile:
+    """File that takes this many writes, then fails like a full drive"""
+    def __init__(self, f, writes):
+        self.f = f
+        self.writes = writes
+
+    def write(self, data):
+        if not self.writes:
+            raise OSError(28, "No space left on device")
+        self.writes -= 1
+        return self.f.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+
+def test_build_on_full_drive_writes_from_image(board, monkeypatch):
+    ui = board.ui
+    data = image(7, 20 * 1024)
+    board.write("fw.bin", data)
+    fs_open = ui.FS.open
+    def full_drive(path, mode="r"):
+        f = fs_open(path, mode)
+        return FullFile(f, 4) if path.endswith(".pages") else f
+    monkeypatch.setattr(ui.FS, "open", full_drive)
+    assert board.quiet(ui.write_flash)
+    assert board.target.flash[:len(data)] == data
+    assert cache_files(board) == []
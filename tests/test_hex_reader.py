@@ -0,0 +1,70 @@
+"""Intel hex decoding and its segment index: hex_reader.HexReader"""
+
+import io
+import random
+
+import pytest
+
+from hex_reader import HexReader
+
+from conftest import image, intel_hex
+
+
+def record(rec_type, addr, data=b""):
+    body = bytes([len(data), addr >> 8, addr & 0xff, rec_type]) + data
+    return ":%s%02X\n" % (body.hex().upper(), -sum(body) & 0xff)
+
+
+def reader(text, bufsize=1024):
+    return HexReader(io.BytesIO(text.encode()), bufsize)
+
+
+def read(r, address, size):
+    buf = bytearray(size)
+    r.seek(address)
+    n = r.readinto(buf)
+    return (n, bytes(buf))
+
+
+@pytest.mark.parametrize("bufsize", [64, 1024])
+def test_records_out_of_order(bufsize):
+    data = image(1, 3000)
+    records = [record(0, a, data[a:a + 16]) for a in range(0, len(data), 16)]
+    random.Random(2).shuffle(records)
+    r = reader("".join(records) + record(1, 0), bufsize)
+    assert r.end == len(data)
+    # Pages in any order, each one crosses records of all over the file
+    assert read(r, 2048, 2048) == (952, data[2048:] + b"\xff" * 1096)
+    assert read(r, 0, 2048) == (2048, data[:2048])
+
+
+def test_segment_address_records():
+    data = image(3, 96)
+    # Segment 0x1000 starts at 0x10000; the record at 0xFFF0 of segment
+    # 0x0000 ends right where it does
+    text = (record(0, 0xfff0, data[:16]) +
+            record(2, 0, b"\x10\x00") +
+            record(0, 0x0000, data[16:48]) +
+            record(2, 0, b"\x20\x00") +
+            record(0, 0x0010, data[48:]) +
+            record(1, 0))
+    r = reader(text)
+    assert r.has_data(0xf800, 0x10000)
+    assert not r.has_data(0x10020, 0x20010)
+    assert read(r, 0xfff0, 48) == (48, data[:48])
+    assert read(r, 0x20010, 48) == (48, data[48:])
+    assert r.end == 0x20040
+
+
+def test_linear_address_records():
+    low = image(4, 100)
+    high = image(5, 200)
+    r = reader(intel_hex({0x100: low, 0x3fff0: high}))
+    assert r.end == 0x3fff0 + 200
+    assert not r.has_data(0x800, 0x3f800)
+    # A page across the 64K boundary of the type 04 records
+    (n, page) = read(r, 0x3f800, 2048)
+    assert n == 2048
+    assert page == b"\xff" * 0x7f0 + high[:16]
+    assert read(r, 0x40000, 2048) == (184, high[16:] + b"\xff" * (2048 - 184))
+    assert read(r, 0, 512) == (512, b"\xff" * 0x100 + low + b"\xff" * 156)
@@ -0,0 +1,115 @@
+"""Writes resumed after a reload: cc25xx_ui.WriteJournal"""
+
+import pytest
+
+from sim.cc253x import CC253x
+
+from conftest import image, intel_hex
+
+PAGE = 2048
+
+
+class Reload(Exception):
+    pass
+
+
+def cut_at(board, page):
+    """Break the link when page is programmed, half of its first block in"""
+    p = board.proto
+    write_block = p.write_flash_memory_block
+    def failing(address, view):
+        if address == page * PAGE:
+            write_block(address, view[:len(view) // 2])
+            raise Reload
+        return write_block(address, view)
+    p.write_flash_memory_block = failing
+    def restore():
+        p.write_flash_memory_block = write_block
+        p.abort_sm()
+    return restore
+
+
+def interrupted_write(board, page, write=None):
+    restore = cut_at(board, page)
+    with pytest.raises(Reload):
+        board.quiet(write or board.ui.write_flash)
+    restore()
+    return board.read("write.journal").decode().splitlines()
+
+
+def test_resume_after_reload(board):
+    data = image(1, 64 * 1024)
+    board.write("fw.bin", data)
+    lines = interrupted_write(board, 20)
+    assert len(lines) == 1 + 20
+    assert lines[1] == "0 %04X" % board.proto.crc16(data[:PAGE])
+    erases = board.target.stats["page_erases"]
+    assert board.quiet(board.ui.write_flash)
+    assert "Resuming at page 20" in board.output
+    assert board.target.stats["page_erases"] - erases == 12
+    assert board.target.flash[:len(data)] == data
+    assert "write.journal" not in board.files()
+
+
+def test_changed_page_is_written_again(board):
+    data = image(2, 32 * 1024)
+    board.write("fw.bin", data)
+    interrupted_write(board, 12)
+    board.target.flash[5 * PAGE + 7] ^= 0x01
+    assert board.quiet(board.ui.write_flash)
+    assert "Resuming at page 5" in board.output
+    assert board.target.flash[:len(data)] == data
+
+
+def test_unverified_pages_are_checked(board):
+    ui = board.ui
+    data = image(3, 32 * 1024)
+    board.write("fw.bin", data)
+    def write(verify):
+        (reader, args) = ui.open_image(ui.workdir + "/fw.bin")
+        journal = ui.WriteJournal()
+        ok = False
+        try:
+            ok = ui.write_flash_from_filedesc(reader, verify=verify, journal=journal, **args)
+        finally:
+            reader.close()
+            journal.close(ok)
+        return ok
+    lines = interrupted_write(board, 10, lambda: write(False))
+    assert lines[1:] == ["%d ?" % i for i in range(10)]
+    board.target.flash[4 * PAGE] ^= 0x80
+    assert board.quiet(write, True)
+    assert "Resuming at page 4" in board.output
+    assert board.target.flash[:len(data)] == data
+
+
+def test_untouched_page_with_data_is_not_trusted(make_board):
+    old = image(4, 256 * 1024)
+    board = make_board(CC253x(flash=old))
+    chunks = {0: image(5, 3 * PAGE), 8 * PAGE: image(6, 4 * PAGE)}
+    board.write("fw.hex", intel_hex(chunks))
+    lines = interrupted_write(board, 10)
+    assert lines[4:9] == ["%d -" % i for i in range(3, 8)]
+    # A "-" entry for a page that has data is never trusted
+    lines[2] = "1 -"
+    board.write("write.journal", "\n".join(lines) + "\n")
+    assert board.quiet(board.ui.write_flash)
+    assert "Resuming at page 1" in board.output
+    flash = board.target.flash
+    assert flash[:3 * PAGE] == chunks[0]
+    assert flash[8 * PAGE:12 * PAGE] == chunks[8 * PAGE]
+    assert flash[3 * PAGE:8 * PAGE] == old[3 * PAGE:8 * PAGE]
+
+
+def test_journal_that_can_not_be_written(board, monkeypatch):
+    ui = board.ui
+    data = image(7, 64 * 1024)
+    board.write("fw.bin", data)
+    fs_open = ui.FS.open
+    def no_append(path, mode="r"):
+        if mode == "a":
+            raise OSError(28, "No space left on device")
+        return fs_open(path, mode)
+    monkeypatch.setattr(ui.FS, "open", no_append)
+    assert board.quiet(ui.write_flash)
+    assert board.target.flash[:len(data)] == data
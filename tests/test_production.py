@@ -0,0 +1,51 @@
+"""Production line: stick after stick without resets"""
+
+from conftest import image
+
+
+class LineStopped(Exception):
+    pass
+
+
+def test_stick_pulled_during_write(board):
+    p = board.proto
+    ui = board.ui
+    p.link_timeout = None
+    ui.write_link_timeout = 0.05
+    target = board.target
+    data = image(1, 16 * 1024)
+    board.write("fw.bin", data)
+    board.write("control.production", b"")
+
+    # First stick is pulled at the third page, put back a few polls later
+    pulls = []
+    write_block = p.write_flash_memory_block
+    def pull_once(address, view):
+        if address == 2 * 2048 and not pulls:
+            target.detach()
+            pulls.append(0)
+        return write_block(address, view)
+    p.write_flash_memory_block = pull_once
+    probe = p.probe
+    def line_probe(init=True):
+        if pulls and not target.connected:
+            pulls[0] += 1
+            if pulls[0] == 3:
+                target.attach()
+        found = probe(init)
+        if not init and found and target.flash[:len(data)] == data:
+            # Flashed: stop instead of waiting for it to be removed
+            raise LineStopped
+        return found
+    p.probe = line_probe
+
+    try:
+        board.quiet(ui.production_line)
+    except LineStopped:
+        pass
+    out = board.output
+    assert "Target lost: Debug link timeout" in out
+    assert "Flashed 0, failed 1" in out
+    assert "Flashed 1, failed 1" in out
+    assert pulls == [3]
+    assert p.link_timeout is None
@@ -0,0 +1,144 @@
+"""Debug protocol: cc25xx_proto against the emulated target"""
+
+import pytest
+
+import sim.cc253x
+from sim.cc253x import CC253x
+
+from conftest import image
+
+
+def init(board):
+    return board.quiet(board.proto.debug_init)
+
+
+def test_chip_id_and_info(board):
+    assert init(board) == (0xB5, "CC2531", 0x24)
+    chip = board.proto.chip
+    assert (chip.flash_size, chip.page_size, chip.sram_size) == (256 * 1024, 2048, 8 * 1024)
+    assert not board.proto.debug_locked()
+
+
+def test_chip_info_of_smaller_chip(make_board):
+    board = make_board(CC253x("CC2533F96"))
+    assert init(board)[1] == "CC2533"
+    chip = board.proto.chip
+    assert (chip.flash_size, chip.page_size, chip.banks) == (96 * 1024, 1024, 3)
+
+
+@pytest.mark.parametrize("address", [0, 0x7800, 0x8000 + 2048, 0x3F800])
+def test_read_flash_block(make_board, address):
+    data = image(1, 256 * 1024)
+    board = make_board(CC253x(flash=data))
+    init(board)
+    buf = bytearray(2048)
+    board.proto.read_flash_memory_block(address, buf)
+    assert buf == data[address:address + 2048]
+    # Next block goes on from there, across the bank mapping cache
+    board.proto.read_flash_memory_block(address ^ 0x8000, buf)
+    assert buf == data[address ^ 0x8000:(address ^ 0x8000) + 2048]
+
+
+def test_read_beyond_flash_is_refused(make_board):
+    board = make_board(CC253x("CC2530F32"))
+    init(board)
+    with pytest.raises(ValueError):
+        board.proto.read_flash_memory_block(0x8000, bytearray(16))
+
+
+@pytest.mark.parametrize("size", [512, 2048])
+def test_write_block_and_crc(board, size):
+    p = board.proto
+    init(board)
+    board.quiet(p.prepare_for_writing, chip_erase=False)
+    data = image(2, size)
+    p.write_flash_memory_block(0x10000, bytearray(data))
+    p.flash_wait()
+    assert bytes(board.target.flash[0x10000:0x10000 + size]) == data
+    assert p.read_flash_crc(0x10000, size) == p.crc16(data)
+    assert not board.target.stats["double_writes"]
+    assert not board.target.errors
+
+
+def test_page_erase_keeps_neighbours(make_board):
+    data = image(3, 256 * 1024)
+    board = make_board(CC253x(flash=data))
+    p = board.proto
+    init(board)
+    board.quiet(p.prepare_for_writing, chip_erase=False)
+    p.erase_flash_page(0x1000)
+    p.flash_wait()
+    flash = board.target.flash
+    assert flash[0x1000:0x1800] == b"\xff" * 2048
+    assert flash[0x0800:0x1000] == data[0x0800:0x1000]
+    assert flash[0x1800:0x2000] == data[0x1800:0x2000]
+    assert board.target.stats["page_erases"] == 1
+
+
+def test_chip_erase_unlocks(make_board):
+    data = bytearray(image(4, 256 * 1024))
+    data[-1] &= 0x7f
+    board = make_board(CC253x(flash=data))
+    p = board.proto
+    init(board)
+    assert p.debug_locked()
+    start = board.seconds
+    board.quiet(p.prepare_for_writing, chip_erase=True)
+    # Erase end is polled, not waited for in big steps
+    assert board.seconds - start < sim.cc253x.CHIP_ERASE_NS / 1e9 + 0.05
+    assert not p.debug_locked()
+    assert board.target.flash == b"\xff" * 256 * 1024
+
+
+def test_missing_target(make_board):
+    target = CC253x()
+    board = make_board(target)
+    target.detach()
+    assert board.quiet(board.proto.probe) is None
+    # Without probe() the link gives up after link_timeout
+    board.proto.link_timeout = 0.05
+    with pytest.raises(TimeoutError):
+        board.quiet(board.proto.debug_init)
+
+
+def test_target_pulled_during_read(make_board):
+    target = CC253x()
+    board = make_board(target)
+    p = board.proto
+    p.link_timeout = 0.05
+    init(board)
+    buf = bytearray(2048)
+    p.read_flash_memory_block(0, buf)
+    target.detach()
+    with pytest.raises(TimeoutError):
+        p.read_flash_memory_block(2048, buf)
+
+
+@pytest.mark.parametrize("poll_sm", [True, False])
+def test_busy_timeout(board, monkeypatch, poll_sm):
+    monkeypatch.setattr(sim.cc253x, "PAGE_ERASE_NS", 10_000_000_000)
+    p = board.proto
+    if not poll_sm:
+        # No state machine free for the poll program: polled from Python
+        ensure_sm = p.ensure_sm
+        def no_poll_sm(sm_id, prog, **kwargs):
+            if sm_id == 2:
+                raise RuntimeError("All state machines in use")
+            return ensure_sm(sm_id, prog, **kwargs)
+        monkeypatch.setattr(p, "ensure_sm", no_poll_sm)
+    p.flash_timeout = 0.1
+    init(board)
+    board.quiet(p.prepare_for_writing, chip_erase=False)
+    start = board.seconds
+    with pytest.raises(p.BusyTimeout):
+        p.erase_flash_page(0)
+    # Round count of the poll program is worked out from PIO cycles
+    assert 0.09 <= board.seconds - start < 0.2
+
+
+def test_crc16_matches_target(board):
+    data = image(5, 1000)
+    crc = 0xffff
+    for byte in data:
+        crc = sim.cc253x.crc16_step(crc, byte)
+    assert board.proto.crc16(data) == crc
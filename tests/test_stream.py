@@ -0,0 +1,98 @@
+"""Image streamed over a serial link: send_image.py to the board, on a pty"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from sim.cc253x import CC253x
+
+from conftest import REPO, image, intel_hex
+
+from send_image import Port
+
+
+class PtyEnd(Port):
+    """Board end of the pty"""
+    def __init__(self, fd):
+        self.fd = fd
+        self.timeout = 0.1
+
+
+@pytest.fixture
+def link():
+    """(board end, host command) of a pty, the host end runs send_image.py"""
+    (master, slave) = os.openpty()
+    hosts = []
+    def host(path):
+        p = subprocess.Popen([sys.executable, os.path.join(REPO, "send_image.py"),
+                              os.ttyname(slave), path, "--timeout", "10"],
+                             stdout=subprocess.PIPE, text=True)
+        hosts.append(p)
+        return p
+    yield (PtyEnd(master), host)
+    for p in hosts:
+        p.kill()
+        p.wait()
+    os.close(slave)
+    os.close(master)
+
+
+def drain(port):
+    while port.read(4096):
+        pass
+
+
+def stream(board, port, host, path, lost=False, late=False):
+    proc = host(path)
+    if lost:
+        # Board reloads: what the host sent first is gone
+        time.sleep(0.3)
+        drain(port)
+    elif late:
+        # Board busy for a while: the header was sent a few times meanwhile
+        time.sleep(2.5)
+    ok = board.quiet(board.ui.write_flash_from_stream, port, 5)
+    result = proc.communicate(timeout=30)[0].splitlines()[-1]
+    return (ok, result)
+
+
+@pytest.mark.parametrize("how", ["lost", "late"])
+def test_stream_bin_with_header_resent(board, link, tmp_path, how):
+    (port, host) = link
+    data = image(1, 5000)
+    path = tmp_path / "fw.bin"
+    path.write_bytes(data)
+    (ok, result) = stream(board, port, host, str(path), **{how: True})
+    assert ok
+    assert result == "Flashed and verified"
+    assert board.target.flash[:len(data)] == data
+    assert "Image stream: 5000 bytes" in board.output
+    assert " bytes=5000 " in board.output
+
+
+def test_stream_sparse_hex(make_board, link, tmp_path):
+    old = image(2, 256 * 1024)
+    board = make_board(CC253x(flash=old))
+    (port, host) = link
+    data = image(3, 3000)
+    path = tmp_path / "fw.hex"
+    path.write_text(intel_hex({0x8000: data}))
+    (ok, result) = stream(board, port, host, str(path))
+    assert ok and result == "Flashed and verified"
+    flash = board.target.flash
+    assert flash[0x8000:0x8000 + len(data)] == data
+    assert flash[:0x8000] == old[:0x8000]
+
+
+def test_stream_failure_reported_to_host(board, link, tmp_path):
+    (port, host) = link
+    path = tmp_path / "fw.bin"
+    path.write_bytes(image(4, 4096))
+    board.proto.link_timeout = 0.05
+    board.target.detach()
+    (ok, result) = stream(board, port, host, str(path))
+    assert not ok
+    assert result == "Failed"
@@ -0,0 +1,135 @@
+"""Several targets flashed at once: cc25xx_ui.write_flash_to_targets"""
+
+import sys
+
+import pytest
+
+from sim.cc253x import CC253x
+
+from conftest import image
+
+
+def two_targets(make_board, **kwargs):
+    return make_board(CC253x(), CC253x(pins=(2, 3, 4), **kwargs))
+
+
+def targets_line(board):
+    line = board.read("perf.log").split(b"\n")[-2]
+    return [w for w in line.split() if w.startswith(b"targets_")]
+
+
+def test_write_both(make_board):
+    board = two_targets(make_board)
+    data = image(1, 16 * 1024)
+    board.write("fw.bin", data)
+    assert board.quiet(board.ui.write_flash)
+    for t in board.targets:
+        assert t.flash[:len(data)] == data
+    assert targets_line(board) == [b"targets_ok=2"]
+
+
+def test_target_pulled_during_erase(make_board):
+    # Only the one pulled off is dropped, even with a link waiting forever
+    board = two_targets(make_board)
+    p = board.proto
+    p.link_timeout = None
+    # Waiting for a silent link is slow to emulate
+    board.ui.write_link_timeout = 0.05
+    second = p.sessions()[1]
+    data = image(2, 16 * 1024)
+    board.write("fw.bin", data)
+    erase_page = p.erase_flash_page
+    def pull_second(address, wait=True):
+        if p.active is second and address == 2 * 2048:
+            board.targets[1].detach()
+        return erase_page(address, wait)
+    p.erase_flash_page = pull_second
+    assert not board.quiet(board.ui.write_flash)
+    assert board.targets[0].flash[:len(data)] == data
+    assert p.sessions()[0].error is None
+    assert second.error == "erase failed"
+    assert "GP2: Debug link timeout" in board.output
+    assert "GP2: CC2531 erase failed" in board.output
+    assert p.link_timeout is None
+    assert targets_line(board) == [b"targets_failed=1", b"targets_ok=1"]
+
+
+def test_failed_chip_erase_drops_target(make_board):
+    locked = bytearray(image(3, 256 * 1024))
+    locked[-1] &= 0x7f
+    board = make_board(CC253x(flash=locked), CC253x(pins=(2, 3, 4), flash=locked))
+    p = board.proto
+    second = p.sessions()[1]
+    start_chip_erase = p.start_chip_erase
+    def fail_second():
+        if p.active is second:
+            raise OSError("erase refused")
+        return start_chip_erase()
+    p.start_chip_erase = fail_second
+    data = image(4, 4096)
+    board.write("fw.bin", data)
+    assert not board.quiet(board.ui.write_flash)
+    assert board.targets[0].flash[:len(data)] == data
+    assert second.error == "erase failed"
+    # Nothing more was sent to it
+    assert board.targets[1].flash == locked
+
+
+def test_rates_per_target(make_board):
+    board = make_board(CC253x(), CC253x(pins=(2, 3, 4)), rates=None)
+    board.write("link.rates", "25000000 31250000\n")
+    board.write("fw.bin", image(5, 2048))
+    assert board.quiet(board.ui.write_flash)
+    assert "Calibrating debug clock GP2" in board.output
+    (first, second) = board.proto.sessions()
+    assert (first.state["pio_frequency"], first.state["write_frequency"]) == (25_000_000, 31_250_000)
+    lines = board.read("link.rates").decode().split("\n")
+    assert lines[0] == "25000000 31250000"
+    (read, write, name) = lines[1].split()
+    assert name == "GP2"
+    assert (board.proto.pio_frequency, board.proto.write_frequency) == (int(read), int(write))
+
+
+def test_read_settle_per_target(make_board):
+    board = make_board(CC253x(), CC253x(pins=(2, 3, 4)))
+    p = board.proto
+    # First target reads on a second pin wired to DD, the other one on DD
+    board.world.gpio.tie(26, 27)
+    p.pinDDin = sys.modules["board"].GP26
+    vars(p).update(p.programs_for(1))
+    (first, second) = p.sessions()
+    assert first.state["read_settle"] == 1
+    assert second.state["read_settle"] == 2
+    assert second.state["flash_read_prog"] is not first.state["flash_read_prog"]
+    data = image(6, 8 * 1024)
+    board.write("fw.bin", data)
+    assert board.quiet(board.ui.write_flash)
+    for t in board.targets:
+        assert t.flash[:len(data)] == data
+    # Input synchronizer is bypassed for the DD input pin only
+    assert board.world.gpio.sync_bypass == [1 << 26, 1 << 26]
+
+
+def test_bypass_needs_gpio_pin(board):
+    with pytest.raises(ValueError):
+        board.proto.bypass_input_sync(object())
+
+
+
+def test_five_targets_uncalibrated(make_board):
+    # debug_command of four targets fills one PIO block and the fifth one's the
+    # other: that one is left at the first calibration rate
+    pins = [(2, 3, 4), (6, 7, 8), (10, 11, 12), (14, 15, 16)]
+    board = make_board(CC253x(), *[CC253x(pins=p) for p in pins], rates=None)
+    data = image(7, 4096)
+    board.write("fw.bin", data)
+    assert board.quiet(board.ui.write_flash)
+    for t in board.targets:
+        assert t.flash[:len(data)] == data
+    assert targets_line(board) == [b"targets_ok=5"]
+    assert "No link test: All state machines in use" in board.output
+    p = board.proto
+    fifth = p.sessions()[4]
+    assert fifth.state["pio_frequency"] == p.CALIBRATION_FREQUENCIES[0]
+    names = [line.split()[2:] for line in board.read("link.rates").decode().split("\n") if line]
+    assert names == [[], ["GP10"], ["GP2"], ["GP6"]]
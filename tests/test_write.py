@@ -0,0 +1,234 @@
+"""Reading and writing whole images: cc25xx_ui on the emulated target"""
+
+import gzip
+import io
+import sys
+import types
+
+import pytest
+
+from sim.cc253x import CC253x
+
+from conftest import image, intel_hex
+
+
+def test_read_flash_dump(make_board):
+    data = image(1, 32 * 1024)
+    board = make_board(CC253x("CC2530F32", flash=data))
+    board.quiet(board.ui.check_storage_on_boot)
+    assert board.ui.need_read()
+    board.quiet(board.ui.read_flash)
+    assert board.read("data.read.bin") == data
+    assert board.read("data.read.id") == b"A5 24\n"
+    assert not board.ui.need_read()
+    assert board.read("perf.log").startswith(b"read ok=1")
+
+
+def test_write_bin(board):
+    data = image(2, 20 * 1024)
+    board.write("fw.bin", data)
+    assert board.ui.need_write()
+    assert board.quiet(board.ui.write_flash)
+    flash = board.target.flash
+    assert flash[:len(data)] == data
+    # The rest of the last page is padded, pages after it are kept
+    assert flash[len(data):len(data) + 2048] == b"\xff" * 2048
+    assert "fw.bin" not in board.files()
+    assert not board.target.errors
+    assert board.read("perf.log").split(b"\n")[-2].startswith(b"write ok=1")
+
+
+def perf_counts(board):
+    line = board.read("perf.log").split(b"\n")[-2].decode()
+    return dict(w.split("=") for w in line.split()[1:])
+
+
+@pytest.mark.parametrize("name", ["fw.bin", "fw.hex"])
+def test_bytes_counted_without_padding(board, name):
+    data = image(17, 10340)
+    board.write(name, data if name.endswith(".bin") else intel_hex({0: data}))
+    assert board.quiet(board.ui.write_flash)
+    assert board.target.flash[:len(data)] == data
+    assert perf_counts(board)["bytes"] == "10340"
+
+
+def test_write_gzipped_bin(board):
+    data = image(3, 8 * 1024)
+    board.write("fw.bin.gz", gzip.compress(data))
+    assert board.quiet(board.ui.write_flash)
+    assert board.target.flash[:len(data)] == data
+
+
+def test_write_sparse_hex_keeps_other_pages(make_board):
+    old = image(4, 256 * 1024)
+    board = make_board(CC253x(flash=old))
+    chunks = {0x0000: image(5, 300), 0x1F000: image(6, 2048), 0x3F000: image(7, 100)}
+    board.write("fw.hex", intel_hex(chunks))
+    assert board.quiet(board.ui.write_flash)
+    flash = board.target.flash
+    written = set()
+    for (address, data) in chunks.items():
+        assert flash[address:address + len(data)] == data
+        written.add(address // 2048)
+    # Pages without image data are untouched, the rest of written ones are blank
+    for page in range(128):
+        start = page * 2048
+        if page not in written:
+            assert flash[start:start + 2048] == old[start:start + 2048]
+    assert flash[300:2048] == b"\xff" * (2048 - 300)
+    assert board.target.stats["page_erases"] == len(written)
+    assert board.target.stats["chip_erases"] == 0
+    # Pages without data are not counted, the last one up to its data only
+    assert perf_counts(board)["bytes"] == str(2 * 2048 + 100)
+
+
+def test_write_locked_chip_erases_it(make_board):
+    old = bytearray(image(8, 256 * 1024))
+    old[-1] &= 0x7f
+    board = make_board(CC253x(flash=old))
+    data = image(9, 4096)
+    board.write("fw.hex", intel_hex({0x2000: data}))
+    assert board.quiet(board.ui.write_flash)
+    flash = board.target.flash
+    assert board.target.stats["chip_erases"] == 1
+    assert flash[0x2000:0x3000] == data
+    assert flash[:0x2000] == b"\xff" * 0x2000
+
+
+def test_verify_failure(board, monkeypatch):
+    board.write("fw.bin", image(10, 8 * 1024))
+    monkeypatch.setattr(board.proto, "read_flash_crc", lambda address, length: -1)
+    assert not board.quiet(board.ui.write_flash)
+    assert "Verification failed at 000000" in board.output
+    # Image stays for the next try
+    assert "fw.bin" in board.files()
+    assert board.read("perf.log").split(b"\n")[-2].startswith(b"write ok=0")
+
+
+def test_target_pulled_during_write(board, monkeypatch):
+    p = board.proto
+    p.link_timeout = 0.05
+    board.write("fw.bin", image(11, 16 * 1024))
+    write_block = p.write_flash_memory_block
+    def pull_at_third_page(address, view):
+        if address == 2 * 2048:
+            board.target.detach()
+        return write_block(address, view)
+    monkeypatch.setattr(p, "write_flash_memory_block", pull_at_third_page)
+    with pytest.raises(TimeoutError):
+        board.quiet(board.ui.write_flash)
+    assert "fw.bin" in board.files()
+
+
+def test_write_from_filedesc_full_chip(make_board):
+    # Image as large as the flash gets a chip erase
+    data = image(12, 32 * 1024)
+    board = make_board(CC253x("CC2530F32", flash=image(13, 32 * 1024)))
+    assert board.quiet(board.ui.write_flash_from_filedesc, io.BytesIO(data),
+                       erase="pages", size=len(data))
+    assert board.target.flash == data
+    assert board.target.stats["chip_erases"] == 1
+    assert board.target.stats["page_erases"] == 0
+
+
+def test_gzip_without_deflate_is_left_alone(board, monkeypatch):
+    import cc25xx_inflate
+    monkeypatch.setattr(cc25xx_inflate, "supported", lambda: False)
+    board.write("fw.bin.gz", gzip.compress(image(14, 2048)))
+    assert not board.quiet(board.ui.need_write)
+    assert "fw.bin.gz: no deflate module" in board.output
+    assert not board.quiet(board.ui.write_flash)
+    assert "fw.bin.gz" in board.files()
+    assert not board.target.stats["page_erases"]
+
+
+@pytest.mark.parametrize("fail", ["verify", "pulled"])
+def test_failed_write_forgets_dump(make_board, monkeypatch, fail):
+    board = make_board(CC253x("CC2530F32", flash=image(15, 32 * 1024)))
+    board.quiet(board.ui.check_storage_on_boot)
+    board.quiet(board.ui.read_flash)
+    assert "data.read.id" in board.files()
+    p = board.proto
+    board.write("fw.bin", image(16, 8 * 1024))
+    if fail == "verify":
+        monkeypatch.setattr(p, "read_flash_crc", lambda address, length: -1)
+        assert not board.quiet(board.ui.write_flash)
+    else:
+        p.link_timeout = 0.05
+        write_block = p.write_flash_memory_block
+        def pull(address, view):
+            if address == 2048:
+                board.target.detach()
+            return write_block(address, view)
+        monkeypatch.setattr(p, "write_flash_memory_block", pull)
+        with pytest.raises(TimeoutError):
+            board.quiet(board.ui.write_flash)
+    # No longer trusted for delta writing
+    assert "data.read.id" not in board.files()
+    assert board.ui.open_dump() is None
+
+
+def test_page_changed_behind_the_dump_is_written(make_board):
+    data = image(18, 32 * 1024)
+    board = make_board(CC253x("CC2530F32", flash=data))
+    board.quiet(board.ui.check_storage_on_boot)
+    board.quiet(board.ui.read_flash)
+    # Written meanwhile without the dump following, e.g. by a streamed image
+    board.target.flash[2048:4096] = image(19, 2048)
+    board.write("fw.bin", data[:8 * 1024])
+    assert board.quiet(board.ui.write_flash)
+    assert board.target.flash == data
+    assert perf_counts(board)["pages_written"] == "1"
+
+
+def test_delta_write_against_the_dump(make_board):
+    data = image(20, 32 * 1024)
+    board = make_board(CC253x("CC2530F32", flash=data))
+    board.quiet(board.ui.check_storage_on_boot)
+    board.quiet(board.ui.read_flash)
+    new = bytearray(data[:8 * 1024])
+    new[3000:3100] = image(21, 100)
+    board.write("fw.bin", bytes(new))
+    assert board.quiet(board.ui.write_flash)
+    flash = board.target.flash
+    assert flash == new + data[8 * 1024:]
+    counts = perf_counts(board)
+    assert (counts["pages_written"], counts["pages_skipped"]) == ("1", "3")
+    # Only what was written counts
+    assert counts["bytes"] == "2048"
+    assert board.target.stats["page_erases"] == 1
+    # The dump follows the write and is still trusted
+    assert board.read("data.read.bin") == flash
+    assert "data.read.id" in board.files()
+
+
+def test_read_flash_ranges(board):
+    data = image(22, 256 * 1024)
+    board.target.flash[:] = data
+    board.write("control.read_ranges", "nv\nIEEE\n\n7F00 8100\n100 +20\n")
+    board.quiet(board.ui.read_flash_ranges)
+    end = len(data)
+    assert board.read("data.read.nv.bin") == data[end - 7 * 2048:end - 2048]
+    assert board.read("data.read.ieee.bin") == data[end - 24:end - 16]
+    # Across a 32K bank
+    assert board.read("data.read.007F00-008100.bin") == data[0x7f00:0x8100]
+    assert board.read("data.read.000100-000120.bin") == data[0x100:0x120]
+    assert "control.read_ranges" not in board.files()
+    assert perf_counts(board)["ranges"] == "4"
+
+
+def test_gzip_failing_to_open_is_reported(make_board, monkeypatch):
+    board = make_board(CC253x("CC2530F32", flash=image(23, 32 * 1024)))
+    import cc25xx_inflate
+    board.quiet(board.ui.check_storage_on_boot)
+    board.quiet(board.ui.read_flash)
+    # Found supported, but no decompressor once the image is opened
+    monkeypatch.setattr(cc25xx_inflate, "supported", lambda: True)
+    monkeypatch.setitem(sys.modules, "zlib", types.ModuleType("zlib"))
+    board.write("fw.bin.gz", gzip.compress(image(24, 2048)))
+    assert not board.quiet(board.ui.write_flash)
+    assert "fw.bin.gz: no deflate module" in board.output
+    assert "fw.bin.gz" in board.files()
+    # Nothing was written, the dump is still trusted
+    assert "data.read.id" in board.files()
+    assert not board.target.stats["page_erases"]